@@ -0,0 +1,546 @@
+import argparse
+import contextlib
+import gc
+import importlib.util
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import types
+from functools import cached_property
+import numpy as np
+
+VOCABULARY = (
+    "so the we you know like think that about data model right yeah really "
+    "people going um what it just kind of actually because mean well"
+).split()
+SIZES = (1_000, 10_000, 100_000, 1_000_000)
+
+
+def synthetic_words(
+    num_words,
+    num_speakers=2,
+    turns_per_minute=8,
+    words_per_minute=160,
+    sentence_length=12,
+    seed=0,
+):
+    """
+    Returns whisperx-like word segments, {"text", "start", "end"} in seconds,
+    and the SpeakerTimeline of the speaker turns covering them.
+
+    Words last 60 / words_per_minute seconds on average with short pauses, one
+    in sentence_length ends a sentence, and the speaker changes
+    turns_per_minute times per minute at random instants.
+    """
+    from helpers import SpeakerTimeline
+
+    rng = np.random.default_rng(seed)
+    mean_ms = 60_000 / words_per_minute
+    durations = rng.integers(mean_ms * 0.5, mean_ms * 1.2, num_words)
+    pauses = rng.integers(0, mean_ms * 0.6, num_words)
+    starts = np.cumsum(pauses + durations) - durations
+    ends = starts + durations
+    total_ms = int(ends[-1]) if num_words else 0
+
+    texts = np.array(VOCABULARY, dtype=object)[
+        rng.integers(0, len(VOCABULARY), num_words)
+    ]
+    sentence_ends = rng.random(num_words) < 1 / sentence_length
+    texts[sentence_ends] = texts[sentence_ends] + "."
+    word_segments = [
+        {"text": text, "start": start, "end": end}
+        for text, start, end in zip(
+            texts.tolist(), (starts / 1000).tolist(), (ends / 1000).tolist()
+        )
+    ]
+
+    num_turns = max(1, int(total_ms / 60_000 * turns_per_minute))
+    bounds = np.unique(rng.integers(1, max(total_ms, 2), num_turns - 1))
+    turn_starts = np.concatenate(([0], bounds))
+    turn_ends = np.concatenate((bounds, [total_ms]))
+    # consecutive turns always change speaker
+    steps = rng.integers(1, max(num_speakers, 2), len(turn_starts))
+    steps[0] = 0
+    labels = np.cumsum(steps) % num_speakers
+    return word_segments, SpeakerTimeline(turn_starts, turn_ends, labels)
+
+
+def write_rttm(speaker_ts, path, name="mono_file"):
+    """Writes the turns of a SpeakerTimeline as NeMo does in pred_rttms."""
+    with open(path, "w") as f:
+        for start, end, speaker in speaker_ts:
+            f.write(
+                f"SPEAKER {name} 1   {start / 1000:.3f}   {(end - start) / 1000:.3f} "
+                f"<NA> <NA> speaker_{speaker} <NA> <NA>\n"
+            )
+    return path
+
+
+## Stub model backends ##
+class _MissingBackend(types.ModuleType):
+    """Placeholder for a package that isn't installed, only its import succeeds."""
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        def unavailable(*args, **kwargs):
+            raise RuntimeError(f"{self.__name__}.{name} is stubbed in benchmarks")
+
+        return unavailable
+
+
+def install_stub_backends():
+    """
+    Lets pipeline.py and punctuation.py be imported without the model
+    packages, the ones that are missing are replaced by placeholder modules.
+    Only the stub models below are run, so no model is ever downloaded.
+    """
+    stubbed = []
+    for name in (
+        "torch",
+        "whisper",
+        "julius",
+        "whisperx",
+        "demucs.pretrained",
+        "demucs.apply",
+        "demucs.audio",
+        "nemo.collections.asr.models.msdd_models",
+        "deepmultilingualpunctuation",
+    ):
+        root = name.split(".")[0]
+        if isinstance(sys.modules.get(root), _MissingBackend):
+            pass
+        elif root in sys.modules or importlib.util.find_spec(root) is not None:
+            continue
+        parts = name.split(".")
+        for i in range(1, len(parts) + 1):
+            module_name = ".".join(parts[:i])
+            if module_name not in sys.modules:
+                sys.modules[module_name] = _MissingBackend(module_name)
+        stubbed.append(name)
+
+    torch = sys.modules["torch"]
+    if isinstance(torch, _MissingBackend):
+        torch.cuda = types.SimpleNamespace(
+            is_available=lambda: False, empty_cache=lambda: None
+        )
+        torch.set_num_threads = lambda num_threads: None
+        torch.set_num_interop_threads = lambda num_threads: None
+        torch.no_grad = contextlib.nullcontext
+    return stubbed
+
+
+class StubWhisper:
+    """Returns the synthetic words as Whisper segments of sentence_length words."""
+
+    def __init__(self, word_segments, language="en", segment_words=12):
+        self.word_segments = word_segments
+        self.language = language
+        self.segment_words = segment_words
+
+    def transcribe(self, audio, **kwargs):
+        segments = []
+        for i in range(0, len(self.word_segments), self.segment_words):
+            words = self.word_segments[i : i + self.segment_words]
+            segments.append(
+                {
+                    "start": words[0]["start"],
+                    "end": words[-1]["end"],
+                    "text": " " + " ".join(wrd_dict["text"] for wrd_dict in words),
+                }
+            )
+        return {
+            "language": self.language,
+            "text": "".join(segment["text"] for segment in segments),
+            "segments": segments,
+        }
+
+
+def stub_align(whisper_results, word_segments):
+    """whisperx alignment stand-in, the words lose their punctuation like whisperx's."""
+    return [
+        {**wrd_dict, "text": wrd_dict["text"].rstrip(".")} for wrd_dict in word_segments
+    ]
+
+
+class StubDiarizer:
+    """
+    Stands in for the NeMo NeuralDiarizer passed to pipeline.diarize_many, it
+    reads the manifest and writes the given timeline as the RTTM of every file.
+    """
+
+    def __init__(self, speaker_ts, work_dir):
+        from helpers import create_config
+
+        self.speaker_ts = speaker_ts
+        self._cfg = create_config(work_dir=work_dir)
+
+    def diarize(self):
+        rttm_dir = os.path.join(self._cfg.diarizer.out_dir, "pred_rttms")
+        os.makedirs(rttm_dir, exist_ok=True)
+        with open(self._cfg.diarizer.manifest_filepath) as f:
+            for line in f:
+                audio_path = json.loads(line)["audio_filepath"]
+                name = os.path.splitext(os.path.basename(audio_path))[0]
+                write_rttm(
+                    self.speaker_ts, os.path.join(rttm_dir, f"{name}.rttm"), name
+                )
+
+
+class StubPunctuationModel:
+    """
+    deepmultilingualpunctuation stand-in answering PunctuationModel.pipe, it
+    puts a period after every sentence_length-th word of each window.
+    """
+
+    def __init__(self, sentence_length=12):
+        self.sentence_length = sentence_length
+
+    def pipe(self, texts, batch_size=8):
+        for text in texts:
+            result, end = [], 0
+            for i, word in enumerate(text.split(" ")):
+                end += len(word) + (1 if i else 0)
+                label = (
+                    "." if i % self.sentence_length == self.sentence_length - 1 else "0"
+                )
+                result.append({"entity": label, "score": 0.9, "end": end})
+            yield result
+
+
+## Workloads ##
+class Workload:
+    """Synthetic inputs of one size, built lazily and shared by the benchmarks."""
+
+    def __init__(self, num_words, work_dir, num_speakers=2, turns_per_minute=8, seed=0):
+        self.num_words = num_words
+        self.work_dir = work_dir
+        self.num_speakers = num_speakers
+        self.turns_per_minute = turns_per_minute
+        self.seed = seed
+        os.makedirs(work_dir, exist_ok=True)
+
+    @cached_property
+    def words_and_turns(self):
+        return synthetic_words(
+            self.num_words, self.num_speakers, self.turns_per_minute, seed=self.seed
+        )
+
+    @property
+    def word_segments(self):
+        return self.words_and_turns[0]
+
+    @property
+    def speaker_ts(self):
+        return self.words_and_turns[1]
+
+    @cached_property
+    def words_speaker_mapping(self):
+        from helpers import get_words_speaker_mapping
+
+        return get_words_speaker_mapping(self.word_segments, self.speaker_ts)
+
+    @cached_property
+    def sentences(self):
+        from helpers import get_sentences_speaker_mapping
+
+        return get_sentences_speaker_mapping(
+            self.words_speaker_mapping, self.speaker_ts
+        )
+
+    @cached_property
+    def rttm_path(self):
+        return write_rttm(self.speaker_ts, os.path.join(self.work_dir, "turns.rttm"))
+
+    @cached_property
+    def srt_path(self):
+        from transcript_writers import write_transcript_files
+
+        base_path = os.path.join(self.work_dir, "transcript")
+        return write_transcript_files(self.sentences, base_path, ["srt"])["srt"]
+
+
+def bench_read_rttm(workload):
+    from helpers import SpeakerTimeline
+
+    SpeakerTimeline.from_rttm(workload.rttm_path)
+
+
+def bench_words_speaker_mapping(workload):
+    # the streaming functions write_transcripts runs, drained in full
+    from helpers import iter_words_speaker_mapping
+
+    for _ in iter_words_speaker_mapping(workload.word_segments, workload.speaker_ts):
+        pass
+
+
+def bench_realign_punctuation(workload):
+    from helpers import iter_realigned_ws_mapping_with_punctuation
+
+    for _ in iter_realigned_ws_mapping_with_punctuation(workload.words_speaker_mapping):
+        pass
+
+
+def bench_sentences_speaker_mapping(workload):
+    from helpers import get_sentences_speaker_mapping
+
+    get_sentences_speaker_mapping(workload.words_speaker_mapping, workload.speaker_ts)
+
+
+def bench_write_srt(workload):
+    from helpers import write_srt
+
+    with open(os.path.join(workload.work_dir, "write_srt.srt"), "w") as f:
+        write_srt(workload.sentences, f)
+
+
+def bench_write_transcripts(workload):
+    from transcript_writers import FORMATS, write_transcript_files
+
+    write_transcript_files(
+        workload.sentences, os.path.join(workload.work_dir, "all_formats"), FORMATS
+    )
+
+
+def bench_speaker_analysis(workload):
+    from speaker_analysis import read_srt, speaker_statistics
+
+    speaker_statistics(read_srt(workload.srt_path))
+
+
+def bench_corpus_analysis(workload):
+    from corpus_analysis import analyze_transcript
+
+    analyze_transcript(workload.srt_path)
+
+
+def bench_transcript_index(workload):
+    from transcript_index import TranscriptIndex
+
+    db_path = os.path.join(workload.work_dir, "index.db")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    with TranscriptIndex(db_path) as index:
+        index.add_sentences(workload.srt_path, workload.sentences)
+        index.search("you know")
+
+
+def bench_end_to_end(workload, audio_seconds=60):
+    """
+    diarize.py's orchestration with stub models: buffer ingestion, the NeMo
+    manifest and RTTM round trip, punctuation windows, word and sentence
+    mapping and the writers. audio_seconds of silence stand in for the audio.
+    """
+    install_stub_backends()
+    from ingest import ingest_audio
+    from pipeline import transcribe, diarize, write_transcripts
+    from punctuation import PunctuationRestorer
+
+    work_dir = os.path.join(workload.work_dir, "end_to_end")
+    os.makedirs(work_dir, exist_ok=True)
+    audio = ingest_audio(
+        np.zeros(audio_seconds * 16000, dtype=np.float32), work_dir, name="stub_audio"
+    )
+    whisper_results = transcribe(StubWhisper(workload.word_segments), audio)
+    word_segments = stub_align(whisper_results, workload.word_segments)
+    speaker_ts = diarize(
+        audio, work_dir, "cpu", StubDiarizer(workload.speaker_ts, work_dir)
+    )
+    write_transcripts(
+        word_segments,
+        speaker_ts,
+        whisper_results["language"],
+        PunctuationRestorer(StubPunctuationModel()),
+        os.path.join(work_dir, "stub_audio"),
+        ["txt", "srt", "json"],
+        segments=whisper_results["segments"],
+    )
+
+
+BENCHMARKS = {
+    "read_rttm": bench_read_rttm,
+    "words_speaker_mapping": bench_words_speaker_mapping,
+    "realign_punctuation": bench_realign_punctuation,
+    "sentences_speaker_mapping": bench_sentences_speaker_mapping,
+    "write_srt": bench_write_srt,
+    "write_transcripts": bench_write_transcripts,
+    "speaker_analysis": bench_speaker_analysis,
+    "corpus_analysis": bench_corpus_analysis,
+    "transcript_index": bench_transcript_index,
+    "end_to_end": bench_end_to_end,
+}
+
+
+def measure(benchmark, workload, repeat=3):
+    """
+    Returns the best wall time of repeat runs, and the peak memory allocated
+    by one more run traced by tracemalloc, which slows it down too much to be
+    timed. Inputs built before the run don't count towards the peak.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        benchmark(workload)
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        benchmark(workload)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(
+    names, sizes, work_dir, num_speakers=2, turns_per_minute=8, repeat=3
+):
+    results = []
+    for num_words in sizes:
+        workload = Workload(
+            num_words,
+            os.path.join(work_dir, f"{num_words}_words"),
+            num_speakers,
+            turns_per_minute,
+        )
+        for name in names:
+            # inputs are built before the measurement starts
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    BENCHMARKS[name](workload)
+                    seconds, peak = measure(BENCHMARKS[name], workload, repeat)
+            except ImportError as e:
+                print(f"{name:>26} {num_words:>10} skipped, {e}")
+                continue
+            results.append(
+                {
+                    "name": name,
+                    "words": num_words,
+                    "seconds": seconds,
+                    "words_per_second": num_words / seconds if seconds else None,
+                    "peak_mb": peak / 2**20,
+                }
+            )
+            print(
+                f"{name:>26} {num_words:>10} {seconds:>10.4f} s "
+                f"{peak / 2**20:>9.1f} MB"
+            )
+    return results
+
+
+def compare(results, baseline):
+    """Prints the time and peak memory of every result relative to the baseline's."""
+    previous = {(r["name"], r["words"]): r for r in baseline["results"]}
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}:")
+    for result in results:
+        before = previous.get((result["name"], result["words"]))
+        if before is None:
+            continue
+        print(
+            f"{result['name']:>26} {result['words']:>10} "
+            f"time x{result['seconds'] / before['seconds']:.2f} "
+            f"memory x{result['peak_mb'] / max(before['peak_mb'], 1e-9):.2f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time and memory of the post-processing helpers, the analysis "
+        "scripts and the pipeline orchestration on synthetic transcripts, no model "
+        "is downloaded or run"
+    )
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help=f"benchmarks to run, all of them by default: {', '.join(BENCHMARKS)}",
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=int,
+        default=SIZES,
+        help="numbers of words of the synthetic transcripts, e.g. 1000 10000000",
+    )
+    parser.add_argument("--speakers", type=int, default=2, help="number of speakers")
+    parser.add_argument(
+        "--turns-per-minute",
+        type=float,
+        default=8,
+        help="speaker changes per minute of the synthetic conversation",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="timed runs, the best one is kept"
+    )
+    parser.add_argument(
+        "-o", "--output", default=None, help="save the results to this JSON file"
+    )
+    parser.add_argument(
+        "--compare", default=None, help="JSON results of a previous run to compare to"
+    )
+    parser.add_argument(
+        "--work-dir", default=None, help="keep the synthetic inputs in this directory"
+    )
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+
+    from helpers import create_workspace, cleanup
+
+    work_dir = args.work_dir or create_workspace(prefix="benchmark_")
+    try:
+        results = run_benchmarks(
+            args.benchmarks or list(BENCHMARKS),
+            args.sizes,
+            work_dir,
+            args.speakers,
+            args.turns_per_minute,
+            args.repeat,
+        )
+    finally:
+        if args.work_dir is None:
+            cleanup(work_dir)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {
+            "speakers": args.speakers,
+            "turns_per_minute": args.turns_per_minute,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results saved to {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,244 @@
+import os
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+from helpers import SpeakerTimeline
+from pipeline import (
+    load_whisper,
+    load_alignment,
+    load_diarizer,
+    transcribe,
+    align,
+    diarize,
+)
+from ingest import SAMPLE_RATE, ingest_audio, map_audio_buffer
+from speaker_enrollment import get_speaker_embeddings, greedy_matches
+from cpu_backend import available_cores, partition_cores, pin_to_cores
+
+# Models are loaded once per worker process and reused for every chunk it gets
+_whisper_models = {}
+_alignment_models = {}
+_diarizers = {}
+
+
+def plan_chunks(duration, chunk_seconds, overlap_seconds):
+    """Split [0, duration) into windows of chunk_seconds overlapping by overlap_seconds."""
+    if overlap_seconds >= chunk_seconds:
+        raise ValueError("chunk overlap must be shorter than the chunk itself")
+
+    windows, start = [], 0.0
+    while True:
+        end = min(start + chunk_seconds, duration)
+        windows.append((start, end))
+        if end >= duration:
+            return windows
+        start = end - overlap_seconds
+
+
+def _pin_worker(free_core_sets):
+    # every worker process takes its own set of cores once, when it starts
+    pin_to_cores(free_core_sets.get())
+
+
+def process_chunk(
+    audio,
+    index,
+    offset,
+    duration,
+    model_name,
+    work_dir,
+    num_threads,
+    domain_type="telephonic",
+    quantize=False,
+):
+    """Transcribe, align and diarize one window of the audio buffer file on the CPU."""
+    device = "cpu"
+    torch.set_num_threads(num_threads)
+    chunk_dir = os.path.join(work_dir, f"chunk_{index}")
+
+    start = int(offset * SAMPLE_RATE)
+    signal = np.asarray(
+        map_audio_buffer(audio).samples[start : start + int(duration * SAMPLE_RATE)]
+    )
+    chunk_buffer = ingest_audio(signal, chunk_dir, name="chunk")
+
+    if model_name not in _whisper_models:
+        _whisper_models[model_name] = load_whisper(model_name, device, quantize)
+    whisper_results = transcribe(_whisper_models[model_name], chunk_buffer)
+
+    language = whisper_results["language"]
+    if language not in _alignment_models:
+        _alignment_models[language] = load_alignment(language, device, quantize)
+    word_segments = align(
+        whisper_results, chunk_buffer, device, *_alignment_models[language]
+    )
+
+    # the diarizer keeps its manifest and outputs in a directory of the worker,
+    # its chunks are diarized there one after the other
+    nemo_dir = os.path.join(work_dir, f"nemo_{os.getpid()}")
+    if (nemo_dir, domain_type) not in _diarizers:
+        _diarizers[nemo_dir, domain_type] = load_diarizer(nemo_dir, device, domain_type)
+    speaker_ts = diarize(
+        chunk_buffer, nemo_dir, device, _diarizers[nemo_dir, domain_type]
+    )
+    embeddings = get_speaker_embeddings(
+        signal, SAMPLE_RATE, speaker_ts, device, chunk_dir
+    )
+
+    offset_ms = int(offset * 1000)
+    return {
+        "language": whisper_results["language"],
+        "word_segments": [
+            {
+                **wrd_dict,
+                "start": wrd_dict["start"] + offset,
+                "end": wrd_dict["end"] + offset,
+            }
+            for wrd_dict in word_segments
+        ],
+        "speaker_ts": SpeakerTimeline(
+            speaker_ts.starts + offset_ms,
+            speaker_ts.ends + offset_ms,
+            speaker_ts.labels,
+        ),
+        "embeddings": embeddings,
+    }
+
+
+def stitch_speakers(chunk_results, threshold=0.5):
+    """
+    Map the local speaker labels of every chunk to global ones, so the same
+    voice keeps the same label across the whole file.
+
+    Local speakers are greedily paired with the most similar global centroid
+    (cosine similarity of their embeddings), a local speaker with no centroid
+    above the threshold starts a new global speaker.
+    """
+    centroids, weights, mappings = [], [], []
+    for result in chunk_results:
+        local = sorted(result["embeddings"].items())
+        if not local:
+            mappings.append({})
+            continue
+        # a zero vector, e.g. a silent embedding, is similar to nothing
+        vectors = np.array([emb for _, (emb, _) in local], dtype=np.float64)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        if centroids:
+            norm_centroids = np.array(centroids)
+            norm_centroids /= np.maximum(
+                np.linalg.norm(norm_centroids, axis=1, keepdims=True), 1e-12
+            )
+            similarity = vectors @ norm_centroids.T
+        else:
+            similarity = np.empty((len(local), 0))
+
+        mapping = {
+            local[i][0]: j for i, j in greedy_matches(similarity, threshold).items()
+        }
+        for i, (speaker, (emb, speech_ms)) in enumerate(local):
+            if speaker not in mapping:
+                # a new speaker starts at its own embedding, not at zero, so
+                # one without speech still has a direction to be matched on
+                mapping[speaker] = len(centroids)
+                centroids.append(vectors[i].copy())
+                weights.append(0)
+            j = mapping[speaker]
+            # duration weighted running mean of the normalized embeddings
+            weights[j] += speech_ms
+            centroids[j] += (vectors[i] - centroids[j]) * speech_ms / max(weights[j], 1)
+        mappings.append(mapping)
+    return mappings
+
+
+def merge_chunks(chunk_results, windows, mappings):
+    """
+    Merge the chunk outputs at the middle of each overlap, returns the word
+    segments and the speaker turns on the global speaker labels.
+
+    """
+    seams = [(windows[i][1] + windows[i + 1][0]) / 2 for i in range(len(windows) - 1)]
+    bounds = zip([0.0] + seams, seams + [float("inf")])
+
+    word_segments, starts, ends, labels = [], [], [], []
+    for result, mapping, (lo, hi) in zip(chunk_results, mappings, bounds):
+        word_segments.extend(
+            wrd_dict
+            for wrd_dict in result["word_segments"]
+            if lo <= wrd_dict["start"] < hi
+        )
+        turns = result["speaker_ts"]
+        s = np.maximum(turns.starts, lo * 1000).astype(np.int64)
+        e = np.minimum(turns.ends, hi * 1000).astype(np.int64)
+        kept = s < e
+        starts.append(s[kept])
+        ends.append(e[kept])
+        labels.append([mapping[sp] for sp in turns.labels[kept].tolist()])
+    speaker_ts = SpeakerTimeline(
+        np.concatenate(starts), np.concatenate(ends), np.concatenate(labels)
+    ).merge_adjacent()
+    return word_segments, speaker_ts
+
+
+def transcribe_and_diarize_chunked(
+    audio,
+    temp_path,
+    model_name,
+    chunk_seconds,
+    overlap_seconds=10.0,
+    num_workers=None,
+    domain_type="telephonic",
+    quantize=False,
+):
+    """
+    Returns word_segments, speaker_ts and the language of a long file, by
+    processing overlapping windows in parallel worker processes, each pinned
+    to its own share of the cores.
+
+    """
+    # workers slice their window out of the shared 16 kHz buffer file
+    audio = ingest_audio(audio, temp_path)
+    windows = plan_chunks(audio.duration, chunk_seconds, overlap_seconds)
+    cores = available_cores()
+    if num_workers is None:
+        num_workers = max(1, min(len(windows), len(cores) // 4))
+    core_sets = partition_cores(cores, [1] * num_workers)
+    num_threads = max(
+        1, min(len(cores) // num_workers, *(len(core_set) for core_set in core_sets))
+    )
+
+    # diarize.py is a plain script, spawned workers would re-run it on import
+    context = multiprocessing.get_context("fork")
+    free_core_sets = context.Queue()
+    for core_set in core_sets:
+        free_core_sets.put(core_set)
+    with ProcessPoolExecutor(
+        max_workers=num_workers,
+        mp_context=context,
+        initializer=_pin_worker,
+        initargs=(free_core_sets,),
+    ) as pool:
+        futures = [
+            pool.submit(
+                process_chunk,
+                audio.path,
+                index,
+                start,
+                end - start,
+                model_name,
+                os.path.abspath(temp_path),
+                num_threads,
+                domain_type,
+                quantize,
+            )
+            for index, (start, end) in enumerate(windows)
+        ]
+        chunk_results = [future.result() for future in futures]
+
+    mappings = stitch_speakers(chunk_results)
+    word_segments, speaker_ts = merge_chunks(chunk_results, windows, mappings)
+    language = Counter(result["language"] for result in chunk_results).most_common(1)[
+        0
+    ][0]
+    return word_segments, speaker_ts, language
@@ -0,0 +1,326 @@
+import argparse
+import glob
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from stage_cache import file_hash
+from speaker_analysis import (
+    FILLER_WORDS,
+    SPEAKER_TEXT,
+    parse_srt,
+    add_durations,
+    add_word_counts,
+    filler_word_counts,
+)
+
+# Most detailed format first, only one transcript per episode is analyzed
+TRANSCRIPT_EXTENSIONS = (".json", ".srt", ".txt")
+
+
+def find_transcripts(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of transcript
+    files. When an episode has several, e.g. the .txt and .srt written by
+    diarize.py, only the most detailed one is kept.
+    """
+    episodes = {}
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*")
+        for path in glob.glob(pattern, recursive=True):
+            base_path, extension = os.path.splitext(os.path.abspath(path))
+            if os.path.isfile(path) and extension.lower() in TRANSCRIPT_EXTENSIONS:
+                episodes.setdefault(base_path, set()).add(extension)
+    return sorted(
+        base_path
+        + min(extensions, key=lambda ext: TRANSCRIPT_EXTENSIONS.index(ext.lower()))
+        for base_path, extensions in episodes.items()
+    )
+
+
+def read_transcript(path):
+    """
+    Returns the Speaker, Text and Duration in seconds of every turn of an .srt,
+    a .txt (no timestamps, durations are NaN) or a .json sentence mapping, a
+    list of {"speaker", "start_time", "end_time", "text"} in milliseconds.
+
+    """
+    with open(path, "r", encoding="utf-8-sig") as f:
+        content = f.read()
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".srt":
+        return add_durations(parse_srt(content))[["Speaker", "Text", "Duration"]]
+
+    if extension == ".json":
+        sentences = json.loads(content)
+        if isinstance(sentences, dict):
+            sentences = sentences["segments"]
+        df = pd.DataFrame(
+            sentences, columns=["speaker", "start_time", "end_time", "text"]
+        )
+        return pd.DataFrame(
+            {
+                "Speaker": df["speaker"],
+                "Text": df["text"].fillna(""),
+                "Duration": (df["end_time"] - df["start_time"]) / 1000,
+            }
+        )
+
+    blocks = pd.Series(content.split("\n\n")).str.strip()
+    blocks = blocks[blocks != ""].str.replace("\n", " ", regex=False)
+    speaker_text = blocks.str.extract(SPEAKER_TEXT)
+    return pd.DataFrame(
+        {
+            "Speaker": speaker_text[0].fillna("Unknown"),
+            "Text": speaker_text[1].fillna(blocks),
+            "Duration": np.nan,
+        }
+    ).reset_index(drop=True)
+
+
+def episode_columns(filler_words=FILLER_WORDS):
+    """Columns of the episode table, in the order analyze_transcript fills them."""
+    return [
+        "file",
+        "duration",
+        "speakers",
+        "turns",
+        "words",
+        "wpm",
+        "fillers",
+        "fillers_per_100_words",
+        *(f"filler_{phrase}" for phrase in filler_words),
+    ]
+
+
+def analyze_transcript(path, filler_words=FILLER_WORDS):
+    """Returns the episode metrics and the per speaker metrics of one transcript."""
+    df = add_word_counts(read_transcript(path))
+    fillers = filler_word_counts(df, filler_words)
+
+    by_speaker = df.groupby("Speaker")
+    speakers = pd.DataFrame(
+        {
+            "duration": by_speaker["Duration"].sum(min_count=1),
+            "words": by_speaker["WordCount"].sum(),
+            "turns": by_speaker.size(),
+        }
+    )
+    speakers["duration_share"] = speakers["duration"] / speakers["duration"].sum()
+    speakers["wpm"] = speakers["words"] / speakers["duration"] * 60
+    speakers["fillers"] = fillers.sum(axis=1)
+    speakers["fillers_per_100_words"] = (
+        speakers["fillers"] / speakers["words"].replace(0, np.nan) * 100
+    )
+    speakers = speakers.join(fillers.add_prefix("filler_"))
+    speakers = speakers.rename_axis("speaker").reset_index()
+    speakers.insert(0, "file", path)
+
+    duration = df["Duration"].sum(min_count=1)
+    words = int(df["WordCount"].sum())
+    total_fillers = int(speakers["fillers"].sum())
+    episode = {
+        "file": path,
+        "duration": duration,
+        "speakers": len(speakers),
+        "turns": len(df),
+        "words": words,
+        "wpm": words / duration * 60 if duration else np.nan,
+        "fillers": total_fillers,
+        "fillers_per_100_words": total_fillers / words * 100 if words else np.nan,
+        **{f"filler_{phrase}": int(fillers[phrase].sum()) for phrase in filler_words},
+    }
+    return episode, speakers
+
+
+def _analyze(args):
+    path, filler_words = args
+    try:
+        return analyze_transcript(path, filler_words)
+    except Exception as e:
+        return {"file": path, "error": f"{type(e).__name__}: {e}"}, None
+
+
+def file_signature(path):
+    stat = os.stat(path)
+    return {"mtime": stat.st_mtime, "size": stat.st_size}
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, "r") as f:
+        return json.load(f)
+
+
+def changed_files(files, state):
+    """
+    Returns the files whose content changed since the state was saved. A file
+    whose mtime or size changed is hashed, and only counts as changed if its
+    hash differs, so touched or copied back files aren't reprocessed.
+    """
+    changed = []
+    for path in files:
+        previous = state.get(path)
+        signature = file_signature(path)
+        if previous and all(previous[key] == signature[key] for key in signature):
+            continue
+        digest = file_hash(path)
+        if previous and previous.get("sha256") == digest:
+            previous.update(signature)
+            continue
+        changed.append(path)
+    return changed
+
+
+def read_table(path):
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path) if path.endswith(".parquet") else pd.read_csv(path)
+
+
+def write_table(df, path):
+    tmp_path = path + ".tmp"
+    if path.endswith(".parquet"):
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+
+def analyze_corpus(
+    files,
+    output_dir,
+    output_format="csv",
+    filler_words=FILLER_WORDS,
+    incremental=True,
+    num_workers=None,
+):
+    """
+    Analyze the transcripts in a process pool and write episodes.<format> and
+    speakers.<format> to output_dir. In incremental mode only the files that
+    changed since the previous run are analyzed again, the rows of the others
+    are kept from the previous tables. Returns the two tables.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    episodes_path = os.path.join(output_dir, f"episodes.{output_format}")
+    speakers_path = os.path.join(output_dir, f"speakers.{output_format}")
+    state_path = os.path.join(output_dir, "state.json")
+
+    state = load_state(state_path) if incremental else {}
+    if state.get("filler_words") != filler_words:
+        state = {}
+    file_state = state.get("files", {})
+    previous_episodes = read_table(episodes_path) if file_state else None
+    previous_speakers = read_table(speakers_path) if file_state else None
+    if previous_episodes is None or previous_speakers is None:
+        file_state = {}
+
+    todo = changed_files(files, file_state)
+    print(f"{len(todo)} of {len(files)} transcripts to analyze")
+
+    episodes, speakers = [], []
+    if todo:
+        with ProcessPoolExecutor(max_workers=num_workers) as pool:
+            chunksize = max(1, len(todo) // (4 * (num_workers or os.cpu_count())))
+            results = pool.map(
+                _analyze, [(path, filler_words) for path in todo], chunksize=chunksize
+            )
+            for path, (episode, speaker_df) in zip(todo, results):
+                if "error" in episode:
+                    print(f"{path}: {episode['error']}")
+                    file_state.pop(path, None)
+                    continue
+                episodes.append(episode)
+                speakers.append(speaker_df)
+                file_state[path] = {**file_signature(path), "sha256": file_hash(path)}
+
+    # keep the previous rows of the files that are still there and didn't change
+    kept = set(files) - set(todo)
+    file_state = {path: file_state[path] for path in files if path in file_state}
+    # explicit columns, no episode may have been analyzed
+    episodes_df = pd.DataFrame(episodes, columns=episode_columns(filler_words))
+    speakers_df = pd.concat(speakers, ignore_index=True) if speakers else None
+    if previous_episodes is not None:
+        episodes_df = pd.concat(
+            [previous_episodes[previous_episodes["file"].isin(kept)], episodes_df],
+            ignore_index=True,
+        )
+        speakers_df = pd.concat(
+            [previous_speakers[previous_speakers["file"].isin(kept)], speakers_df],
+            ignore_index=True,
+        )
+    if speakers_df is None:
+        speakers_df = pd.DataFrame(columns=["file", "speaker"])
+    episodes_df = episodes_df.sort_values("file", ignore_index=True)
+    speakers_df = speakers_df.sort_values(["file", "speaker"], ignore_index=True)
+
+    write_table(episodes_df, episodes_path)
+    write_table(speakers_df, speakers_path)
+    with open(state_path + ".tmp", "w") as f:
+        json.dump({"filler_words": filler_words, "files": file_state}, f)
+    os.replace(state_path + ".tmp", state_path)
+    return episodes_df, speakers_df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Per episode and per speaker metrics (duration share, words per "
+        "minute, filler words) of many .srt, .txt or .json transcripts"
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="directories, transcript files or glob patterns"
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        default="corpus_analysis",
+        help="directory of the episodes and speakers tables",
+    )
+    parser.add_argument(
+        "--format",
+        dest="output_format",
+        choices=["csv", "parquet"],
+        default="csv",
+        help="format of the tables, parquet needs pyarrow",
+    )
+    parser.add_argument(
+        "--fillers",
+        nargs="+",
+        default=FILLER_WORDS,
+        help='filler words or quoted phrases to count, e.g. um "you know"',
+    )
+    parser.add_argument(
+        "--full",
+        action="store_false",
+        dest="incremental",
+        default=True,
+        help="analyze every transcript again instead of only the changed ones",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of worker processes, defaults to one per CPU core",
+    )
+    args = parser.parse_args()
+
+    files = find_transcripts(args.inputs)
+    if not files:
+        raise SystemExit("No transcripts found.")
+
+    episodes_df, speakers_df = analyze_corpus(
+        files,
+        args.output_dir,
+        args.output_format,
+        args.fillers,
+        args.incremental,
+        args.workers,
+    )
+    print(
+        f"{len(episodes_df)} episodes and {len(speakers_df)} speaker rows written "
+        f"to {args.output_dir}"
+    )
@@ -0,0 +1,102 @@
+import os
+import torch
+
+
+def resolve_device(device="auto"):
+    """Returns cuda for "auto" when a GPU is available, cpu when there is none."""
+    if device == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return device
+
+
+def available_cores():
+    """CPU cores this process may run on, honoring taskset and cgroup cpusets."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+def parse_cores(spec):
+    """Parses a core list like "0-3,8,10-11" into [0, 1, 2, 3, 8, 10, 11]."""
+    cores = []
+    for part in spec.split(","):
+        first, _, last = part.partition("-")
+        cores.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(cores))
+
+
+def format_cores(cores):
+    """Inverse of parse_cores."""
+    ranges, cores = [], sorted(cores)
+    for core in cores:
+        if ranges and core == ranges[-1][1] + 1:
+            ranges[-1][1] = core
+        else:
+            ranges.append([core, core])
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+def partition_cores(cores, shares):
+    """
+    Splits cores into disjoint sets proportional to shares, every set getting
+    at least one core. Cores sharing a physical core are usually numbered far
+    apart, so contiguous ranges keep each set on its own physical cores.
+    """
+    if len(cores) < len(shares):
+        # not enough cores to split, every set runs on all of them
+        return [list(cores) for _ in shares]
+    total = sum(shares)
+    bounds, acc = [0], 0.0
+    for share in shares[:-1]:
+        acc += share
+        bound = round(len(cores) * acc / total)
+        bounds.append(min(max(bound, bounds[-1] + 1), len(cores) - 1))
+    bounds.append(len(cores))
+    return [list(cores[start:end]) for start, end in zip(bounds, bounds[1:])]
+
+
+def pin_to_cores(cores):
+    """
+    Restricts this process to cores and sizes torch's thread pools to match,
+    so processes pinned to disjoint sets don't oversubscribe the CPU.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    configure_threads(len(cores))
+
+
+def configure_threads(num_threads=None):
+    """
+    Sets torch's intra-op threads to num_threads, one per available core by
+    default, and the environment of the subprocesses it starts to the same.
+    """
+    num_threads = num_threads or len(available_cores())
+    torch.set_num_threads(num_threads)
+    try:
+        # only possible before torch ran any parallel work
+        torch.set_num_interop_threads(max(1, min(4, num_threads // 4)))
+    except RuntimeError:
+        pass
+    for variable in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[variable] = str(num_threads)
+    return num_threads
+
+
+def quantize_model(model):
+    """
+    Dynamically quantizes the Linear layers of a model to int8 for CPU
+    inference: weights are stored as int8 and activations quantized on the
+    fly, so the matrix products of the Whisper and wav2vec2 alignment models
+    run on int8 kernels, for a small accuracy cost.
+
+    Whisper's Linear subclass only casts its weights to the input dtype,
+    which is a no-op in float32, so it is quantized as a plain Linear.
+    """
+    for module in model.modules():
+        if type(module).__name__ == "Linear" and type(module) is not torch.nn.Linear:
+            module.__class__ = torch.nn.Linear
+    return torch.quantization.quantize_dynamic(
+        model.float().eval(), {torch.nn.Linear}, dtype=torch.qint8
+    )
@@ -2,15 +2,26 @@
 import argparse
 import os
 from helpers import *
-from whisper import load_model
-import whisperx
 import torch
-import librosa
-import soundfile
-from nemo.collections.asr.models.msdd_models import NeuralDiarizer
-from deepmultilingualpunctuation import PunctuationModel
-import re
-import time
+from pipeline import (
+    separate_vocals,
+    load_whisper,
+    transcribe,
+    align,
+    diarize,
+    write_transcripts,
+)
+from chunking import transcribe_and_diarize_chunked
+from ingest import ingest_audio
+from stage_cache import StageCache, NullCache, DEFAULT_CACHE_DIR
+from transcript_index import TranscriptIndex
+from punctuation import PunctuationRestorer
+from transcript_writers import FORMATS, DEFAULT_FORMATS
+from speaker_enrollment import VoicePrintStore, get_speaker_embeddings, name_speakers
+import contextlib
+from tracing import start_tracing, stop_tracing, span, traced
+from cpu_backend import resolve_device, configure_threads
+from vad import VAD_METHODS, SpeechMap, energy_speech_regions, nemo_speech_regions
 
 # Initialize argument parser
 parser = argparse.ArgumentParser()
@@ -26,6 +37,14 @@ parser.add_argument(
     "This helps with long files that don't contain a lot of music.",
 )
 
+parser.add_argument(
+    "--stem-mode",
+    choices=["auto", "always"],
+    default="auto",
+    help="auto only separates the segments that look like music and skips files "
+    "without any, always separates the whole file",
+)
+
 parser.add_argument(
     "--whisper-model",
     dest="model_name",
@@ -33,149 +52,385 @@ parser.add_argument(
     help="name of the Whisper model to use",
 )
 
-# Parse command-line arguments
-args = parser.parse_args()
+parser.add_argument(
+    "--device",
+    choices=["auto", "cuda", "cpu"],
+    default="auto",
+    help="auto runs on the GPU when there is one",
+)
 
-# Perform source separation if enabled
-source_seperation_start_time = time.time()
-if args.stemming:
-    # Isolate vocals from the rest of the audio
-    return_code = os.system(
-        f'python3 -m demucs.separate -n htdemucs --two-stems=vocals "{args.audio}" -o "temp_outputs"'
-    )
+parser.add_argument(
+    "--cpu-threads",
+    type=int,
+    default=None,
+    help="Number of threads of the models on the cpu device, "
+    "defaults to one per available core",
+)
 
-    if return_code != 0:
-        print(
-            "Source splitting failed, using original audio file. Use --no-stem argument to disable it."
-        )
-        vocal_target = args.audio
-    else:
-        temp_file_path= os.path.splitext(os.path.basename(args.audio))[0]
-        vocal_target = f"temp_outputs/htdemucs/{temp_file_path}/vocals.wav"
-else:
-    vocal_target = args.audio
-source_seperation_end_time = end_time = time.time()
-print_time_usage(
-  start_time = source_seperation_start_time,
-  end_time = source_seperation_end_time,
-  description= "Vocal Seperation from Audio"
+parser.add_argument(
+    "--quantize",
+    action="store_true",
+    default=False,
+    help="Run int8 dynamically quantized Whisper and alignment models, cpu only",
 )
 
-# Load the Whisper ASR model and transcribe the audio
-whisper_model = trace_time_usage(load_model, args.model_name)
-whisper_results = trace_time_usage(whisper_model.transcribe, vocal_target, beam_size=None, verbose=False)
+parser.add_argument(
+    "--output-formats",
+    nargs="+",
+    choices=FORMATS,
+    default=list(DEFAULT_FORMATS),
+    help="Transcript formats written next to the audio file",
+)
 
-# Clear GPU memory
-del whisper_model
-torch.cuda.empty_cache()
+parser.add_argument(
+    "--word-level",
+    action="store_true",
+    default=False,
+    help="Include every word with its timestamps in the json output",
+)
 
-# Load the Whisper alignment model and align words with timestamps
-device = "cuda" if torch.cuda.is_available() else "cpu"
-alignment_model, metadata = whisperx.load_align_model(
-    language_code=whisper_results["language"], device=device
+parser.add_argument(
+    "--punct-mode",
+    choices=["model", "whisper"],
+    default="model",
+    help="whisper keeps Whisper's own punctuation for the segments that already "
+    "end with a sentence ending punctuation and only runs the punctuation model "
+    "on the others",
 )
-result_aligned = whisperx.align(
-    whisper_results["segments"], alignment_model, metadata, vocal_target, device
+
+parser.add_argument(
+    "--punct-threads",
+    type=int,
+    default=None,
+    help="Number of CPU threads of the punctuation model, when running on the CPU",
 )
 
-# Clear GPU memory
-del alignment_model
-torch.cuda.empty_cache()
+parser.add_argument(
+    "--domain-type",
+    choices=DOMAIN_TYPES,
+    default="telephonic",
+    help="NeMo diarization profile, meeting suits recordings with many speakers "
+    "and far field microphones",
+)
 
-# Convert audio to mono for NeMo compatibility
-signal, sample_rate = librosa.load(vocal_target, sr=None)
-ROOT = os.getcwd()
-temp_path = os.path.join(ROOT, "temp_outputs")
-if not os.path.exists(temp_path):
-    os.mkdir(temp_path)
-os.chdir(temp_path)
-soundfile.write("mono_file.wav", signal, sample_rate, "PCM_24")
+parser.add_argument(
+    "--vad",
+    choices=VAD_METHODS,
+    default=None,
+    help="Only transcribe and align the speech regions found by NeMo's VAD during "
+    "diarization, or by an energy detector, joined into one shorter signal. "
+    "Word timestamps are mapped back to the recording.",
+)
 
-# Initialize NeMo MSDD diarization model and perform diarization
-config = create_config()
+parser.add_argument(
+    "--chunk-seconds",
+    type=float,
+    default=None,
+    help="Transcribe and diarize the audio in overlapping windows of this many "
+    "seconds, processed in parallel on the CPU. Meant for recordings of several hours.",
+)
+
+parser.add_argument(
+    "--chunk-overlap",
+    type=float,
+    default=10.0,
+    help="Overlap in seconds between consecutive windows of --chunk-seconds",
+)
+
+parser.add_argument(
+    "--chunk-workers",
+    type=int,
+    default=None,
+    help="Number of worker processes for --chunk-seconds, "
+    "defaults to one per four CPU cores",
+)
+
+parser.add_argument(
+    "--index",
+    dest="index_path",
+    default=None,
+    help="Add the transcript to this search index, see transcript_index.py",
+)
+
+parser.add_argument(
+    "--voiceprints",
+    default=None,
+    help="Name the speakers by matching their voices against this voice print "
+    "store, see speaker_enrollment.py. Unknown voices are added as 'Unknown N'.",
+)
+
+parser.add_argument(
+    "--voiceprint-threshold",
+    type=float,
+    default=0.6,
+    help="Minimum cosine similarity for a speaker to get the name of a voice print",
+)
+
+parser.add_argument(
+    "--no-enroll",
+    action="store_false",
+    dest="enroll_unknown",
+    default=True,
+    help="Don't add the voices missing from --voiceprints to the store",
+)
 
+parser.add_argument(
+    "--trace",
+    dest="trace_path",
+    default=None,
+    help="Append the time, CPU time, peak memory and real-time factor of every "
+    "stage to this JSON lines file",
+)
+
+parser.add_argument(
+    "--chrome-trace",
+    default=None,
+    help="Write the stages as a Chrome trace, to open in chrome://tracing or Perfetto",
+)
+
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    default=False,
+    help="Reuse the cached outputs of the stages whose inputs and settings didn't change, "
+    "e.g. only transcription and alignment rerun with a different --whisper-model.",
+)
+
+parser.add_argument(
+    "--cache-dir",
+    default=None,
+    help="Directory of the stage cache, enables caching. "
+    f"Defaults to {DEFAULT_CACHE_DIR} with --resume.",
+)
+
+parser.add_argument(
+    "--cache-size",
+    type=float,
+    default=20,
+    help="Size limit of the stage cache in GB, least recently used entries are evicted",
+)
+
+# Parse command-line arguments
+args = parser.parse_args()
+if args.vad and args.chunk_seconds:
+    parser.error("--vad can't be combined with --chunk-seconds")
+
+# Private workspace, several runs can share the working directory
+temp_path = create_workspace()
+
+# Every stage is traced in a span of the run, the summary is printed at the end
+start_tracing(args.trace_path, args.chrome_trace)
+run = contextlib.ExitStack()
+run_span = run.enter_context(span("diarize", file=os.path.abspath(args.audio)))
+
+# Stage outputs are cached by audio content hash, model and settings
+if args.resume or args.cache_dir:
+    cache = StageCache(
+        args.cache_dir or DEFAULT_CACHE_DIR,
+        max_bytes=int(args.cache_size * 1024**3),
+        resume=args.resume,
+    )
+else:
+    cache = NullCache()
+source_key = cache.hash_file(args.audio)
+
+device = resolve_device(args.device)
+if args.quantize and device != "cpu":
+    parser.error("--quantize needs the cpu device")
+device_name = device
 if device == "cpu":
-    config.num_workers = 0
-
-neural_diarizer_start_time = time.time()
-msdd_model = NeuralDiarizer(cfg=config).to(device)
-msdd_model.diarize()
-neural_diarizer_end_time = time.time()
-print_time_usage(
-  start_time = neural_diarizer_start_time,
-  end_time = neural_diarizer_end_time,
-  description= "Neural diarizer processing"
-)
-
-# Clear GPU memory
-del msdd_model
-torch.cuda.empty_cache()
-
-# Read speaker timestamps and labels from the output file
-output_dir = "nemo_outputs"
-
-speaker_ts = []
-with open(f"{output_dir}/pred_rttms/mono_file.rttm", "r") as f:
-    lines = f.readlines()
-    for line in lines:
-        line_list = line.split(" ")
-        s = int(float(line_list[5]) * 1000)
-        e = s + int(float(line_list[8]) * 1000)
-        speaker_ts.append([s, e, int(line_list[11].split("_")[-1])])
-
-# Map words to speakers using timestamps
-wsm = get_words_speaker_mapping(result_aligned["word_segments"], speaker_ts, "start")
-
-# Restore punctuation in the transcript if the language is supported
-if whisper_results["language"] in punct_model_langs:
-    # Load punctuation model
-    punct_model = PunctuationModel(model="kredor/punctuate-all")
-
-    # Get list of words from the word-speaker mapping
-    words_list = list(map(lambda x: x["word"], wsm))
-
-    # Predict punctuation for the words
-    labled_words = punct_model.predict(words_list)
-
-    # Add predicted punctuation to the words in the word-speaker mapping
-    ending_puncts = ".?!"
-    model_puncts = ".,;:!?"
-
-    # Function to check if a word is an acronym
-    is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
-
-    for word_dict, labeled_tuple in zip(wsm, labled_words):
-        word = word_dict["word"]
-        if (
-            word
-            and labeled_tuple[1] in ending_puncts
-            and (word[-1] not in model_puncts or is_acronym(word))
-        ):
-            word += labeled_tuple[1]
-            if word.endswith(".."):
-                word = word.rstrip(".")
-            word_dict["word"] = word
-
-    # Realign word-speaker mapping with punctuation
-    wsm = get_realigned_ws_mapping_with_punctuation(wsm)
+    device_name = f"{configure_threads(args.cpu_threads)} cpu threads"
+
+# Perform source separation if enabled
+vocal_target = args.audio
+if args.stemming:
+    vocals_key = cache.key("vocals", source_key, "htdemucs", args.stem_mode)
+    separated = cache.get(vocals_key)
+    if separated is None:
+        # Isolate vocals from the rest of the audio, skipped if there is no music.
+        # Only that is cached, a failed separation is tried again next run
+        try:
+            separated = cache.put(
+                vocals_key,
+                {
+                    "vocals": separate_vocals(
+                        args.audio, device, mode=args.stem_mode, strict=True
+                    )
+                },
+            )
+        except Exception as e:
+            print(
+                f"Source splitting failed ({e}), using original audio file. Use --no-stem argument to disable it."
+            )
+            separated = {"vocals": None}
+    if separated["vocals"] is not None:
+        vocal_target = separated["vocals"]
+        source_key = vocals_key
+
+# Decode the audio once into a 16 kHz mono buffer shared by every stage
+audio = traced("ingest_audio", ingest_audio, vocal_target, temp_path)
+run_span.audio_seconds = audio.duration
+
+if args.chunk_seconds:
+    # Long files are transcribed and diarized window by window in a process pool
+    chunked_key = cache.key(
+        "chunked",
+        source_key,
+        args.model_name,
+        args.chunk_seconds,
+        args.chunk_overlap,
+        args.domain_type,
+        NEMO_CONFIG_VERSION,
+        *(["int8"] if args.quantize else []),
+    )
+    word_segments, speaker_ts, language = traced(
+        "chunked_transcription_and_diarization",
+        cache.cached,
+        chunked_key,
+        transcribe_and_diarize_chunked,
+        audio.path,
+        temp_path,
+        args.model_name,
+        args.chunk_seconds,
+        overlap_seconds=args.chunk_overlap,
+        num_workers=args.chunk_workers,
+        domain_type=args.domain_type,
+        quantize=args.quantize,
+        audio_seconds=audio.duration,
+    )
+    segments = None
 else:
-    print(
-        f'Punctuation restoration is not available for {whisper_results["language"]} language.'
+    # Perform NeMo MSDD diarization on the mono audio
+    speaker_ts = cache.cached(
+        cache.key(
+            "rttm", source_key, f"diar_infer_{args.domain_type}", NEMO_CONFIG_VERSION
+        ),
+        diarize,
+        audio,
+        temp_path,
+        device,
+        domain_type=args.domain_type,
     )
+    # Clear GPU memory
+    torch.cuda.empty_cache()
 
-# Get sentence-speaker mapping from the word-speaker mapping
-ssm = get_sentences_speaker_mapping(wsm, speaker_ts)
+    # Cut silences, intros and music beds out of what Whisper transcribes
+    whisper_audio, speech_map, vad_key = audio, None, []
+    if args.vad:
+        with span("vad", audio_seconds=audio.duration):
+            if args.vad == "nemo":
+                regions = nemo_speech_regions(
+                    os.path.join(temp_path, "nemo_outputs"), audio.path, speaker_ts
+                )
+            else:
+                regions = energy_speech_regions(audio.samples, audio.sample_rate)
+            speech_map = SpeechMap(regions, audio.duration)
+            whisper_audio = speech_map.gate(audio.samples, audio.sample_rate)
+            # the regions themselves key the transcription, NeMo's may come from
+            # vad_out.json or from the speaker turns of a cached RTTM
+            vad_key = ["vad", args.vad, speech_map.key()]
+        print(
+            f"Transcribing {speech_map.speech_seconds:.1f} s of speech "
+            f"out of {audio.duration:.1f} s"
+        )
+
+    if speech_map is not None and not speech_map.speech_seconds:
+        # nothing for Whisper to transcribe, the transcript is empty
+        print("No speech found, writing an empty transcript")
+        language, segments, word_segments = None, [], []
+    else:
+        # Load the Whisper ASR model and transcribe the audio
+        whisper_key = cache.key(
+            "whisper",
+            source_key,
+            args.model_name,
+            *(["int8"] if args.quantize else []),
+            *vad_key,
+        )
+        whisper_results = cache.get(whisper_key)
+        if whisper_results is None:
+            whisper_model = load_whisper(args.model_name, device, args.quantize)
+            whisper_results = transcribe(whisper_model, whisper_audio)
+            cache.put(whisper_key, whisper_results)
+
+            # Clear GPU memory
+            del whisper_model
+            torch.cuda.empty_cache()
+        language = whisper_results["language"]
+        segments = whisper_results["segments"]
 
-# Change back to the parent directory
-os.chdir(ROOT)
+        # Load the Whisper alignment model and align words with timestamps
+        word_segments = cache.cached(
+            cache.key("aligned", whisper_key),
+            align,
+            whisper_results,
+            whisper_audio,
+            device,
+            quantize=args.quantize,
+        )
 
-# Write speaker-aware transcript to a text file
-with open(f"{args.audio[:-4]}.txt", "w", encoding="utf-8-sig") as f:
-    get_speaker_aware_transcript(ssm, f)
+        # Clear GPU memory
+        torch.cuda.empty_cache()
 
-# Write speaker-aware subtitles to an SRT file
-with open(f"{args.audio[:-4]}.srt", "w", encoding="utf-8-sig") as srt:
-    write_srt(ssm, srt)
+        if speech_map is not None:
+            # back from the joined speech to the timeline of the recording
+            word_segments = speech_map.restore_timestamps(word_segments)
+            segments = speech_map.restore_timestamps(segments)
+
+# Name the speakers after the enrolled voices they match
+speaker_names = None
+if args.voiceprints:
+    with span("speaker_naming"):
+        store = VoicePrintStore.load(args.voiceprints)
+        embeddings = get_speaker_embeddings(
+            np.asarray(audio.samples), audio.sample_rate, speaker_ts, device, temp_path
+        )
+        speaker_names = name_speakers(
+            store, embeddings, args.voiceprint_threshold, args.enroll_unknown
+        )
+        store.save(args.voiceprints)
+    for spk, name in sorted(speaker_names.items()):
+        print(f"Speaker {spk}: {name}")
+
+# Load punctuation model if the language is supported
+punct_model = None
+if language in punct_model_langs:
+    punct_model = traced(
+        "load_punctuation", PunctuationRestorer, num_threads=args.punct_threads
+    )
+
+# Map words to speakers, restore punctuation and write every output format
+# in a single pass
+output_paths = write_transcripts(
+    word_segments,
+    speaker_ts,
+    language,
+    punct_model,
+    args.audio[:-4],
+    args.output_formats,
+    segments=segments,
+    punct_mode=args.punct_mode,
+    speaker_names=speaker_names,
+    word_level=args.word_level,
+)
+
+# Make the subtitles searchable by phrase, speaker and time
+if args.index_path:
+    indexable = [output_paths[fmt] for fmt in ("srt", "json") if fmt in output_paths]
+    if indexable:
+        with span("index"), TranscriptIndex(args.index_path) as index:
+            index.add_file(indexable[0], force=True)
+    else:
+        print("--index needs the srt or json output format, transcript not indexed")
 
 # Clean up temporary files and directories
-cleanup(temp_path)
\ No newline at end of file
+cleanup(temp_path)
+
+run.close()
+stop_tracing()
+if run_span.audio_seconds:
+    print(
+        f"{run_span.audio_seconds:.1f} s of audio processed in "
+        f"{run_span.wall_seconds:.1f} s on {device_name}, "
+        f"real-time factor {run_span.rtf:.3f}"
+    )
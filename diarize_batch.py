@@ -0,0 +1,344 @@
+import argparse
+import glob
+import os
+import queue
+import threading
+import traceback
+from functools import partial
+from helpers import *
+from whisper import load_model
+import torch
+from pipeline import (
+    separate_vocals,
+    transcribe,
+    align,
+    load_diarizer,
+    diarize_many,
+    write_transcripts,
+)
+from diarize_worker import AlignModelCache
+from ingest import ingest_audio
+from punctuation import PunctuationRestorer
+from transcript_writers import FORMATS, DEFAULT_FORMATS
+from speaker_enrollment import VoicePrintStore, get_speaker_embeddings, name_speakers
+from tracing import start_tracing, stop_tracing, span
+
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg", ".opus", ".aac")
+
+# Marks the end of the file stream between two stages
+_DONE = object()
+
+
+def find_audio_files(inputs):
+    """Expand directories and glob patterns into a sorted list of audio files."""
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        files.extend(
+            path
+            for path in glob.glob(pattern)
+            if os.path.isfile(path) and path.lower().endswith(AUDIO_EXTENSIONS)
+        )
+    return sorted(set(files))
+
+
+def run_stage(name, process, inbox, outbox):
+    """
+    Pull jobs from inbox, run process on them and push them to outbox.
+
+    A job whose previous stage failed is passed along untouched, so one bad
+    file never stops the rest of the batch.
+    """
+    while True:
+        job = inbox.get()
+        if job is _DONE:
+            outbox.put(_DONE)
+            return
+        if "error" not in job:
+            try:
+                with span(f"{name}_stage", file=job["audio"]):
+                    process(job)
+            except Exception:
+                job["error"] = f"{name} failed:\n{traceback.format_exc()}"
+        outbox.put(job)
+
+
+def run_batched_stage(name, process, inbox, outbox, max_batch):
+    """
+    Like run_stage, but process gets a list of up to max_batch jobs: the next
+    job and the ones already waiting behind it, never waiting for more.
+    """
+    done = False
+    while not done:
+        jobs = [inbox.get()]
+        while len(jobs) < max_batch and jobs[-1] is not _DONE:
+            try:
+                jobs.append(inbox.get_nowait())
+            except queue.Empty:
+                break
+        if jobs[-1] is _DONE:
+            done = True
+            jobs.pop()
+
+        ready = [job for job in jobs if "error" not in job]
+        if ready:
+            try:
+                with span(f"{name}_stage", files=[job["audio"] for job in ready]):
+                    process(ready)
+            except Exception:
+                for job in ready:
+                    job["error"] = f"{name} failed:\n{traceback.format_exc()}"
+        for job in jobs:
+            outbox.put(job)
+    outbox.put(_DONE)
+
+
+class BatchPipeline:
+    """
+    Runs separation, transcription + alignment and diarization + writing as
+    three threads connected by bounded queues, so while a file is transcribed
+    the next one is being separated and the previous one diarized. Files
+    waiting for diarization are diarized together in a single NeMo call.
+    """
+
+    def __init__(
+        self,
+        model_name,
+        device,
+        temp_path,
+        stemming=True,
+        queue_size=2,
+        domain_type="telephonic",
+        diarize_batch_size=4,
+        voiceprints=None,
+        voiceprint_threshold=0.6,
+        output_formats=DEFAULT_FORMATS,
+    ):
+        self.model_name = model_name
+        self.device = device
+        self.temp_path = temp_path
+        self.stemming = stemming
+        self.queue_size = queue_size
+        self.domain_type = domain_type
+        self.diarize_batch_size = diarize_batch_size
+        self.voiceprints = voiceprints
+        self.voiceprint_threshold = voiceprint_threshold
+        self.output_formats = output_formats
+
+    def separate(self, job):
+        vocal_target = job["audio"]
+        if self.stemming:
+            vocals = separate_vocals(job["audio"], self.device)
+            if vocals is not None:
+                vocal_target = vocals
+        # decode once into the buffer shared by the next stages
+        job["audio_buffer"] = ingest_audio(
+            vocal_target, self.temp_path, name=f"audio_{job['index']}"
+        )
+
+    def transcribe(self, job):
+        whisper_results = transcribe(self.whisper_model, job["audio_buffer"])
+        job["language"] = whisper_results["language"]
+        alignment_model, metadata = self.align_models.get(job["language"])
+        job["word_segments"] = align(
+            whisper_results, job["audio_buffer"], self.device, alignment_model, metadata
+        )
+
+    def diarize_and_write(self, jobs):
+        timelines = diarize_many(
+            [job["audio_buffer"] for job in jobs],
+            self.nemo_path,
+            self.device,
+            self.msdd_model,
+        )
+        # a file failing to be written doesn't fail the others of the batch
+        for job, speaker_ts in zip(jobs, timelines):
+            try:
+                with span("episode_outputs", file=job["audio"]):
+                    self.write_outputs(job, speaker_ts)
+            except Exception:
+                job["error"] = f"write failed:\n{traceback.format_exc()}"
+
+    def write_outputs(self, job, speaker_ts):
+        base_path = os.path.splitext(job["audio"])[0]
+        speaker_names = None
+        if self.store is not None:
+            # voices enrolled by an episode are recognized in the next ones
+            embeddings = get_speaker_embeddings(
+                np.asarray(job["audio_buffer"].samples),
+                job["audio_buffer"].sample_rate,
+                speaker_ts,
+                self.device,
+                self.temp_path,
+            )
+            speaker_names = name_speakers(
+                self.store, embeddings, self.voiceprint_threshold
+            )
+            self.store.save(self.voiceprints)
+        write_transcripts(
+            job["word_segments"],
+            speaker_ts,
+            job["language"],
+            self.punct_model,
+            base_path,
+            self.output_formats,
+            speaker_names=speaker_names,
+        )
+        audio_buffer = job.pop("audio_buffer")
+        # input files that already were 16 kHz float WAVs are mapped in place
+        if audio_buffer.path.startswith(self.temp_path):
+            cleanup(audio_buffer.path)
+
+    def run(self, audio_files):
+        self.whisper_model = load_model(self.model_name, device=self.device)
+        self.align_models = AlignModelCache(self.device)
+        self.nemo_path = os.path.join(self.temp_path, "nemo")
+        self.msdd_model = load_diarizer(self.nemo_path, self.device, self.domain_type)
+        self.punct_model = PunctuationRestorer()
+        self.store = None
+        if self.voiceprints:
+            self.store = VoicePrintStore.load(self.voiceprints)
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(4)]
+        stages = [
+            ("separation", run_stage, self.separate),
+            ("transcription", run_stage, self.transcribe),
+            (
+                "diarization",
+                partial(run_batched_stage, max_batch=self.diarize_batch_size),
+                self.diarize_and_write,
+            ),
+        ]
+        threads = [
+            threading.Thread(
+                target=runner,
+                args=(name, process, queues[i], queues[i + 1]),
+                name=name,
+                daemon=True,
+            )
+            for i, (name, runner, process) in enumerate(stages)
+        ]
+        for thread in threads:
+            thread.start()
+
+        def feed():
+            for index, audio in enumerate(audio_files):
+                queues[0].put({"index": index, "audio": os.path.abspath(audio)})
+            queues[0].put(_DONE)
+
+        threading.Thread(target=feed, daemon=True).start()
+
+        results = []
+        while (job := queues[-1].get()) is not _DONE:
+            status = "failed" if "error" in job else "done"
+            print(f"[{len(results) + 1}/{len(audio_files)}] {status}: {job['audio']}")
+            # drop the transcript, only the outcome is kept for the report
+            results.append({key: job[key] for key in ("audio", "error") if key in job})
+        for thread in threads:
+            thread.join()
+        return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Diarize every audio file of a directory or glob pattern, "
+        "overlapping the stages of consecutive files"
+    )
+    parser.add_argument(
+        "inputs", nargs="+", help="directories, audio files or glob patterns"
+    )
+    parser.add_argument(
+        "--no-stem",
+        action="store_false",
+        dest="stemming",
+        default=True,
+        help="Disables source separation."
+        "This helps with long files that don't contain a lot of music.",
+    )
+    parser.add_argument(
+        "--whisper-model",
+        dest="model_name",
+        default="large",
+        help="name of the Whisper model to use",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=2,
+        help="number of files waiting between two stages, bounds memory use",
+    )
+    parser.add_argument(
+        "--domain-type",
+        choices=DOMAIN_TYPES,
+        default="telephonic",
+        help="NeMo diarization profile",
+    )
+    parser.add_argument(
+        "--diarize-batch-size",
+        type=int,
+        default=4,
+        help="maximum number of waiting files diarized together in one NeMo call",
+    )
+    parser.add_argument(
+        "--voiceprints",
+        default=None,
+        help="name the speakers after the voices of this store, see "
+        'speaker_enrollment.py, new voices are added as "Unknown N"',
+    )
+    parser.add_argument(
+        "--voiceprint-threshold",
+        type=float,
+        default=0.6,
+        help="minimum cosine similarity for a speaker to get the name of a voice",
+    )
+    parser.add_argument(
+        "--output-formats",
+        nargs="+",
+        choices=FORMATS,
+        default=list(DEFAULT_FORMATS),
+        help="transcript formats written next to every audio file",
+    )
+    parser.add_argument(
+        "--trace",
+        dest="trace_path",
+        default=None,
+        help="append the time, CPU time, peak memory and real-time factor of every "
+        "stage of every file to this JSON lines file",
+    )
+    parser.add_argument(
+        "--chrome-trace",
+        default=None,
+        help="write the stages as a Chrome trace, one track per pipeline thread",
+    )
+    args = parser.parse_args()
+
+    audio_files = find_audio_files(args.inputs)
+    if not audio_files:
+        raise SystemExit("No audio files found.")
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    temp_path = create_workspace(prefix="diarize_batch_")
+    start_tracing(args.trace_path, args.chrome_trace)
+    try:
+        results = BatchPipeline(
+            args.model_name,
+            device,
+            temp_path,
+            args.stemming,
+            args.queue_size,
+            args.domain_type,
+            args.diarize_batch_size,
+            args.voiceprints,
+            args.voiceprint_threshold,
+            args.output_formats,
+        ).run(audio_files)
+    finally:
+        cleanup(temp_path)
+        stop_tracing()
+
+    failed = [job for job in results if "error" in job]
+    for job in failed:
+        print(f"\n{job['audio']}: {job['error']}")
+    print(f"\n{len(results) - len(failed)} of {len(results)} files processed")
+    raise SystemExit(1 if failed else 0)
@@ -0,0 +1,79 @@
+import argparse
+import json
+import os
+import socket
+from transcript_writers import FORMATS, DEFAULT_FORMATS, ENCODINGS
+
+
+def submit(socket_path, jobs):
+    """Send jobs to a running diarize_worker.py and yield its responses in order."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path)
+        with sock.makefile("rw", encoding="utf-8") as stream:
+            for job in jobs:
+                stream.write(json.dumps(job) + "\n")
+            stream.flush()
+            for _ in jobs:
+                yield json.loads(stream.readline())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Submit audio files to a diarize_worker.py listening on a Unix socket"
+    )
+    parser.add_argument(
+        "-a", "--audio", nargs="+", help="name of the target audio files", required=True
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        required=True,
+        help="path of the worker's Unix socket",
+    )
+    parser.add_argument(
+        "--no-stem",
+        action="store_false",
+        dest="stemming",
+        default=True,
+        help="Disables source separation.",
+    )
+    parser.add_argument(
+        "--output-formats",
+        nargs="+",
+        choices=FORMATS,
+        default=list(DEFAULT_FORMATS),
+        help="transcript formats written next to every audio file",
+    )
+    parser.add_argument(
+        "--word-level",
+        action="store_true",
+        default=False,
+        help="include every word with its timestamps in the json output",
+    )
+    args = parser.parse_args()
+
+    jobs = [
+        {
+            "id": i,
+            "audio": os.path.abspath(audio),
+            "stemming": args.stemming,
+            "output_formats": args.output_formats,
+            "word_level": args.word_level,
+        }
+        for i, audio in enumerate(args.audio)
+    ]
+    failed = 0
+    for audio, response in zip(args.audio, submit(args.socket_path, jobs)):
+        if response["status"] != "ok":
+            print(f"{audio}: {response['error']}")
+            failed += 1
+            continue
+
+        paths = []
+        for fmt in args.output_formats:
+            paths.append(f"{audio[:-4]}.{fmt}")
+            with open(paths[-1], "w", encoding=ENCODINGS.get(fmt, "utf-8")) as f:
+                f.write(response[fmt])
+        print(f"{audio}: wrote {', '.join(paths)}")
+
+    raise SystemExit(1 if failed else 0)
@@ -1,13 +1,31 @@
 import argparse
 import os
 from helpers import *
-from whisper import load_model
-import whisperx
+from pipeline import (
+    separate_vocals,
+    load_whisper,
+    transcribe,
+    align,
+    read_rttm,
+    rttm_name,
+    punctuate,
+    write_transcripts,
+)
+from ingest import ingest_audio
 import torch
-from deepmultilingualpunctuation import PunctuationModel
-import re
-import subprocess
-
+from punctuation import PunctuationRestorer
+from transcript_writers import FORMATS, DEFAULT_FORMATS
+import contextlib
+from stage_graph import StageGraph
+from vad import SpeechMap, energy_speech_regions
+from tracing import start_tracing, stop_tracing, span
+from cpu_backend import (
+    resolve_device,
+    available_cores,
+    partition_cores,
+    format_cores,
+    pin_to_cores,
+)
 
 # Initialize parser
 parser = argparse.ArgumentParser()
@@ -30,107 +48,210 @@ parser.add_argument(
     help="name of the Whisper model to use",
 )
 
-args = parser.parse_args()
-
+parser.add_argument(
+    "--output-formats",
+    nargs="+",
+    choices=FORMATS,
+    default=list(DEFAULT_FORMATS),
+    help="Transcript formats written next to the audio file",
+)
 
-if args.stemming:
-    # Isolate vocals from the rest of the audio
+parser.add_argument(
+    "--device",
+    choices=["auto", "cuda", "cpu"],
+    default="auto",
+    help="auto runs on the GPU when there is one",
+)
 
-    return_code = os.system(
-        f'python3 -m demucs.separate -n htdemucs_ft --two-stems=vocals "{args.audio}" -o "temp_outputs"'
-    )
+parser.add_argument(
+    "--nemo-share",
+    type=float,
+    default=0.33,
+    help="On the cpu device, share of the cores given to the NeMo process, "
+    "Whisper runs on the others",
+)
 
-    if return_code != 0:
-        print(
-            "Source splitting failed, using original audio file. Use --no-stem argument to disable it."
-        )
-        vocal_target = args.audio
-    else:
-        vocal_target = f"temp_outputs/htdemucs_ft/{args.audio[:-4]}/vocals.wav"
-else:
-    vocal_target = args.audio
-
-nemo_process = subprocess.Popen(
-    ["python3", "nemo_process.py", "-a", vocal_target],
-    stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
+parser.add_argument(
+    "--quantize",
+    action="store_true",
+    default=False,
+    help="Run int8 dynamically quantized Whisper and alignment models, cpu only",
 )
-# Large models result in considerably better and more aligned (words, timestamps) mapping.
-whisper_model = load_model(args.model_name)
-whisper_results = whisper_model.transcribe(vocal_target, beam_size=None, verbose=False)
 
-# clear gpu vram
-del whisper_model
-torch.cuda.empty_cache()
+parser.add_argument(
+    "--vad",
+    choices=["energy"],
+    default=None,
+    help="Only transcribe and align the audible regions found by an energy "
+    "detector, NeMo's VAD would make Whisper wait for the diarization",
+)
 
-device = "cuda"
-alignment_model, metadata = whisperx.load_align_model(
-    language_code=whisper_results["language"], device=device
+parser.add_argument(
+    "--trace",
+    dest="trace_path",
+    default=None,
+    help="Append the time, CPU time, peak memory and real-time factor of every "
+    "stage to this JSON lines file, NeMo's process included",
 )
-result_aligned = whisperx.align(
-    whisper_results["segments"], alignment_model, metadata, vocal_target, device
+
+parser.add_argument(
+    "--chrome-trace",
+    default=None,
+    help="Write the stages as a Chrome trace, to open in chrome://tracing or Perfetto",
 )
 
-# clear gpu vram
-del alignment_model
-torch.cuda.empty_cache()
-
-# Reading timestamps <> Speaker Labels mapping
-nemo_process.communicate()
-ROOT = os.getcwd()
-temp_path = os.path.join(ROOT, "temp_outputs")
-output_dir = "nemo_outputs"
-
-speaker_ts = []
-with open(f"{temp_path}/{output_dir}/pred_rttms/mono_file.rttm", "r") as f:
-    lines = f.readlines()
-    for line in lines:
-        line_list = line.split(" ")
-        s = int(float(line_list[5]) * 1000)
-        e = s + int(float(line_list[8]) * 1000)
-        speaker_ts.append([s, e, int(line_list[11].split("_")[-1])])
-
-wsm = get_words_speaker_mapping(result_aligned["word_segments"], speaker_ts, "start")
-
-if whisper_results["language"] in punct_model_langs:
-    # restoring punctuation in the transcript to help realign the sentences
-    punct_model = PunctuationModel(model="kredor/punctuate-all")
-
-    words_list = list(map(lambda x: x["word"], wsm))
-
-    labled_words = punct_model.predict(words_list)
-
-    ending_puncts = ".?!"
-    model_puncts = ".,;:!?"
-
-    # We don't want to punctuate U.S.A. with a period. Right?
-    is_acronym = lambda x: re.fullmatch(r"\b(?:[a-zA-Z]\.){2,}", x)
-
-    for word_dict, labeled_tuple in zip(wsm, labled_words):
-        word = word_dict["word"]
-        if (
-            word
-            and labeled_tuple[1] in ending_puncts
-            and (word[-1] not in model_puncts or is_acronym(word))
-        ):
-            word += labeled_tuple[1]
-            if word.endswith(".."):
-                word = word.rstrip(".")
-            word_dict["word"] = word
-
-    wsm = get_realigned_ws_mapping_with_punctuation(wsm)
-else:
+args = parser.parse_args()
+
+
+# Private workspace shared with nemo_process.py, concurrent runs don't collide
+temp_path = create_workspace()
+
+# Every stage is traced in a span of the run, the summary is printed at the end
+start_tracing(args.trace_path, args.chrome_trace)
+run = contextlib.ExitStack()
+run_span = run.enter_context(span("diarize_parallel", file=os.path.abspath(args.audio)))
+
+device = resolve_device(args.device)
+if args.quantize and device != "cpu":
+    parser.error("--quantize needs the cpu device")
+
+nemo_command = [
+    "python3",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "nemo_process.py"),
+    "--work-dir",
+    temp_path,
+    "--device",
+    device,
+]
+device_name = device
+if device == "cpu":
+    cores = available_cores()
+    # Whisper and NeMo run side by side on disjoint cores instead of
+    # oversubscribing all of them
+    nemo_cores, whisper_cores = partition_cores(
+        cores, [args.nemo_share, 1 - args.nemo_share]
+    )
+    nemo_command += ["--cores", format_cores(nemo_cores)]
+    device_name = f"{len(cores)} cpu cores"
+    pin_to_cores(whisper_cores)
     print(
-        f'Punctuation restoration is not available for {whisper_results["language"]} language.'
+        f"Whisper on cores {format_cores(whisper_cores)}, "
+        f"NeMo on cores {format_cores(nemo_cores)}"
     )
+if args.trace_path:
+    nemo_command += ["--trace", args.trace_path]
 
-ssm = get_sentences_speaker_mapping(wsm, speaker_ts)
 
-os.chdir(ROOT)  # back to parent dir
-with open(f"{args.audio[:-4]}.txt", "w", encoding="utf-8-sig") as f:
-    get_speaker_aware_transcript(ssm, f)
+def separation():
+    if args.stemming:
+        # Isolate vocals from the rest of the audio, skipped if there is no music
+        vocals = separate_vocals(args.audio, device, model="htdemucs_ft")
+        if vocals is not None:
+            return vocals
+    return args.audio
 
-with open(f"{args.audio[:-4]}.srt", "w", encoding="utf-8-sig") as srt:
-    write_srt(ssm, srt)
 
-cleanup(temp_path)
+def ingest(vocal_target):
+    # Decode the audio once, NeMo reads the buffer file and Whisper its samples
+    audio = ingest_audio(vocal_target, temp_path)
+    run_span.audio_seconds = audio.duration
+    return audio
+
+
+def diarization(audio):
+    # NeMo runs in its own process, its log is streamed as it comes
+    graph.run_process(nemo_command + ["-a", audio.path], "nemo")
+    output_dir = os.path.join(temp_path, "nemo_outputs")
+    return read_rttm(f"{output_dir}/pred_rttms/{rttm_name(audio.path)}.rttm")
+
+
+def vad(audio):
+    if not args.vad:
+        return audio, None
+    # Cut silences and intros out of what Whisper transcribes
+    speech_map = SpeechMap(
+        energy_speech_regions(audio.samples, audio.sample_rate), audio.duration
+    )
+    print(
+        f"Transcribing {speech_map.speech_seconds:.1f} s of speech "
+        f"out of {audio.duration:.1f} s"
+    )
+    return speech_map.gate(audio.samples, audio.sample_rate), speech_map
+
+
+def transcription(whisper_model, gated):
+    whisper_audio, speech_map = gated
+    if speech_map is not None and not speech_map.speech_seconds:
+        # nothing for Whisper to transcribe, the transcript is empty
+        print("No speech found, writing an empty transcript")
+        return {"text": "", "segments": [], "language": None}
+    return transcribe(whisper_model, whisper_audio)
+
+
+def alignment(whisper_results, gated):
+    # the Whisper model is freed by now, give its memory back to NeMo
+    torch.cuda.empty_cache()
+    if not whisper_results["segments"]:
+        return []
+    whisper_audio, speech_map = gated
+    word_segments = align(
+        whisper_results, whisper_audio, device, quantize=args.quantize
+    )
+    if speech_map is not None:
+        # back from the joined speech to the timeline of the recording
+        word_segments = speech_map.restore_timestamps(word_segments)
+    return word_segments
+
+
+def load_punctuation(whisper_results):
+    if whisper_results["language"] in punct_model_langs:
+        # restoring punctuation in the transcript to help realign the sentences
+        return PunctuationRestorer()
+
+
+def punctuation(word_segments, whisper_results, punct_model):
+    return punctuate(word_segments, whisper_results["language"], punct_model)
+
+
+def write(word_segments, speaker_ts, whisper_results, labled_words):
+    # words are mapped to speakers and sentences while the outputs are written
+    return write_transcripts(
+        word_segments,
+        speaker_ts,
+        whisper_results["language"],
+        None,
+        args.audio[:-4],
+        args.output_formats,
+        labled_words=labled_words,
+    )
+
+
+# Every stage starts as soon as its inputs are ready: Whisper loads during the
+# separation, NeMo diarizes during transcription and alignment, and the
+# punctuation model runs before the diarization is done
+graph = StageGraph()
+graph.add("separation", separation)
+graph.add("ingest", ingest, "separation")
+# Large models result in considerably better and more aligned (words, timestamps) mapping.
+graph.add("load_whisper", lambda: load_whisper(args.model_name, device, args.quantize))
+graph.add("vad", vad, "ingest")
+graph.add("transcription", transcription, "load_whisper", "vad")
+graph.add("diarization", diarization, "ingest")
+graph.add("alignment", alignment, "transcription", "vad")
+graph.add("load_punctuation", load_punctuation, "transcription")
+graph.add("punctuation", punctuation, "alignment", "transcription", "load_punctuation")
+graph.add("write", write, "alignment", "diarization", "transcription", "punctuation")
+
+try:
+    graph.run()
+finally:
+    cleanup(temp_path)
+
+run.close()
+stop_tracing()
+print(f"Critical path: {graph.format_critical_path()}")
+print(
+    f"{run_span.audio_seconds:.1f} s of audio processed in "
+    f"{run_span.wall_seconds:.1f} s on {device_name}, "
+    f"real-time factor {run_span.rtf:.3f}"
+)
@@ -0,0 +1,218 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import socketserver
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from helpers import *
+from whisper import load_model
+import whisperx
+import torch
+from pipeline import (
+    separate_vocals,
+    transcribe,
+    align,
+    load_diarizer,
+    diarize,
+    speaker_sentences,
+)
+from ingest import ingest_audio
+from punctuation import PunctuationRestorer
+from transcript_writers import DEFAULT_FORMATS, render_transcripts
+
+
+class AlignModelCache:
+    """whisperx alignment models per language, the least recently used one is evicted first."""
+
+    def __init__(self, device, maxsize=2):
+        self.device = device
+        self.maxsize = maxsize
+        self.models = OrderedDict()
+
+    def get(self, language):
+        if language in self.models:
+            self.models.move_to_end(language)
+            return self.models[language]
+
+        self.models[language] = whisperx.load_align_model(
+            language_code=language, device=self.device
+        )
+        if len(self.models) > self.maxsize:
+            self.models.popitem(last=False)
+            torch.cuda.empty_cache()
+        return self.models[language]
+
+
+class DiarizationWorker:
+    """Keeps every model of the pipeline loaded and processes one job at a time."""
+
+    def __init__(
+        self,
+        model_name,
+        device,
+        temp_path,
+        stemming=True,
+        align_cache_size=2,
+        domain_type="telephonic",
+    ):
+        self.device = device
+        self.temp_path = temp_path
+        self.stemming = stemming
+        self.whisper_model = load_model(model_name, device=device)
+        self.align_models = AlignModelCache(device, align_cache_size)
+        self.msdd_model = load_diarizer(temp_path, device, domain_type)
+        self.punct_model = PunctuationRestorer()
+        self.lock = threading.Lock()
+
+    def process(self, job):
+        audio = job["audio"]
+        with self.lock:
+            job_path = tempfile.mkdtemp(prefix="job_", dir=self.temp_path)
+            try:
+                vocal_target = audio
+                if job.get("stemming", self.stemming):
+                    vocals = separate_vocals(audio, self.device)
+                    if vocals is not None:
+                        vocal_target = vocals
+
+                # decode once into the buffer shared by every stage
+                audio_buffer = ingest_audio(vocal_target, job_path)
+
+                whisper_results = transcribe(self.whisper_model, audio_buffer)
+                language = whisper_results["language"]
+                alignment_model, metadata = self.align_models.get(language)
+                word_segments = align(
+                    whisper_results,
+                    audio_buffer,
+                    self.device,
+                    alignment_model,
+                    metadata,
+                )
+                speaker_ts = diarize(
+                    audio_buffer, job_path, self.device, self.msdd_model
+                )
+
+                formats = job.get("output_formats", DEFAULT_FORMATS)
+                outputs = {fmt: io.StringIO() for fmt in formats}
+                ssm = speaker_sentences(
+                    word_segments,
+                    speaker_ts,
+                    language,
+                    self.punct_model,
+                    segments=whisper_results["segments"],
+                    punct_mode=job.get("punct_mode", "model"),
+                    with_words=job.get("word_level", False),
+                )
+                render_transcripts(ssm, outputs, language)
+            finally:
+                cleanup(job_path)
+
+        return {
+            "language": language,
+            **{fmt: output.getvalue() for fmt, output in outputs.items()},
+        }
+
+    def handle_line(self, line):
+        """Run the job of one JSON line and return the JSON line of its response."""
+        job = {}
+        try:
+            job = json.loads(line)
+            response = {"status": "ok", **self.process(job)}
+        except Exception as e:
+            response = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+        response["id"] = job.get("id")
+        response["audio"] = job.get("audio")
+        return json.dumps(response) + "\n"
+
+
+def serve_stdin(worker):
+    # model logs go to stderr, stdout only carries the responses
+    responses = sys.stdout
+    with contextlib.redirect_stdout(sys.stderr):
+        for line in sys.stdin:
+            if line.strip():
+                responses.write(worker.handle_line(line))
+                responses.flush()
+
+
+def serve_socket(worker, socket_path):
+    class JobHandler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                if line.strip():
+                    self.wfile.write(worker.handle_line(line).encode("utf-8"))
+                    self.wfile.flush()
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    with socketserver.ThreadingUnixStreamServer(socket_path, JobHandler) as server:
+        print(f"Listening on {socket_path}", file=sys.stderr)
+        try:
+            server.serve_forever()
+        finally:
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Long-running worker that keeps the models loaded between jobs. "
+        'Jobs are JSON lines like {"id": 1, "audio": "/abs/path.wav", "stemming": false, '
+        '"punct_mode": "whisper"}, '
+        "read from stdin or from a Unix socket."
+    )
+    parser.add_argument(
+        "--socket",
+        dest="socket_path",
+        default=None,
+        help="path of the Unix socket to listen on, jobs are read from stdin if not given",
+    )
+    parser.add_argument(
+        "--no-stem",
+        action="store_false",
+        dest="stemming",
+        default=True,
+        help="Disables source separation for jobs that don't ask for it.",
+    )
+    parser.add_argument(
+        "--whisper-model",
+        dest="model_name",
+        default="large",
+        help="name of the Whisper model to use",
+    )
+    parser.add_argument(
+        "--align-cache-size",
+        type=int,
+        default=2,
+        help="number of alignment models (one per language) kept loaded",
+    )
+    parser.add_argument(
+        "--domain-type",
+        choices=DOMAIN_TYPES,
+        default="telephonic",
+        help="NeMo diarization profile",
+    )
+    args = parser.parse_args()
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    temp_path = create_workspace(prefix="diarize_worker_")
+    with contextlib.redirect_stdout(sys.stderr):
+        worker = DiarizationWorker(
+            args.model_name,
+            device,
+            temp_path,
+            args.stemming,
+            args.align_cache_size,
+            args.domain_type,
+        )
+
+    try:
+        if args.socket_path:
+            serve_socket(worker, args.socket_path)
+        else:
+            serve_stdin(worker)
+    finally:
+        cleanup(temp_path)
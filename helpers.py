@@ -1,10 +1,14 @@
 import os
-import wget
+import numpy as np
+import copy
 from omegaconf import OmegaConf
 import json
+import re
+import itertools
 import shutil
-# For profiling performance bottlenecks
-import time
+import tempfile
+from collections import Counter
+from functools import lru_cache
 
 punct_model_langs = [
     "en",
@@ -43,64 +47,186 @@ wav2vec2_langs = [
 ]
 
 
-def create_config():
-    data_dir = "./"
-    DOMAIN_TYPE = "telephonic"  # Can be meeting or telephonic based on domain type of the audio file
-    CONFIG_FILE_NAME = f"diar_infer_{DOMAIN_TYPE}.yaml"
-    CONFIG_URL = f"https://raw.githubusercontent.com/NVIDIA/NeMo/main/examples/speaker_tasks/diarization/conf/inference/{CONFIG_FILE_NAME}"
-    MODEL_CONFIG = os.path.join(data_dir, CONFIG_FILE_NAME)
-    if not os.path.exists(MODEL_CONFIG):
-        MODEL_CONFIG = wget.download(CONFIG_URL, data_dir)
-
-    config = OmegaConf.load(MODEL_CONFIG)
-
-    ROOT = os.getcwd()
-    data_dir = os.path.join(ROOT, "data")
-    os.makedirs(data_dir, exist_ok=True)
-
-    meta = {
-        "audio_filepath": "mono_file.wav",
-        "offset": 0,
-        "duration": None,
-        "label": "infer",
-        "text": "-",
-        "rttm_filepath": None,
-        "uem_filepath": None,
-    }
-    with open("data/input_manifest.json", "w") as fp:
-        json.dump(meta, fp)
-        fp.write("\n")
-
-    pretrained_vad = "vad_multilingual_marblenet"
-    pretrained_speaker_model = "titanet_large"
+# NeMo diarization configs bundled with the repo, one per domain type
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+NEMO_CONFIG_VERSION = "1.17.0"
+DOMAIN_TYPES = ("telephonic", "meeting")
+
+
+@lru_cache(maxsize=None)
+def load_nemo_config(domain_type="telephonic"):
+    """Loads the bundled config of a domain type once, callers get a deep copy."""
+    if domain_type not in DOMAIN_TYPES:
+        raise ValueError(
+            f"Unknown domain type {domain_type}, expected one of {DOMAIN_TYPES}"
+        )
+    return OmegaConf.load(os.path.join(CONFIG_DIR, f"diar_infer_{domain_type}.yaml"))
+
+
+def create_config(
+    audio_filepath="mono_file.wav", domain_type="telephonic", work_dir="."
+):
+    """
+    Returns the NeMo diarization config of the telephonic or meeting profile,
+    and writes the manifest of audio_filepath, a path or a list of paths.
+
+    The manifest and NeMo outputs go to absolute paths inside work_dir, so the
+    config doesn't depend on the working directory of the process.
+    """
+    config = copy.deepcopy(load_nemo_config(domain_type))
+    work_dir = os.path.abspath(work_dir)
+
+    manifest_path = os.path.join(work_dir, "data", "input_manifest.json")
+    write_manifest(audio_filepath, manifest_path)
 
     config.num_workers = 1  # Workaround for multiprocessing hanging with ipython issue
 
-    output_dir = "nemo_outputs"  # os.path.join(ROOT, 'outputs')
+    output_dir = os.path.join(work_dir, "nemo_outputs")
     os.makedirs(output_dir, exist_ok=True)
-    config.diarizer.manifest_filepath = "data/input_manifest.json"
+    config.diarizer.manifest_filepath = manifest_path
     config.diarizer.out_dir = (
         output_dir  # Directory to store intermediate files and prediction outputs
     )
 
-    config.diarizer.speaker_embeddings.model_path = pretrained_speaker_model
-    config.diarizer.oracle_vad = (
-        False  # compute VAD provided with model_path to vad config
-    )
-    config.diarizer.clustering.parameters.oracle_num_speakers = False
-
-    # Here, we use our in-house pretrained NeMo VAD model
-    config.diarizer.vad.model_path = pretrained_vad
-    config.diarizer.vad.parameters.onset = 0.8
-    config.diarizer.vad.parameters.offset = 0.6
-    config.diarizer.vad.parameters.pad_offset = -0.05
-    config.diarizer.msdd_model.model_path = (
-        "diar_msdd_telephonic"  # Telephonic speaker diarization model
-    )
-
     return config
 
 
+def write_manifest(audio_filepaths, manifest_path="data/input_manifest.json"):
+    """
+    Writes one manifest line per audio file, NeMo diarizes all of them in a
+    single call and names each RTTM after the file name without extension.
+
+    """
+    if isinstance(audio_filepaths, str):
+        audio_filepaths = [audio_filepaths]
+    names = [os.path.splitext(os.path.basename(path))[0] for path in audio_filepaths]
+    if len(set(names)) != len(names):
+        raise ValueError("Audio files diarized together need distinct file names")
+
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path, "w") as fp:
+        for audio_filepath in audio_filepaths:
+            meta = {
+                "audio_filepath": audio_filepath,
+                "offset": 0,
+                "duration": None,
+                "label": "infer",
+                "text": "-",
+                "rttm_filepath": None,
+                "uem_filepath": None,
+            }
+            json.dump(meta, fp)
+            fp.write("\n")
+
+
+class SpeakerTimeline:
+    """
+    Speaker turns stored as three NumPy columns, start and end in milliseconds
+    and the integer speaker label, in the order NeMo writes them (by start).
+
+    Indexing and iterating yield (start, end, speaker) tuples, so a timeline
+    can be used wherever a speaker_ts list of [start, end, speaker] is.
+    """
+
+    def __init__(self, starts, ends, labels):
+        self.starts = np.asarray(starts, dtype=np.int64)
+        self.ends = np.asarray(ends, dtype=np.int64)
+        self.labels = np.asarray(labels, dtype=np.int64)
+        # running maximum of the ends, turns before i can't cover t past it
+        self._max_ends = (
+            np.maximum.accumulate(self.ends) if len(self.ends) else self.ends
+        )
+
+    @classmethod
+    def from_list(cls, speaker_ts):
+        turns = np.asarray(speaker_ts, dtype=np.int64).reshape(-1, 3)
+        return cls(turns[:, 0], turns[:, 1], turns[:, 2])
+
+    @classmethod
+    def from_rttm(cls, path):
+        """
+        Parse a whole RTTM file at once, e.g. lines like
+        SPEAKER mono_file 1   0.500   2.130 <NA> <NA> speaker_0 <NA> <NA>
+
+        """
+        with open(path, "r") as f:
+            tokens = f.read().split()
+        if not tokens:  # NeMo writes an empty RTTM when nobody speaks
+            return cls([], [], [])
+        if len(tokens) % 10 == 0:
+            fields = np.array(tokens, dtype=str).reshape(-1, 10)[:, [3, 4, 7]]
+        else:  # lines with a non standard number of fields
+            with open(path, "r") as f:
+                fields = np.array(
+                    [
+                        (line_list[3], line_list[4], line_list[7])
+                        for line_list in map(str.split, f)
+                        if line_list
+                    ],
+                    dtype=str,
+                ).reshape(-1, 3)
+
+        # same truncation as int(float(x) * 1000)
+        starts = (fields[:, 0].astype(np.float64) * 1000).astype(np.int64)
+        durations = (fields[:, 1].astype(np.float64) * 1000).astype(np.int64)
+        labels = np.char.rpartition(fields[:, 2], "_")[:, 2].astype(np.int64)
+        return cls(starts, starts + durations, labels)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, idx):
+        return int(self.starts[idx]), int(self.ends[idx]), int(self.labels[idx])
+
+    def __iter__(self):
+        return zip(self.starts.tolist(), self.ends.tolist(), self.labels.tolist())
+
+    def to_list(self):
+        return [list(turn) for turn in self]
+
+    def speaker_at(self, t):
+        """Returns the speaker talking at t milliseconds, or None in a gap."""
+        idx = int(np.searchsorted(self.starts, t, side="right")) - 1
+        # walk back only through turns that can still cover t (overlaps)
+        while idx >= 0 and self._max_ends[idx] > t:
+            if self.ends[idx] > t:
+                return int(self.labels[idx])
+            idx -= 1
+        return None
+
+    def speakers_at(self, times, missing=-1):
+        """Vectorized speaker_at for non-overlapping turns, gaps get missing."""
+        times = np.asarray(times)
+        idx = np.searchsorted(self.starts, times, side="right") - 1
+        safe_idx = np.maximum(idx, 0)
+        covered = (idx >= 0) & (self.ends[safe_idx] > times)
+        return np.where(covered, self.labels[safe_idx], missing)
+
+    def speaker_totals(self):
+        """Returns {speaker: total speaking time in milliseconds}."""
+        speakers, inverse = np.unique(self.labels, return_inverse=True)
+        totals = np.bincount(inverse, weights=self.ends - self.starts)
+        return dict(zip(speakers.tolist(), totals.astype(np.int64).tolist()))
+
+    def merge_adjacent(self, max_gap=0):
+        """Returns a timeline where consecutive turns of the same speaker separated
+        by at most max_gap milliseconds are merged into one."""
+        if len(self) < 2:
+            return SpeakerTimeline(self.starts, self.ends, self.labels)
+        # running maximum of the ends restarted at every change of speaker
+        run = np.cumsum(np.concatenate(([0], self.labels[1:] != self.labels[:-1])))
+        shift = run * (int(self.ends.max()) + 1)
+        run_ends = np.maximum.accumulate(self.ends + shift) - shift
+        joins = (self.labels[1:] == self.labels[:-1]) & (
+            self.starts[1:] - run_ends[:-1] <= max_gap
+        )
+        first = np.concatenate(([True], ~joins))
+        group = np.cumsum(first) - 1
+        ends = np.zeros(group[-1] + 1, dtype=np.int64)
+        np.maximum.at(ends, group, self.ends)
+        return SpeakerTimeline(self.starts[first], ends, self.labels[first])
+
+
 def get_word_ts_anchor(s, e, option="start"):
     if option == "end":
         return e
@@ -110,151 +236,347 @@ def get_word_ts_anchor(s, e, option="start"):
 
 
 def get_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option="start"):
-    s, e, sp = spk_ts[0]
-    wrd_pos, turn_idx = 0, 0
-    wrd_spk_mapping = []
-    for wrd_dict in wrd_ts:
-        ws, we, wrd = (
-            int(wrd_dict["start"] * 1000),
-            int(wrd_dict["end"] * 1000),
-            wrd_dict["text"],
-        )
-        wrd_pos = get_word_ts_anchor(ws, we, word_anchor_option)
-        while wrd_pos > float(e):
-            turn_idx += 1
-            turn_idx = min(turn_idx, len(spk_ts) - 1)
-            s, e, sp = spk_ts[turn_idx]
-            if turn_idx == len(spk_ts) - 1:
-                e = get_word_ts_anchor(ws, we, option="end")
-        wrd_spk_mapping.append(
-            {"word": wrd, "start_time": ws, "end_time": we, "speaker": sp}
-        )
-    return wrd_spk_mapping
+    return list(iter_words_speaker_mapping(wrd_ts, spk_ts, word_anchor_option))
 
 
-sentence_ending_punctuations = ".?!"
+def assign_words_to_speakers(
+    word_starts,
+    word_ends,
+    turn_starts,
+    turn_ends,
+    turn_labels,
+    option="start",
+    anchor_floor=None,
+):
+    """
+    Vectorized word -> speaker assignment, returns one label per word.
+
+    "start", "mid" and "end" pick the first turn ending at or after the word
+    anchor, like the original sequential walk, and the last turn absorbs every
+    word past the end of the timeline. anchor_floor is the largest anchor of
+    the words before these ones, when they are assigned in blocks. "overlap"
+    picks the turn sharing the most time with the word and works with
+    overlapping turns.
+    """
+    word_starts = np.asarray(word_starts)
+    word_ends = np.asarray(word_ends)
+    turn_starts = np.asarray(turn_starts)
+    turn_ends = np.asarray(turn_ends)
+    turn_labels = np.asarray(turn_labels)
+    if len(turn_labels) == 0:
+        raise ValueError("at least one speaker turn is required")
+
+    if option == "overlap":
+        return turn_labels[
+            _max_overlap_turn_idx(word_starts, word_ends, turn_starts, turn_ends)
+        ]
+    anchors = get_word_ts_anchor(word_starts, word_ends, option)
+    if anchor_floor is not None:
+        anchors = np.maximum(anchors, anchor_floor)
+    return turn_labels[_anchor_turn_idx(anchors, turn_ends)]
+
+
+def _anchor_turn_idx(anchors, turn_ends):
+    # The sequential walk never moves back, so a word is compared against the
+    # running maximum of the anchors, and the first turn whose end reaches the
+    # anchor is also the first one whose running maximum end does.
+    anchors = np.maximum.accumulate(anchors) if len(anchors) else anchors
+    idx = np.searchsorted(np.maximum.accumulate(turn_ends), anchors, side="left")
+    return np.minimum(idx, len(turn_ends) - 1)
+
+
+def _max_overlap_turn_idx(word_starts, word_ends, turn_starts, turn_ends):
+    # ties go to the turn that starts first, as in a walk over the turns
+    order = np.argsort(turn_starts, kind="stable")
+    rank = np.argsort(order)
+
+    best_idx = _anchor_turn_idx(
+        get_word_ts_anchor(word_starts, word_ends, "start"), turn_ends
+    )  # fallback for words in gaps
+    best_rank = rank[best_idx]
+    best_overlap = np.zeros(len(word_starts), dtype=np.int64)
+    if not len(word_starts):
+        return best_idx
+
+    # Turns are searched by length class, powers of two. Only the turns of a
+    # class starting in [word_start - longest turn of the class, word_end) can
+    # overlap a word, and as they are at least half as long as the longest,
+    # few of them fit there: one long turn doesn't widen the search of the
+    # short ones.
+    lengths = np.maximum(turn_ends - turn_starts, 1)
+    length_class = np.ceil(np.log2(lengths)).astype(np.int64)
+    for cls in np.unique(length_class):
+        members = order[length_class[order] == cls]
+        starts, ends = turn_starts[members], turn_ends[members]
+        longest = int((ends - starts).max())
+        lo = np.searchsorted(starts, word_starts - longest, side="left")
+        hi = np.searchsorted(starts, word_ends, side="left")
+        for offset in range(int((hi - lo).max())):
+            idx = lo + offset
+            valid = idx < hi
+            idx = np.where(valid, idx, 0)
+            overlap = np.minimum(word_ends, ends[idx]) - np.maximum(
+                word_starts, starts[idx]
+            )
+            candidate_rank = rank[members[idx]]
+            better = valid & (
+                (overlap > best_overlap)
+                | (
+                    (overlap == best_overlap)
+                    & (overlap > 0)
+                    & (candidate_rank < best_rank)
+                )
+            )
+            best_overlap = np.where(better, overlap, best_overlap)
+            best_idx = np.where(better, members[idx], best_idx)
+            best_rank = np.where(better, candidate_rank, best_rank)
 
+    return best_idx
 
-def get_first_word_idx_of_sentence(word_idx, word_list, speaker_list, max_words):
-    is_word_sentence_end = (
-        lambda x: x >= 0 and word_list[x][-1] in sentence_ending_punctuations
-    )
-    left_idx = word_idx
-    while (
-        left_idx > 0
-        and word_idx - left_idx < max_words
-        and speaker_list[left_idx - 1] == speaker_list[left_idx]
-        and not is_word_sentence_end(left_idx - 1)
-    ):
-        left_idx -= 1
 
-    return left_idx if left_idx == 0 or is_word_sentence_end(left_idx - 1) else -1
+def iter_words_speaker_mapping(
+    wrd_ts, spk_ts, word_anchor_option="start", block_size=1 << 16
+):
+    """
+    Streaming counterpart of get_words_speaker_mapping, yields one dict per
+    word. Words are assigned with assign_words_to_speakers block_size at a
+    time, so only one block of timestamps is held in arrays.
+    """
+    if not isinstance(spk_ts, SpeakerTimeline):
+        spk_ts = SpeakerTimeline.from_list(spk_ts)
+    wrd_ts = iter(wrd_ts)
+    anchor_floor = None
+    while block := list(itertools.islice(wrd_ts, block_size)):
+        times = np.fromiter(
+            (t for wrd_dict in block for t in (wrd_dict["start"], wrd_dict["end"])),
+            dtype=np.float64,
+            count=2 * len(block),
+        ).reshape(-1, 2)
+        # same truncation as int(t * 1000)
+        word_starts, word_ends = (times * 1000).astype(np.int64).T
+        speakers = assign_words_to_speakers(
+            word_starts,
+            word_ends,
+            spk_ts.starts,
+            spk_ts.ends,
+            spk_ts.labels,
+            word_anchor_option,
+            anchor_floor,
+        )
+        if word_anchor_option != "overlap":
+            # the sequential walk never moves back, not even across blocks
+            anchors = get_word_ts_anchor(word_starts, word_ends, word_anchor_option)
+            anchor_floor = max(anchors.max(), anchor_floor or 0)
+        for wrd_dict, ws, we, sp in zip(
+            block, word_starts.tolist(), word_ends.tolist(), speakers.tolist()
+        ):
+            yield {
+                "word": wrd_dict["text"],
+                "start_time": ws,
+                "end_time": we,
+                "speaker": sp,
+            }
+
 
+# We don't want to punctuate U.S.A. with a period. Right?
+is_acronym = re.compile(r"\b(?:[a-zA-Z]\.){2,}").fullmatch
 
-def get_last_word_idx_of_sentence(word_idx, word_list, max_words):
-    is_word_sentence_end = (
-        lambda x: x >= 0 and word_list[x][-1] in sentence_ending_punctuations
-    )
-    right_idx = word_idx
-    while (
-        right_idx < len(word_list)
-        and right_idx - word_idx < max_words
-        and not is_word_sentence_end(right_idx)
-    ):
-        right_idx += 1
 
-    return (
-        right_idx
-        if right_idx == len(word_list) - 1 or is_word_sentence_end(right_idx)
-        else -1
-    )
+def iter_punctuated_words(word_speaker_mapping, labeled_words):
+    """Adds the sentence ending punctuation predicted by the punctuation model."""
+    ending_puncts = ".?!"
+    model_puncts = ".,;:!?"
+
+    for word_dict, labeled_tuple in zip(word_speaker_mapping, labeled_words):
+        word = word_dict["word"]
+        if (
+            word
+            and labeled_tuple[1] in ending_puncts
+            and (word[-1] not in model_puncts or is_acronym(word))
+        ):
+            word += labeled_tuple[1]
+            if word.endswith(".."):
+                word = word.rstrip(".")
+            word_dict["word"] = word
+        yield word_dict
+
+
+sentence_ending_punctuations = ".?!"
 
 
 def get_realigned_ws_mapping_with_punctuation(
     word_speaker_mapping, max_words_in_sentence=50
 ):
-    is_word_sentence_end = (
-        lambda x: x >= 0
-        and word_speaker_mapping[x]["word"][-1] in sentence_ending_punctuations
-    )
     wsp_len = len(word_speaker_mapping)
-
-    words_list, speaker_list = [], []
-    for k, line_dict in enumerate(word_speaker_mapping):
-        word, speaker = line_dict["word"], line_dict["speaker"]
-        words_list.append(word)
-        speaker_list.append(speaker)
+    speaker_list = [line_dict["speaker"] for line_dict in word_speaker_mapping]
+    is_sentence_end = [
+        line_dict["word"][-1:] in sentence_ending_punctuations
+        and line_dict["word"] != ""
+        for line_dict in word_speaker_mapping
+    ]
+
+    # sentence_start[k]: first word after the closest sentence end before k
+    # run_start[k]: first word of the same-speaker run containing k
+    sentence_start, run_start = [0] * wsp_len, [0] * wsp_len
+    for k in range(1, wsp_len):
+        sentence_start[k] = k if is_sentence_end[k - 1] else sentence_start[k - 1]
+        run_start[k] = k if speaker_list[k] != speaker_list[k - 1] else run_start[k - 1]
+
+    # next_end[k]: first sentence end at or after k, wsp_len if there is none
+    next_end = [wsp_len] * (wsp_len + 1)
+    for k in range(wsp_len - 1, -1, -1):
+        next_end[k] = k if is_sentence_end[k] else next_end[k + 1]
 
     k = 0
-    while k < len(word_speaker_mapping):
-        line_dict = word_speaker_mapping[k]
-        if (
-            k < wsp_len - 1
-            and speaker_list[k] != speaker_list[k + 1]
-            and not is_word_sentence_end(k)
-        ):
-            left_idx = get_first_word_idx_of_sentence(
-                k, words_list, speaker_list, max_words_in_sentence
-            )
-            right_idx = (
-                get_last_word_idx_of_sentence(
-                    k, words_list, max_words_in_sentence - k + left_idx - 1
-                )
-                if left_idx > -1
-                else -1
-            )
-            if min(left_idx, right_idx) == -1:
-                k += 1
-                continue
-
-            spk_labels = speaker_list[left_idx : right_idx + 1]
-            mod_speaker = max(set(spk_labels), key=spk_labels.count)
-            if spk_labels.count(mod_speaker) < len(spk_labels) // 2:
-                k += 1
-                continue
-
-            speaker_list[left_idx : right_idx + 1] = [mod_speaker] * (
-                right_idx - left_idx + 1
-            )
-            k = right_idx
+    while k < wsp_len - 1:
+        if speaker_list[k] == speaker_list[k + 1] or is_sentence_end[k]:
+            k += 1
+            continue
+
+        # the sentence around the speaker change: it starts after the last
+        # sentence end in the same speaker run and ends at the next one
+        left_idx = sentence_start[k]
+        if left_idx < run_start[k] or left_idx < k - max_words_in_sentence:
+            k += 1
+            continue
+        right_limit = max(max_words_in_sentence - k + left_idx - 1, 0)
+        right_idx = min(next_end[k], k + right_limit, wsp_len - 1)
+        if not (right_idx == wsp_len - 1 or is_sentence_end[right_idx]):
+            k += 1
+            continue
+
+        spk_labels = speaker_list[left_idx : right_idx + 1]
+        spk_counts = Counter(spk_labels)
+        mod_speaker = max(set(spk_labels), key=spk_counts.__getitem__)
+        if spk_counts[mod_speaker] < len(spk_labels) // 2:
+            k += 1
+            continue
+
+        speaker_list[left_idx : right_idx + 1] = [mod_speaker] * (
+            right_idx - left_idx + 1
+        )
+        k = right_idx + 1
 
-        k += 1
+    # only words that changed speaker are copied
+    return [
+        line_dict
+        if line_dict["speaker"] == speaker
+        else {**line_dict, "speaker": speaker}
+        for line_dict, speaker in zip(word_speaker_mapping, speaker_list)
+    ]
 
-    k, realigned_list = 0, []
-    while k < len(word_speaker_mapping):
-        line_dict = word_speaker_mapping[k].copy()
-        line_dict["speaker"] = speaker_list[k]
-        realigned_list.append(line_dict)
-        k += 1
 
-    return realigned_list
+def iter_realigned_ws_mapping_with_punctuation(
+    word_speaker_mapping, max_words_in_sentence=50
+):
+    """
+    Streaming counterpart of get_realigned_ws_mapping_with_punctuation.
+
+    A sentence can only be realigned when it fits in max_words_in_sentence
+    words, so at most one word more than that is held back before being yielded.
+    """
+    sentence = []
+    overflow = False  # current sentence is too long to be realigned
+
+    for line_dict in word_speaker_mapping:
+        is_sentence_end = (
+            line_dict["word"] != ""
+            and line_dict["word"][-1] in sentence_ending_punctuations
+        )
+        if overflow:
+            yield line_dict
+            overflow = not is_sentence_end
+            continue
+
+        sentence.append(line_dict)
+        if len(sentence) > max_words_in_sentence:
+            yield from sentence
+            sentence = []
+            overflow = not is_sentence_end
+        elif is_sentence_end:
+            yield from _realign_sentence(sentence)
+            sentence = []
+
+    yield from _realign_sentence(sentence)
+
+
+def _realign_sentence(sentence):
+    spk_labels = [line_dict["speaker"] for line_dict in sentence]
+    if len(set(spk_labels)) < 2:
+        return sentence
+
+    spk_counts = Counter(spk_labels)
+    mod_speaker = max(set(spk_labels), key=spk_counts.__getitem__)
+    if spk_counts[mod_speaker] < len(spk_labels) // 2:
+        return sentence
+
+    return [
+        line_dict
+        if line_dict["speaker"] == mod_speaker
+        else {**line_dict, "speaker": mod_speaker}
+        for line_dict in sentence
+    ]
+
+
+def get_sentences_speaker_mapping(word_speaker_mapping, spk_ts, speaker_names=None):
+    return list(
+        iter_sentences_speaker_mapping(word_speaker_mapping, spk_ts, speaker_names)
+    )
 
 
-def get_sentences_speaker_mapping(word_speaker_mapping, spk_ts):
+def speaker_name(spk, speaker_names=None):
+    if speaker_names and spk in speaker_names:
+        return speaker_names[spk]
+    return f"Speaker {spk}"
+
+
+def iter_sentences_speaker_mapping(
+    word_speaker_mapping, spk_ts, speaker_names=None, with_words=False
+):
+    """
+    Groups words into speaker turns, yielding each one as soon as it closes.
+    Speakers are labeled "Speaker N" unless speaker_names maps N to a name,
+    with_words adds the words of the turn with their timestamps. Without
+    words, e.g. for silent audio, nothing is yielded, whatever spk_ts holds.
+    """
+    word_speaker_mapping = iter(word_speaker_mapping)
+    first_word = next(word_speaker_mapping, None)
+    if first_word is None:
+        return
+    word_speaker_mapping = itertools.chain([first_word], word_speaker_mapping)
     s, e, spk = spk_ts[0]
     prev_spk = spk
 
-    snts = []
-    snt = {"speaker": f"Speaker {spk}", "start_time": s, "end_time": e, "text": ""}
+    snt = {"speaker": speaker_name(spk, speaker_names), "start_time": s, "end_time": e}
+    words = []
+    word_times = []
 
     for wrd_dict in word_speaker_mapping:
         wrd, spk = wrd_dict["word"], wrd_dict["speaker"]
         s, e = wrd_dict["start_time"], wrd_dict["end_time"]
         if spk != prev_spk:
-            snts.append(snt)
+            snt["text"] = "".join(wrd + " " for wrd in words)
+            if with_words:
+                snt["words"] = word_times
+            yield snt
             snt = {
-                "speaker": f"Speaker {spk}",
+                "speaker": speaker_name(spk, speaker_names),
                 "start_time": s,
                 "end_time": e,
-                "text": "",
             }
+            words = []
+            word_times = []
         else:
             snt["end_time"] = e
-        snt["text"] += wrd + " "
+        words.append(wrd)
+        if with_words:
+            word_times.append({"word": wrd, "start_time": s, "end_time": e})
         prev_spk = spk
 
-    snts.append(snt)
-    return snts
+    snt["text"] = "".join(wrd + " " for wrd in words)
+    if with_words:
+        snt["words"] = word_times
+    yield snt
 
 
 def get_speaker_aware_transcript(sentences_speaker_mapping, f):
@@ -284,21 +606,31 @@ def format_timestamp(
     )
 
 
+def format_srt_segment(i, segment):
+    return (
+        f"{i}\n"
+        f"{format_timestamp(segment['start_time'], always_include_hours=True, decimal_marker=',')} --> "
+        f"{format_timestamp(segment['end_time'], always_include_hours=True, decimal_marker=',')}\n"
+        f"{segment['speaker']}: {segment['text'].strip().replace('-->', '->')}\n"
+    )
+
+
 def write_srt(transcript, file):
     """
     Write a transcript to a file in SRT format.
 
     """
     for i, segment in enumerate(transcript, start=1):
-        # write srt lines
-        print(
-            f"{i}\n"
-            f"{format_timestamp(segment['start_time'], always_include_hours=True, decimal_marker=',')} --> "
-            f"{format_timestamp(segment['end_time'], always_include_hours=True, decimal_marker=',')}\n"
-            f"{segment['speaker']}: {segment['text'].strip().replace('-->', '->')}\n",
-            file=file,
-            flush=True,
-        )
+        # write srt lines, flushed by the file buffer rather than per segment
+        file.write(format_srt_segment(i, segment) + "\n")
+
+
+def create_workspace(prefix="diarize_"):
+    """
+    Returns the absolute path of a new private directory for the intermediate
+    files of one job, under $TMPDIR, so concurrent jobs never share files.
+    """
+    return tempfile.mkdtemp(prefix=prefix)
 
 
 def cleanup(path: str):
@@ -312,16 +644,3 @@ def cleanup(path: str):
         shutil.rmtree(path)
     else:
         raise ValueError("Path {} is not a file or dir.".format(path))
-
-def trace_time_usage(callback, *args, **kwargs):
-    start_time = time.time()
-    result = callback(*args, **kwargs)
-    end_time = time.time()
-    time_taken = end_time - start_time
-    function_name = callback.__name__
-    print(f"Time taken for {function_name}: {time_taken:.2f} seconds")
-    return result
-
-def print_time_usage(start_time, end_time, description): 
-    time_taken = end_time - start_time
-    print(f"Time taken for {description}: {time_taken:.2f} seconds")
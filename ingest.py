@@ -0,0 +1,96 @@
+import os
+import struct
+import subprocess
+from dataclasses import dataclass
+import numpy as np
+import soundfile
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class AudioBuffer:
+    """
+    Decoded 16 kHz mono float32 audio shared by every stage of the pipeline.
+
+    samples is a copy-on-write memory map of the data chunk of the float WAV
+    at path, so Whisper and whisperx read it without a copy and NeMo reads
+    the very same file through its manifest.
+    """
+
+    path: str
+    samples: np.ndarray
+    sample_rate: int = SAMPLE_RATE
+
+    @property
+    def duration(self):
+        return len(self.samples) / self.sample_rate
+
+
+def _wav_data_chunk(path):
+    """Returns the byte offset and size of the data chunk of a WAV file."""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        riff, _, wave = struct.unpack("<4sI4s", f.read(12))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(f"{path} is not a WAV file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"{path} has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"data":
+                offset = f.tell()
+                return offset, min(chunk_size, file_size - offset)
+            f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def _is_buffer_file(path):
+    if not path.lower().endswith(".wav"):
+        return False
+    info = soundfile.info(path)
+    return (
+        info.samplerate == SAMPLE_RATE and info.channels == 1 and info.subtype == "FLOAT"
+    )
+
+
+def map_audio_buffer(path):
+    offset, size = _wav_data_chunk(path)
+    samples = np.memmap(
+        path, dtype="<f4", mode="c", offset=offset, shape=(size // 4,)
+    )
+    return AudioBuffer(path=path, samples=samples)
+
+
+def ingest_audio(audio, work_dir, name="mono_file"):
+    """
+    Decode audio once into a 16 kHz mono float32 WAV in work_dir and map it.
+
+    audio can be any file ffmpeg can decode, or a 16 kHz mono array such as
+    separated vocals. Files that already are 16 kHz mono float WAVs are mapped
+    in place.
+    """
+    if isinstance(audio, AudioBuffer):
+        return audio
+    if isinstance(audio, str) and _is_buffer_file(audio):
+        return map_audio_buffer(audio)
+
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(os.path.abspath(work_dir), f"{name}.wav")
+    if isinstance(audio, np.ndarray):
+        soundfile.write(path, audio, SAMPLE_RATE, "FLOAT")
+    else:
+        # fmt: off
+        cmd = [
+            "ffmpeg", "-nostdin", "-threads", "0", "-i", audio,
+            "-ac", "1", "-ar", str(SAMPLE_RATE), "-c:a", "pcm_f32le",
+            "-f", "wav", "-y", path,
+        ]
+        # fmt: on
+        try:
+            subprocess.run(cmd, capture_output=True, check=True)
+        except subprocess.CalledProcessError as e:
+            raise RuntimeError(
+                f"Failed to decode {audio}: {e.stderr.decode(errors='ignore')}"
+            ) from e
+    return map_audio_buffer(path)
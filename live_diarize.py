@@ -0,0 +1,598 @@
+import argparse
+import bisect
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from collections import deque
+import numpy as np
+import soundfile
+import torch
+from helpers import create_workspace, cleanup
+from ingest import SAMPLE_RATE
+from pipeline import load_whisper
+from speaker_enrollment import load_speaker_model, VoicePrintStore
+from transcript_writers import ENCODINGS, SrtWriter
+from cpu_backend import resolve_device, configure_threads
+
+SENTENCE_ENDINGS = (".", "?", "!")
+
+# data chunk sizes written by recorders and pipes that don't know the length yet
+_UNKNOWN_SIZES = (0, 0xFFFFFFFF)
+
+
+class WavStream:
+    """
+    Reads a WAV file or pipe block by block without seeking, so it works on
+    stdin and on a file that is still being written (follow). Blocks are
+    returned as float32 mono samples at the rate of the stream.
+    """
+
+    def __init__(self, stream, follow=False, poll_seconds=0.2, idle_seconds=10.0):
+        self.stream = stream
+        self.follow = follow
+        self.poll_seconds = poll_seconds
+        self.idle_seconds = idle_seconds
+        self._read_header()
+
+    def _read(self, size):
+        """Up to size bytes, fewer only at the end of the stream."""
+        data = b""
+        idle_since = time.monotonic()
+        while len(data) < size:
+            chunk = self.stream.read(size - len(data))
+            if chunk:
+                data += chunk
+                idle_since = time.monotonic()
+            elif not self.follow or time.monotonic() - idle_since > self.idle_seconds:
+                break
+            else:
+                # the file may still grow
+                time.sleep(self.poll_seconds)
+        return data
+
+    def _read_header(self):
+        riff, _, wave = struct.unpack("<4sI4s", self._read(12).ljust(12, b"\0"))
+        if riff != b"RIFF" or wave != b"WAVE":
+            raise ValueError(
+                "the input is not a WAV stream, decode it with e.g. "
+                "ffmpeg -i INPUT -f wav - | python live_diarize.py -a -"
+            )
+        fmt = None
+        while True:
+            header = self._read(8)
+            if len(header) < 8:
+                raise ValueError("the WAV stream has no data chunk")
+            chunk_id, chunk_size = struct.unpack("<4sI", header)
+            if chunk_id == b"data":
+                break
+            data = self._read(chunk_size + (chunk_size & 1))
+            if chunk_id == b"fmt ":
+                fmt = data
+        if fmt is None:
+            raise ValueError("the WAV stream has no fmt chunk")
+
+        format_tag, self.channels, self.sample_rate = struct.unpack("<HHI", fmt[:8])
+        bits = struct.unpack("<H", fmt[14:16])[0]
+        if format_tag == 0xFFFE:
+            # WAVE_FORMAT_EXTENSIBLE, the format is in the sub format GUID
+            format_tag = struct.unpack("<H", fmt[24:26])[0]
+        dtypes = {(1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4"}
+        if (format_tag, bits) not in dtypes:
+            raise ValueError(
+                f"unsupported WAV encoding (format {format_tag}, {bits} bits), "
+                "16 or 32 bit PCM and 32 bit float are supported"
+            )
+        self.dtype = np.dtype(dtypes[format_tag, bits])
+        self.scale = 1.0 if format_tag == 3 else float(2 ** (bits - 1))
+        self.frame_size = self.dtype.itemsize * self.channels
+        # the data size of a file being written isn't final yet
+        self.remaining = (
+            None if self.follow or chunk_size in _UNKNOWN_SIZES else chunk_size
+        )
+
+    def read(self, num_frames):
+        """The next num_frames frames as mono float32, or None at the end."""
+        size = num_frames * self.frame_size
+        if self.remaining is not None:
+            size = min(size, self.remaining)
+        data = self._read(size)
+        data = data[: len(data) - len(data) % self.frame_size]
+        if not data:
+            return None
+        if self.remaining is not None:
+            self.remaining -= len(data)
+        frames = np.frombuffer(data, dtype=self.dtype).reshape(-1, self.channels)
+        return (frames.mean(axis=1) / self.scale).astype(np.float32)
+
+
+class StreamResampler:
+    """
+    Resamples consecutive blocks of a stream to 16 kHz: a windowed sinc low
+    pass below the lower of the two Nyquist rates, then linear interpolation.
+    The filter history and the position of the next output sample carry over
+    from block to block, so there are no seams.
+    """
+
+    def __init__(self, sample_rate, target_rate=SAMPLE_RATE, taps=63):
+        self.ratio = sample_rate / target_rate
+        self.filter = None
+        if sample_rate > target_rate:
+            cutoff = 0.45 * target_rate / sample_rate
+            n = np.arange(taps) - (taps - 1) / 2
+            self.filter = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hanning(taps)
+            self.filter = (self.filter / self.filter.sum()).astype(np.float32)
+            self.history = np.zeros(taps - 1, dtype=np.float32)
+        self.base = 0  # stream index of the first sample of the next block
+        self.position = 0.0  # stream index of the next output sample
+        self.previous = np.float32(0)
+
+    def __call__(self, block):
+        if self.ratio == 1:
+            return block
+        if self.filter is not None:
+            padded = np.concatenate([self.history, block])
+            self.history = padded[len(padded) - len(self.history) :]
+            block = np.convolve(padded, self.filter, mode="valid")
+        last = self.base + len(block) - 1
+        count = int((last - self.position) // self.ratio) + 1
+        count = max(count, 0)
+        positions = self.position + self.ratio * np.arange(count)
+        samples = np.interp(
+            positions - (self.base - 1),
+            np.arange(len(block) + 1),
+            np.concatenate([[self.previous], block]),
+        ).astype(np.float32)
+        self.position += count * self.ratio
+        self.base += len(block)
+        if len(block):
+            self.previous = block[-1]
+        return samples
+
+
+def read_blocks(wav, blocks, block_seconds=0.5, speed=None):
+    """
+    Puts 16 kHz blocks of the WAV stream in the blocks queue as (samples,
+    arrival time), then None. With speed, the stream is fed no faster than
+    speed times real time, to simulate a live source with a file. A full
+    queue stops the reading until the transcription catches up.
+    """
+    resample = StreamResampler(wav.sample_rate)
+    frames = max(1, int(block_seconds * wav.sample_rate))
+    start, fed = time.monotonic(), 0.0
+    try:
+        while (block := wav.read(frames)) is not None:
+            fed += len(block) / wav.sample_rate
+            if speed:
+                time.sleep(max(0.0, start + fed / speed - time.monotonic()))
+            blocks.put((resample(block), time.monotonic()))
+    finally:
+        blocks.put(None)
+
+
+class RollingTranscriber:
+    """
+    Transcribes the audio that isn't final yet, up to window_seconds of it,
+    every time step_seconds of new audio arrived.
+
+    Words become final once two consecutive passes agree on them, or once
+    they are max_latency seconds behind the newest audio, which bounds the
+    latency when the hypotheses keep changing. Final audio is dropped from
+    the window and the last final words are given to Whisper as prompt, so
+    the memory and the cost of a pass stay bounded however long the stream.
+    """
+
+    def __init__(
+        self,
+        whisper_model,
+        language=None,
+        window_seconds=30.0,
+        step_seconds=3.0,
+        max_latency=10.0,
+        prompt_words=40,
+        fp16=False,
+    ):
+        self.whisper_model = whisper_model
+        self.language = language
+        self.window = int(window_seconds * SAMPLE_RATE)
+        self.step = int(step_seconds * SAMPLE_RATE)
+        self.max_latency = max_latency
+        self.fp16 = fp16
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.audio_start = 0.0  # stream time of self.audio[0]
+        self.pending = 0  # samples that arrived since the last pass
+        self.hypothesis = []
+        self.prompt = deque(maxlen=prompt_words)
+
+    @property
+    def audio_end(self):
+        return self.audio_start + len(self.audio) / SAMPLE_RATE
+
+    def feed(self, samples, end_of_stream=False):
+        """Adds samples and returns the words they made final, if any."""
+        self.audio = np.concatenate([self.audio, samples])
+        self.pending += len(samples)
+        final = []
+        while len(self.audio) and (
+            self.pending >= self.step or len(self.audio) > self.window or end_of_stream
+        ):
+            final.extend(self._transcribe(end_of_stream))
+        return final
+
+    def _transcribe(self, end_of_stream):
+        self.pending = 0
+        # the rest of the stream fits in this pass, every word of it is final
+        last_pass = end_of_stream and len(self.audio) <= self.window
+        window = self.audio[: self.window]
+        window_end = self.audio_start + len(window) / SAMPLE_RATE
+        results = self.whisper_model.transcribe(
+            window,
+            language=self.language,
+            initial_prompt=" ".join(self.prompt) or None,
+            condition_on_previous_text=False,
+            word_timestamps=True,
+            fp16=self.fp16,
+            verbose=None,
+        )
+        if self.language is None:
+            # the language of the first pass is kept for the whole stream
+            self.language = results["language"]
+        words = [
+            {
+                "word": word["word"].strip(),
+                "start": self.audio_start + word["start"],
+                "end": self.audio_start + word["end"],
+            }
+            for segment in results["segments"]
+            for word in segment.get("words", ())
+            if word["word"].strip()
+        ]
+
+        if last_pass:
+            final = words
+        else:
+            agreed = 0
+            for previous, word in zip(self.hypothesis, words):
+                if previous["word"] != word["word"]:
+                    break
+                agreed += 1
+            horizon = self.audio_end - self.max_latency
+            if len(self.audio) > self.window:
+                # a full window has to move on, only its last second is kept
+                # in case a word was cut at its end
+                horizon = max(horizon, window_end - 1.0)
+            while agreed < len(words) and words[agreed]["end"] <= horizon:
+                agreed += 1
+            final = words[:agreed]
+        self.hypothesis = words[len(final) :]
+
+        if last_pass:
+            cut = self.audio_end
+        elif final:
+            cut = final[-1]["end"]
+        elif len(self.audio) > self.window:
+            cut = window_end - 1.0
+        else:
+            cut = self.audio_start
+        self._drop(cut)
+        self.prompt.extend(word["word"] for word in final)
+        return final
+
+    def _drop(self, until):
+        drop = min(
+            max(0, round((until - self.audio_start) * SAMPLE_RATE)), len(self.audio)
+        )
+        self.audio = self.audio[drop:]
+        self.audio_start += drop / SAMPLE_RATE
+
+
+class OnlineSpeakers:
+    """
+    Assigns cues to speakers by the cosine similarity of their TitaNet
+    embedding to a running centroid per speaker, new voices get the next
+    "Speaker N". Centroids are the speech duration weighted mean of their
+    cues, only cues of at least min_enroll_seconds refine them.
+    """
+
+    def __init__(
+        self,
+        device,
+        work_dir,
+        threshold=0.6,
+        max_speakers=8,
+        min_seconds=0.5,
+        min_enroll_seconds=1.5,
+    ):
+        self.speaker_model = load_speaker_model(device)
+        self.cue_path = os.path.join(work_dir, "cue.wav")
+        self.store = VoicePrintStore()
+        self.threshold = threshold
+        self.max_speakers = max_speakers
+        self.min_seconds = min_seconds
+        self.min_enroll_seconds = min_enroll_seconds
+        self.last = "Speaker 0"
+
+    def embedding(self, samples):
+        soundfile.write(self.cue_path, samples, SAMPLE_RATE)
+        with torch.no_grad():
+            embedding = self.speaker_model.get_embedding(self.cue_path)
+        return embedding.squeeze().cpu().numpy()
+
+    def assign(self, samples):
+        seconds = len(samples) / SAMPLE_RATE
+        if seconds < self.min_seconds:
+            # too short to tell, most likely the speaker of the previous cue
+            return self.last
+        embedding = self.embedding(samples)
+        name = self.store.match({0: embedding}, self.threshold).get(0)
+        if name is None and len(self.store) >= self.max_speakers:
+            name = self.store.names[int(np.argmax(self.store.similarities(embedding)))]
+        if name is None:
+            name = f"Speaker {len(self.store)}"
+            self.store.enroll(name, embedding, seconds * 1000)
+        elif seconds >= self.min_enroll_seconds:
+            self.store.enroll(name, embedding, seconds * 1000)
+        self.last = name
+        return name
+
+
+class CueBuilder:
+    """
+    Groups final words into subtitle cues, a cue closes at the end of a
+    sentence, before a pause of max_gap seconds, or once it is max_seconds
+    long.
+    """
+
+    def __init__(self, max_seconds=6.0, max_gap=0.8):
+        self.max_seconds = max_seconds
+        self.max_gap = max_gap
+        self.words = []
+
+    @property
+    def start(self):
+        return self.words[0]["start"] if self.words else None
+
+    def add(self, words):
+        """Returns the word lists of the cues the words closed."""
+        cues = []
+        for word in words:
+            if self.words and (
+                word["start"] - self.words[-1]["end"] >= self.max_gap
+                or word["end"] - self.words[0]["start"] > self.max_seconds
+            ):
+                cues.append(self.words)
+                self.words = []
+            self.words.append(word)
+            if word["word"].endswith(SENTENCE_ENDINGS):
+                cues.append(self.words)
+                self.words = []
+        return cues
+
+    def flush(self):
+        cues, self.words = ([self.words] if self.words else []), []
+        return cues
+
+
+class LiveDiarizer:
+    """
+    Appends speaker-labeled SRT cues to a stream as soon as they are final,
+    keeping only the audio of the open window and cue in memory.
+    """
+
+    def __init__(self, transcriber, speakers, srt_stream):
+        self.transcriber = transcriber
+        self.speakers = speakers
+        self.cues = CueBuilder()
+        self.srt_stream = srt_stream
+        self.writer = SrtWriter(srt_stream)
+        self.count = 0
+        self.latencies = []
+        # (stream seconds, arrival time) of the blocks, to measure latency
+        self.arrivals = deque()
+        self.received = 0.0
+        # audio kept for the speaker embeddings of the open cue
+        self.audio = np.zeros(0, dtype=np.float32)
+        self.audio_start = 0.0
+
+    def feed(self, samples, arrival, end_of_stream=False):
+        self.audio = np.concatenate([self.audio, samples])
+        self.received += len(samples) / SAMPLE_RATE
+        self.arrivals.append((self.received, arrival))
+        cues = self.cues.add(self.transcriber.feed(samples, end_of_stream))
+        if end_of_stream:
+            cues += self.cues.flush()
+        for words in cues:
+            self.emit(words)
+
+        # only the audio of the open cue and of the transcription window is kept
+        keep_from = min(
+            self.cues.start if self.cues.start is not None else float("inf"),
+            self.transcriber.audio_start,
+        )
+        drop = min(
+            max(0, round((keep_from - self.audio_start) * SAMPLE_RATE)), len(self.audio)
+        )
+        self.audio = self.audio[drop:]
+        self.audio_start += drop / SAMPLE_RATE
+        while len(self.arrivals) > 1 and self.arrivals[1][0] <= keep_from:
+            self.arrivals.popleft()
+
+    def emit(self, words):
+        start, end = words[0]["start"], words[-1]["end"]
+        first = max(0, int((start - self.audio_start) * SAMPLE_RATE))
+        speaker = self.speakers.assign(
+            self.audio[first : max(first, int((end - self.audio_start) * SAMPLE_RATE))]
+        )
+        sentence = {
+            "speaker": speaker,
+            "start_time": int(start * 1000),
+            "end_time": int(end * 1000),
+            "text": " ".join(word["word"] for word in words),
+        }
+        self.count += 1
+        self.writer.write(self.count, sentence)
+        self.srt_stream.flush()
+        print(f"[{start:7.1f} s] {speaker}: {sentence['text']}", flush=True)
+
+        # delay between the arrival of the end of the cue and its output
+        seconds = [received for received, _ in self.arrivals]
+        arrived = self.arrivals[min(bisect.bisect_left(seconds, end), len(seconds) - 1)]
+        self.latencies.append(time.monotonic() - arrived[1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Transcribe and diarize a WAV stream as it arrives, appending "
+        "speaker-labeled SRT cues as soon as they are final"
+    )
+    parser.add_argument(
+        "-a",
+        "--audio",
+        required=True,
+        help='WAV file or "-" for stdin, other formats can be piped through '
+        '"ffmpeg -i INPUT -f wav -"',
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="SRT file the cues are appended to, defaults to the audio file name "
+        "with .srt, or live.srt for stdin",
+    )
+    parser.add_argument(
+        "--follow",
+        action="store_true",
+        default=False,
+        help="Keep reading a file that is still being written, until it stops "
+        "growing for --idle-seconds",
+    )
+    parser.add_argument("--idle-seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=None,
+        help="Feed the input no faster than this many times real time, e.g. 1 to "
+        "simulate a live source with a file",
+    )
+    parser.add_argument(
+        "--whisper-model",
+        dest="model_name",
+        default="small.en",
+        help="name of the Whisper model to use, smaller ones keep up more easily",
+    )
+    parser.add_argument("--language", default=None)
+    parser.add_argument(
+        "--window-seconds",
+        type=float,
+        default=30.0,
+        help="Longest audio transcribed in one pass",
+    )
+    parser.add_argument(
+        "--step-seconds",
+        type=float,
+        default=3.0,
+        help="New audio between two transcription passes",
+    )
+    parser.add_argument(
+        "--max-latency",
+        type=float,
+        default=10.0,
+        help="Words this many seconds behind the newest audio are final even if "
+        "the passes don't agree on them yet",
+    )
+    parser.add_argument(
+        "--speaker-threshold",
+        type=float,
+        default=0.6,
+        help="Minimum cosine similarity of a cue to a speaker's centroid",
+    )
+    parser.add_argument("--max-speakers", type=int, default=8)
+    parser.add_argument(
+        "--device",
+        choices=["auto", "cuda", "cpu"],
+        default="auto",
+        help="auto runs on the GPU when there is one",
+    )
+    parser.add_argument(
+        "--quantize",
+        action="store_true",
+        default=False,
+        help="Run an int8 dynamically quantized Whisper model, cpu only",
+    )
+    args = parser.parse_args()
+    if args.step_seconds >= args.window_seconds:
+        parser.error("--step-seconds has to be shorter than --window-seconds")
+
+    device = resolve_device(args.device)
+    if args.quantize and device != "cpu":
+        parser.error("--quantize needs the cpu device")
+    if device == "cpu":
+        configure_threads()
+
+    if args.audio == "-":
+        source = sys.stdin.buffer
+        output = args.output or "live.srt"
+    else:
+        source = open(args.audio, "rb")
+        output = args.output or os.path.splitext(args.audio)[0] + ".srt"
+    wav = WavStream(source, args.follow, idle_seconds=args.idle_seconds)
+
+    # the models are loaded before the stream is read, the first cue doesn't wait
+    work_dir = create_workspace(prefix="live_")
+    transcriber = RollingTranscriber(
+        load_whisper(args.model_name, device, args.quantize),
+        args.language,
+        args.window_seconds,
+        args.step_seconds,
+        args.max_latency,
+        fp16=device == "cuda",
+    )
+    speakers = OnlineSpeakers(
+        device, work_dir, args.speaker_threshold, args.max_speakers
+    )
+
+    # at most a window of blocks waits in the queue, a source faster than the
+    # transcription is held back instead of piling up in memory
+    block_seconds = 0.5
+    window_blocks = max(1, int(args.window_seconds / block_seconds))
+    blocks = queue.Queue(maxsize=window_blocks)
+    threading.Thread(
+        target=read_blocks,
+        args=(wav, blocks, block_seconds, args.speed),
+        daemon=True,
+    ).start()
+
+    started = time.monotonic()
+    try:
+        with open(output, "w", encoding=ENCODINGS["srt"]) as srt_stream:
+            live = LiveDiarizer(transcriber, speakers, srt_stream)
+            end_of_stream = False
+            while not end_of_stream:
+                # what arrived during the last pass is taken at once, up to a window
+                items = [blocks.get()]
+                while len(items) < window_blocks and items[-1] is not None:
+                    try:
+                        items.append(blocks.get_nowait())
+                    except queue.Empty:
+                        break
+                end_of_stream = items[-1] is None
+                items = [item for item in items if item is not None]
+                samples = np.concatenate(
+                    [samples for samples, _ in items] or [np.zeros(0, np.float32)]
+                )
+                arrival = items[-1][1] if items else time.monotonic()
+                live.feed(samples, arrival, end_of_stream)
+    finally:
+        cleanup(work_dir)
+        if source is not sys.stdin.buffer:
+            source.close()
+
+    elapsed = time.monotonic() - started
+    print(f"{live.count} cues written to {output}")
+    if live.latencies:
+        print(
+            f"{live.received:.1f} s of audio in {elapsed:.1f} s, cue latency "
+            f"mean {np.mean(live.latencies):.1f} s, max {max(live.latencies):.1f} s"
+        )
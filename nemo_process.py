@@ -1,26 +1,43 @@
-
 import argparse
-import os
 from helpers import *
-import librosa
-import soundfile
-from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+from pipeline import diarize
+from tracing import start_tracing, stop_tracing, span
+from cpu_backend import resolve_device, parse_cores, pin_to_cores
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-a", "--audio", help="name of the target audio file", required=True
 )
+parser.add_argument(
+    "--work-dir",
+    required=True,
+    help="workspace of the job, NeMo writes its outputs under it",
+)
+parser.add_argument(
+    "--device",
+    choices=["auto", "cuda", "cpu"],
+    default="auto",
+    help="auto runs on the GPU when there is one",
+)
+parser.add_argument(
+    "--cores",
+    default=None,
+    help='on the cpu device, run on these cores only, e.g. "0-3,8"',
+)
+parser.add_argument(
+    "--trace",
+    dest="trace_path",
+    default=None,
+    help="append the spans of the diarization to this JSON lines file",
+)
 args = parser.parse_args()
 
-# convert audio to mono for NeMo combatibility
-signal, sample_rate = librosa.load(args.audio, sr=None)
-ROOT = os.getcwd()
-temp_path = os.path.join(ROOT, "temp_outputs")
-if not os.path.exists(temp_path):
-    os.mkdir(temp_path)
-os.chdir(temp_path)
-soundfile.write("mono_file.wav", signal, sample_rate, "PCM_24")
+# NeMo MSDD diarization, the RTTM is written to WORK_DIR/nemo_outputs/pred_rttms
+device = resolve_device(args.device)
+if device == "cpu" and args.cores:
+    pin_to_cores(parse_cores(args.cores))
 
-# Initialize NeMo MSDD diarization model
-msdd_model = NeuralDiarizer(cfg=create_config()).to("cuda")
-msdd_model.diarize()
+start_tracing(args.trace_path)
+with span("nemo_process", file=args.audio):
+    diarize(args.audio, args.work_dir, device)
+stop_tracing(print_summary=False)
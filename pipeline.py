@@ -0,0 +1,247 @@
+import os
+from helpers import *
+import whisperx
+from whisper import load_model
+from nemo.collections.asr.models.msdd_models import NeuralDiarizer
+import separation
+from ingest import SAMPLE_RATE, AudioBuffer, ingest_audio
+from punctuation import restore_punctuation
+from transcript_writers import DEFAULT_FORMATS, write_transcript_files
+from tracing import span
+from cpu_backend import quantize_model
+
+
+def separate_vocals(audio, device, model="htdemucs", mode="auto", strict=False):
+    """
+    Isolate vocals from the rest of the audio in-process.
+
+    Returns a 16 kHz mono array, or None when the audio doesn't need it or
+    the separation failed, in which case the original file should be used.
+    With strict, a failed separation raises instead, so callers caching the
+    result can tell it from audio without music.
+    """
+    try:
+        with span("separation") as stage:
+            vocals = separation.separate_vocals(audio, model, device, mode=mode)
+            if vocals is not None:
+                stage.audio_seconds = len(vocals) / SAMPLE_RATE
+        return vocals
+    except Exception as e:
+        if strict:
+            raise
+        print(
+            f"Source splitting failed ({e}), using original audio file. Use --no-stem argument to disable it."
+        )
+        return None
+
+
+def _samples(audio):
+    return audio.samples if isinstance(audio, AudioBuffer) else audio
+
+
+def _duration(audio):
+    return len(_samples(audio)) / SAMPLE_RATE
+
+
+def load_whisper(model_name, device, quantize=False):
+    """Loads a Whisper model, dynamically quantized to int8 with quantize."""
+    if quantize and device != "cpu":
+        raise ValueError("int8 quantized models only run on the cpu device")
+    with span("load_whisper", quantized=quantize):
+        whisper_model = load_model(model_name, device=device)
+        return quantize_model(whisper_model) if quantize else whisper_model
+
+
+def transcribe(whisper_model, audio):
+    with span("transcription", audio_seconds=_duration(audio)):
+        return whisper_model.transcribe(_samples(audio), beam_size=None, verbose=False)
+
+
+def load_alignment(language, device, quantize=False):
+    """
+    Loads the whisperx alignment model of a language and its metadata, the
+    model dynamically quantized to int8 with quantize.
+    """
+    if quantize and device != "cpu":
+        raise ValueError("int8 quantized models only run on the cpu device")
+    alignment_model, metadata = whisperx.load_align_model(
+        language_code=language, device=device
+    )
+    if quantize:
+        alignment_model = quantize_model(alignment_model)
+    return alignment_model, metadata
+
+
+def align(
+    whisper_results,
+    audio,
+    device,
+    alignment_model=None,
+    metadata=None,
+    quantize=False,
+):
+    """
+    Returns whisperx word segments, loading the alignment model if none is
+    given, dynamically quantized to int8 with quantize.
+    """
+    with span("alignment", audio_seconds=_duration(audio)):
+        if alignment_model is None:
+            alignment_model, metadata = load_alignment(
+                whisper_results["language"], device, quantize
+            )
+        result_aligned = whisperx.align(
+            whisper_results["segments"],
+            alignment_model,
+            metadata,
+            _samples(audio),
+            device,
+        )
+    return result_aligned["word_segments"]
+
+
+def load_diarizer(temp_path, device, domain_type="telephonic"):
+    """
+    Build the NeMo MSDD diarizer for temp_path, it can be passed to diarize
+    to process several files without reloading the models.
+
+    """
+    os.makedirs(temp_path, exist_ok=True)
+    config = create_config(domain_type=domain_type, work_dir=temp_path)
+    if device == "cpu":
+        config.num_workers = 0
+    with span("load_diarizer"):
+        return NeuralDiarizer(cfg=config).to(device)
+
+
+def diarize(audio, temp_path, device, msdd_model=None, domain_type="telephonic"):
+    """
+    Run NeMo MSDD diarization on an audio file, array or AudioBuffer and
+    return the speaker turns as a SpeakerTimeline.
+
+    """
+    return diarize_many([audio], temp_path, device, msdd_model, domain_type)[0]
+
+
+def diarize_many(audios, temp_path, device, msdd_model=None, domain_type="telephonic"):
+    """
+    Diarize several audio files, arrays or AudioBuffers with a single NeMo
+    call, so VAD, embedding extraction and MSDD run batched over all of them.
+    Returns one SpeakerTimeline per audio, in order.
+
+    domain_type is only used when no msdd_model is given. A given msdd_model
+    keeps the manifest and output directory of the temp_path it was loaded for.
+    """
+    # NeMo reads the 16 kHz mono buffer files as is, without another conversion
+    audios = [
+        ingest_audio(
+            audio, temp_path, name="mono_file" if len(audios) == 1 else f"mono_file_{i}"
+        )
+        for i, audio in enumerate(audios)
+    ]
+    if msdd_model is None:
+        msdd_model = load_diarizer(temp_path, device, domain_type)
+
+    write_manifest(
+        [audio.path for audio in audios], msdd_model._cfg.diarizer.manifest_filepath
+    )
+    with span("diarization", audio_seconds=sum(audio.duration for audio in audios)):
+        msdd_model.diarize()
+
+    rttm_dir = os.path.join(msdd_model._cfg.diarizer.out_dir, "pred_rttms")
+    with span("rttm_parsing"):
+        return [
+            read_rttm(os.path.join(rttm_dir, f"{rttm_name(audio.path)}.rttm"))
+            for audio in audios
+        ]
+
+
+def rttm_name(audio_path):
+    """NeMo names the RTTM of an audio file after its file name without extension."""
+    return os.path.splitext(os.path.basename(audio_path))[0]
+
+
+def read_rttm(path):
+    return SpeakerTimeline.from_rttm(path)
+
+
+def punctuate(word_segments, language, punct_model, segments=None, punct_mode="model"):
+    """
+    Returns the punctuated words of the transcript, or None if punctuation
+    restoration isn't available for the language. Doesn't need the speakers,
+    so it can run while the file is still being diarized.
+    """
+    if language not in punct_model_langs:
+        return None
+    with span("punctuation", words=len(word_segments)):
+        return restore_punctuation(punct_model, word_segments, segments, punct_mode)
+
+
+def speaker_sentences(
+    word_segments,
+    speaker_ts,
+    language,
+    punct_model,
+    segments=None,
+    punct_mode="model",
+    speaker_names=None,
+    with_words=False,
+    labled_words=None,
+):
+    """
+    Map words to speakers and restore punctuation, yielding the speaker turns
+    of the sentence mapping as soon as they close.
+
+    punct_mode "whisper" keeps Whisper's punctuation for the segments that
+    already end with one and only runs punct_model on the others.
+    speaker_names maps speaker numbers to names, e.g. from voice prints.
+    labled_words are the words already punctuated by punctuate, if any.
+    """
+    wsm = iter_words_speaker_mapping(word_segments, speaker_ts, "start")
+
+    # Restore punctuation in the transcript if the language is supported
+    if language in punct_model_langs:
+        if labled_words is None:
+            labled_words = punctuate(
+                word_segments, language, punct_model, segments, punct_mode
+            )
+
+        wsm = iter_punctuated_words(wsm, labled_words)
+        wsm = iter_realigned_ws_mapping_with_punctuation(wsm)
+    elif language is not None:
+        print(f"Punctuation restoration is not available for {language} language.")
+
+    return iter_sentences_speaker_mapping(wsm, speaker_ts, speaker_names, with_words)
+
+
+def write_transcripts(
+    word_segments,
+    speaker_ts,
+    language,
+    punct_model,
+    base_path,
+    formats=DEFAULT_FORMATS,
+    segments=None,
+    punct_mode="model",
+    speaker_names=None,
+    word_level=False,
+    labled_words=None,
+):
+    """
+    Write the speaker-aware transcript as base_path.<format> for every format
+    in a single pass over the speaker turns, returns {format: path}.
+    word_level adds the words and their timestamps to the .json output.
+    """
+    ssm = speaker_sentences(
+        word_segments,
+        speaker_ts,
+        language,
+        punct_model,
+        segments,
+        punct_mode,
+        speaker_names,
+        with_words=word_level and "json" in formats,
+        labled_words=labled_words,
+    )
+    # words are mapped to speakers while the outputs are written
+    with span("write_transcripts", formats=list(formats)):
+        return write_transcript_files(ssm, base_path, formats, language)
@@ -0,0 +1,192 @@
+from collections import OrderedDict
+import numpy as np
+import torch
+from deepmultilingualpunctuation import PunctuationModel
+
+PUNCTUATION_MODEL = "kredor/punctuate-all"
+ENDING_PUNCTUATIONS = ".?!"
+MODEL_PUNCTUATIONS = ".,;:!?"
+
+# Models are loaded once per process and reused for every file
+_punctuation_models = {}
+
+
+def load_punctuation_model(name=PUNCTUATION_MODEL):
+    if name not in _punctuation_models:
+        _punctuation_models[name] = PunctuationModel(model=name)
+    return _punctuation_models[name]
+
+
+def overlapping_windows(num_words, window_size=230, overlap=5):
+    """
+    Returns (start, end, keep) word windows covering num_words words. Each
+    window but the last one overlaps the next by overlap words, only used
+    as right context, so only the first keep words of a window are labeled.
+    """
+    if num_words <= window_size:
+        return [(0, num_words, num_words)] if num_words else []
+    step = window_size - overlap
+    windows = []
+    for start in range(0, num_words, step):
+        end = min(start + window_size, num_words)
+        windows.append((start, end, step if end < num_words else end - start))
+        if end == num_words:
+            break
+    return windows
+
+
+class PunctuationRestorer:
+    """
+    Restores punctuation with the token classification pipeline of a
+    deepmultilingualpunctuation model, labeling words the same way as
+    PunctuationModel.predict.
+
+    The words are cut into fixed-size overlapping windows that are sent to the
+    pipeline batch_size at a time, and the labels of a window are memoized by
+    its text so repeated windows, e.g. intros of a podcast, run once.
+    """
+
+    def __init__(
+        self,
+        model=None,
+        window_size=230,
+        overlap=5,
+        batch_size=8,
+        num_threads=None,
+        cache_size=4096,
+    ):
+        self.model = model or load_punctuation_model()
+        self.window_size = window_size
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        if num_threads and not torch.cuda.is_available():
+            torch.set_num_threads(num_threads)
+
+    def _label_window(self, words, result):
+        """Label every word with the last punctuation predicted for its subtokens."""
+        text = " ".join(words)
+        if result and len(text) != result[-1]["end"]:
+            raise RuntimeError("Punctuation window too large, text got clipped")
+
+        labels = []
+        char_index = 0
+        result_index = 0
+        for word in words:
+            char_index += len(word) + 1
+            label, score = "0", 0.0
+            while (
+                result_index < len(result) and char_index > result[result_index]["end"]
+            ):
+                label = result[result_index]["entity"]
+                score = result[result_index]["score"]
+                result_index += 1
+            labels.append((label, score))
+        return labels
+
+    def _predict_windows(self, windows):
+        """Returns the labels of each window of words, running the model on the misses."""
+        texts = [" ".join(words) for words in windows]
+        # labels of this call, the cache may evict them before they are read
+        # when there are more misses than it holds
+        labels = {}
+        misses = {}
+        for text, words in zip(texts, windows):
+            if text in self.cache:
+                self.cache.move_to_end(text)
+                labels[text] = self.cache[text]
+            else:
+                misses[text] = words
+        if misses:
+            results = self.model.pipe(list(misses), batch_size=self.batch_size)
+            for (text, words), result in zip(misses.items(), results):
+                labels[text] = self.cache[text] = self._label_window(words, result)
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        return [labels[text] for text in texts]
+
+    def predict_runs(self, runs):
+        """
+        Returns the predict result of each list of words in runs, the windows
+        of all runs going through the model in the same batches.
+        """
+        run_windows = [
+            overlapping_windows(len(words), self.window_size, self.overlap)
+            for words in runs
+        ]
+        window_labels = iter(
+            self._predict_windows(
+                [
+                    words[start:end]
+                    for words, windows in zip(runs, run_windows)
+                    for start, end, _ in windows
+                ]
+            )
+        )
+        tagged_runs = []
+        for words, windows in zip(runs, run_windows):
+            tagged_words = []
+            for (start, _, keep), labels in zip(windows, window_labels):
+                tagged_words.extend(
+                    [word, label, score]
+                    for word, (label, score) in zip(
+                        words[start : start + keep], labels[:keep]
+                    )
+                )
+            tagged_runs.append(tagged_words)
+        return tagged_runs
+
+    def predict(self, words):
+        """Returns [word, label, score] for every word, like PunctuationModel.predict."""
+        return self.predict_runs([words])[0]
+
+
+def whisper_punctuated_words(word_segments, segments):
+    """
+    Flags the words of the Whisper segments whose text already ends with a
+    sentence ending punctuation, Whisper's own punctuation is kept for those.
+
+    """
+    flags = np.zeros(len(word_segments), dtype=bool)
+    if not segments or not word_segments:
+        return flags
+    segment_ends = np.array([segment["end"] for segment in segments])
+    punctuated = np.array(
+        [
+            segment["text"].strip()[-1:] in list(ENDING_PUNCTUATIONS)
+            for segment in segments
+        ]
+    )
+    word_starts = np.array([wrd_dict["start"] for wrd_dict in word_segments])
+    segment_idx = np.minimum(
+        np.searchsorted(segment_ends, word_starts, side="right"), len(segments) - 1
+    )
+    flags[:] = punctuated[segment_idx]
+    return flags
+
+
+def restore_punctuation(restorer, word_segments, segments=None, mode="model"):
+    """
+    Returns [word, label, score] for every word segment.
+
+    With mode "whisper", words of Whisper segments that already end with a
+    sentence ending punctuation keep their own punctuation as label and only
+    the other words go through the model, in runs of consecutive words.
+    """
+    words = [wrd_dict["text"] for wrd_dict in word_segments]
+    if mode != "whisper":
+        return restorer.predict(words)
+
+    skip = whisper_punctuated_words(word_segments, segments)
+    tagged_words = [
+        [word, word[-1] if word and word[-1] in MODEL_PUNCTUATIONS else "0", 1.0]
+        for word in words
+    ]
+    # runs of words that still need the model
+    edges = np.flatnonzero(np.diff(np.concatenate(([True], skip, [True])).astype(int)))
+    runs = list(zip(edges[::2], edges[1::2]))
+    tagged_runs = restorer.predict_runs([words[start:end] for start, end in runs])
+    for (start, end), tagged_run in zip(runs, tagged_runs):
+        tagged_words[start:end] = tagged_run
+    return tagged_words
@@ -0,0 +1,103 @@
+import numpy as np
+import torch
+import julius
+from demucs.pretrained import get_model
+from demucs.apply import apply_model
+from demucs.audio import AudioFile
+
+SAMPLE_RATE = 16000
+
+# Models are loaded once per process and reused for every file
+_separation_models = {}
+
+
+def load_separation_model(name="htdemucs", device="cpu"):
+    if (name, device) not in _separation_models:
+        model = get_model(name)
+        model.to(device)
+        model.eval()
+        _separation_models[(name, device)] = model
+    return _separation_models[(name, device)]
+
+
+def music_segments(signal, sample_rate, segment_seconds=30.0, threshold=0.15):
+    """
+    Flags the segments of a mono signal that look like music rather than speech.
+
+    Speech alternates syllables and short pauses, so many of its 20 ms frames
+    are much quieter than the average of the surrounding second, while music
+    keeps a steady energy. A segment whose share of such low energy frames
+    stays under the threshold is flagged as music, silent segments never are.
+    """
+    frame = int(0.02 * sample_rate)
+    num_frames = len(signal) // frame
+    rms = np.sqrt(
+        np.mean(
+            np.square(signal[: num_frames * frame].reshape(num_frames, frame)), axis=1
+        )
+    )
+
+    # mean energy over a sliding one second window around each frame
+    window = 50
+    local_mean = np.convolve(rms, np.ones(window) / window, mode="same")
+    low_energy = rms < 0.5 * local_mean
+    audible = local_mean > 1e-3
+
+    frames_per_segment = max(1, int(segment_seconds / 0.02))
+    num_segments = max(1, -(-num_frames // frames_per_segment))
+    flags = np.zeros(num_segments, dtype=bool)
+    for i in range(num_segments):
+        seg = slice(i * frames_per_segment, (i + 1) * frames_per_segment)
+        if audible[seg].mean() < 0.5:
+            continue
+        flags[i] = low_energy[seg][audible[seg]].mean() < threshold
+    return flags
+
+
+def separate_vocals(
+    audio, model_name="htdemucs", device="cpu", segment_seconds=30.0, mode="auto"
+):
+    """
+    Separate the vocals of an audio file in-process.
+
+    Returns a 16 kHz mono float32 array, or None when mode is "auto" and no
+    segment looks like music, in which case the original audio should be used
+    as is. In "auto" mode only the music segments go through demucs, the other
+    ones are kept unchanged.
+    """
+    model = load_separation_model(model_name, device)
+    wav = AudioFile(audio).read(
+        streams=0, samplerate=model.samplerate, channels=model.audio_channels
+    )
+    mono = wav.mean(0)
+
+    if mode == "auto":
+        flags = music_segments(mono.numpy(), model.samplerate, segment_seconds)
+        if not flags.any():
+            return None
+    else:
+        flags = np.ones(1, dtype=bool)
+        segment_seconds = wav.shape[-1] / model.samplerate
+
+    ref_mean, ref_std = mono.mean(), mono.std()
+    vocals = mono.clone()
+    segment_len = int(segment_seconds * model.samplerate)
+    vocals_idx = model.sources.index("vocals")
+
+    # consecutive music segments are separated together to avoid seams
+    i = 0
+    while i < len(flags):
+        if not flags[i]:
+            i += 1
+            continue
+        j = i
+        while j < len(flags) and flags[j]:
+            j += 1
+        start, end = i * segment_len, min(j * segment_len, wav.shape[-1])
+        mix = (wav[:, start:end] - ref_mean) / ref_std
+        with torch.no_grad():
+            sources = apply_model(model, mix[None], device=device, split=True)[0]
+        vocals[start:end] = (sources[vocals_idx] * ref_std + ref_mean).mean(0).cpu()
+        i = j
+
+    return julius.resample_frac(vocals, model.samplerate, SAMPLE_RATE).numpy()
@@ -1,118 +1,200 @@
-import re
-import pandas as pd
-from datetime import datetime
-from functools import reduce
+import argparse
 import string
+from collections import Counter
+import numpy as np
+import pandas as pd
 
-# Ask the user for the input file path
-file_path = input("Please enter the path to the .srt file: ")
-
-# Initialize the list to store data
-data = []
-
-# Open and read the file
-with open(file_path, 'r') as file:
-    content = file.read()
-    blocks = content.split('\n\n')
-
-    # Loop through each block and parse the data
-    for block in blocks:
-        # Split the block into lines
-        lines = block.split('\n')
-        if len(lines) >= 3:
-            # The first line is the index, second line is the time, and the remaining lines are the text
-            index = lines[0]
-            time = lines[1]
-            text = ' '.join(lines[2:])
-
-            # Use regex to find the speaker's name in the text
-            match = re.match(r'(.*): (.*)', text)
-            if match:
-                speaker, text = match.groups()
-            else:
-                speaker = 'Unknown'
-
-            # Append the data to the list
-            data.append([index, time, speaker, text])
-
-# Convert the list into a DataFrame
-df = pd.DataFrame(data, columns=['Index', 'Time', 'Speaker', 'Text'])
-
-## Section 1 - Speech Duration ##
-# Function to calculate the duration in seconds from a time range string
-def calculate_duration(time_range):
-    start_time_str, end_time_str = time_range.split(' --> ')
-    start_time = datetime.strptime(start_time_str, '%H:%M:%S,%f')
-    end_time = datetime.strptime(end_time_str, '%H:%M:%S,%f')
-    return (end_time - start_time).total_seconds()
-
-# Apply the function to the 'Time' column
-df['Duration'] = df['Time'].apply(calculate_duration)
-
-# Group by speaker and sum the duration
-speaker_duration = df.groupby('Speaker')['Duration'].sum()
-
-# Calculate the total duration of the audio file
-total_duration = df['Duration'].sum()
-
-# Calculate the speaker_duration as % of total audio file
-speaker_duration_percentage = (speaker_duration / total_duration) * 100
-
-# Display the results
-print("\n # Speaker duration as % of total audio file:")
-print(speaker_duration_percentage.round(2).astype(str) + " %")
-
-print("Speaker aggregate duration (in seconds):")
-print(speaker_duration.round(2).astype(str) + " seconds")
-
-
-
-## Section 2 - Speech Rate ##
-# Function to count words in a text
-def word_count(text):
-    return len(text.split())
-
-# Apply the word_count function to the 'Text' column
-df['WordCount'] = df['Text'].apply(word_count)
-
-# Calculate the total number of words spoken by each speaker
-speaker_wordcount = df.groupby('Speaker')['WordCount'].sum()
-
-# Calculate the speech rate (words per minute) for each speaker
-speaker_speech_rate = (speaker_wordcount / speaker_duration) * 60
-
-print("\n # Speech rate (words per minute):")
-print(speaker_speech_rate.round(2).astype(str) + " words per minute")
-
-## Section 3 - Filler words ##
-# TODO: Make it work with compound phrases ("I Think", "I mean", "You know")
-filler_words = [
+# Single words and compound phrases, matched on lowercase words without punctuation
+FILLER_WORDS = [
     'um',
     'uh',
     'like',
     'so',
-    'think'
+    'think',
+    'i think',
+    'i mean',
+    'you know',
 ]
 
-# Function to clean and split text into words without removing stopwords
-def clean_and_split_text_without_stopwords(text):
-    # Remove punctuation and convert to lowercase
-    text = text.translate(str.maketrans('', '', string.punctuation)).lower()
-    # Split into words
-    words = text.split()
-    return words
+_punctuation_table = str.maketrans('', '', string.punctuation)
+
+# Speaker and text of a transcript line, the speaker's name is everything
+# before the first ': ', the text can have colons of its own
+SPEAKER_TEXT = r'^(.*?): (.*)$'
+
+
+def parse_srt(content):
+    """Returns a DataFrame with the Index, Time, Speaker and Text of every block."""
+    # The first line is the index, second line is the time, the rest is the text
+    blocks = pd.Series(content.split('\n\n')).str.split('\n', n=2, expand=True)
+    if blocks.shape[1] < 3:
+        return pd.DataFrame(columns=['Index', 'Time', 'Speaker', 'Text'])
+    blocks = blocks[blocks[2].notna()]
+
+    text = blocks[2].str.replace('\n', ' ', regex=False)
+    speaker_text = text.str.extract(SPEAKER_TEXT)
+    df = pd.DataFrame(
+        {
+            'Index': blocks[0],
+            'Time': blocks[1],
+            'Speaker': speaker_text[0].fillna('Unknown'),
+            'Text': speaker_text[1].fillna(text),
+        }
+    )
+    return df.reset_index(drop=True)
+
+
+def read_srt(file_path):
+    with open(file_path, 'r') as file:
+        return parse_srt(file.read())
+
+
+class PhraseMatcher:
+    """
+    Aho-Corasick automaton over words, counts every occurrence of a set of
+    phrases of one or more words in a single pass over a word sequence.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = list(phrases)
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+
+        for phrase_idx, phrase in enumerate(self.phrases):
+            state = 0
+            for word in phrase.lower().split():
+                if word not in self.goto[state]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                    self.goto[state][word] = len(self.goto) - 1
+                state = self.goto[state][word]
+            self.outputs[state].append(phrase_idx)
+
+        # breadth first, so the failure state of a node is always built first
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for word, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and word not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(word, 0)
+                self.outputs[next_state] = (
+                    self.outputs[next_state] + self.outputs[self.fail[next_state]]
+                )
+
+    def count(self, words, counts=None):
+        """Adds the number of occurrences of each phrase in words to counts."""
+        counts = Counter() if counts is None else counts
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        state = 0
+        for word in words:
+            while state and word not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(word, 0)
+            for phrase_idx in outputs[state]:
+                counts[phrase_idx] += 1
+        return counts
 
-# Apply the function to the 'Text' column
-df['Words'] = df['Text'].apply(clean_and_split_text_without_stopwords)
 
-# Function to count the occurrence of each filler word in a list of words
-def count_filler_words(words):
-    return {filler_word: words.count(filler_word) for filler_word in filler_words}
+## Section 1 - Speech Duration ##
+def add_durations(df):
+    """Adds the Duration of every block in seconds, parsed column-wise."""
+    times = df['Time'].str.split(' --> ', n=1, expand=True)
+    start = pd.to_timedelta(times[0].str.replace(',', '.', regex=False))
+    end = pd.to_timedelta(times[1].str.replace(',', '.', regex=False))
+    df['Duration'] = (end - start).dt.total_seconds()
+    return df
 
-# Apply the function to the 'Words' column and then group by speaker
-speaker_filler_word_counts = df.groupby('Speaker')['Words'].sum().apply(count_filler_words)
 
-# Convert the series of dictionaries into a DataFrame
-filler_words_df = pd.DataFrame(speaker_filler_word_counts.tolist(), index=speaker_filler_word_counts.index)
-print("\n # Occurrences of filler words per speaker:")
-print(filler_words_df)
+## Section 2 - Speech Rate ##
+def add_word_counts(df):
+    df['WordCount'] = df['Text'].str.split().str.len()
+    return df
+
+
+## Section 3 - Filler words ##
+def tokenize(df):
+    """Returns the lowercase words without punctuation of every block, one per row."""
+    words = df['Text'].str.translate(_punctuation_table).str.lower().str.split()
+    return words.explode().dropna()
+
+
+def filler_word_counts(df, filler_words=FILLER_WORDS):
+    """Returns the occurrences of each filler word or phrase per speaker."""
+    tokens = tokenize(df)
+    speakers = df['Speaker'].loc[tokens.index].to_numpy()
+    rows = tokens.index.to_numpy()
+    tokens = tokens.to_numpy()
+
+    matcher = PhraseMatcher(filler_words)
+    counts = {speaker: Counter() for speaker in sorted(df['Speaker'].unique())}
+    # phrases never span two blocks, the automaton restarts at every block
+    boundaries = np.flatnonzero(rows[1:] != rows[:-1]) + 1
+    for start, end in zip([0, *boundaries], [*boundaries, len(rows)]):
+        if start == end:
+            continue
+        matcher.count(tokens[start:end], counts[speakers[start]])
+
+    return pd.DataFrame(
+        [
+            [counts[speaker][phrase_idx] for phrase_idx in range(len(filler_words))]
+            for speaker in counts
+        ],
+        index=pd.Index(list(counts), name='Speaker'),
+        columns=filler_words,
+    )
+
+
+def speaker_statistics(df, filler_words=FILLER_WORDS):
+    """Returns the speech statistics and the filler word counts per speaker."""
+    add_durations(df)
+    add_word_counts(df)
+    by_speaker = df.groupby('Speaker')
+    stats = pd.DataFrame(
+        {
+            'Duration': by_speaker['Duration'].sum(),
+            'WordCount': by_speaker['WordCount'].sum(),
+        }
+    )
+    stats['DurationPercentage'] = stats['Duration'] / stats['Duration'].sum() * 100
+    stats['WordsPerMinute'] = stats['WordCount'] / stats['Duration'] * 60
+    return stats, filler_word_counts(df, filler_words)
+
+
+def print_report(stats, filler_words_df):
+    print("\n # Speaker duration as % of total audio file:")
+    print(stats['DurationPercentage'].rename('Duration').round(2).astype(str) + " %")
+
+    print("Speaker aggregate duration (in seconds):")
+    print(stats['Duration'].round(2).astype(str) + " seconds")
+
+    print("\n # Speech rate (words per minute):")
+    speech_rate = stats['WordsPerMinute'].rename(None)
+    print(speech_rate.round(2).astype(str) + " words per minute")
+
+    print("\n # Occurrences of filler words per speaker:")
+    print(filler_words_df)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Speech duration, speech rate and filler words per speaker '
+        'of an .srt file'
+    )
+    parser.add_argument('srt', nargs='?', help='path to the .srt file')
+    parser.add_argument(
+        '--fillers',
+        nargs='+',
+        default=FILLER_WORDS,
+        help='filler words or quoted phrases to count, e.g. um "you know"',
+    )
+    args = parser.parse_args()
+
+    # Ask the user for the input file path when it isn't given
+    file_path = args.srt or input("Please enter the path to the .srt file: ")
+
+    stats, filler_words_df = speaker_statistics(read_srt(file_path), args.fillers)
+    print_report(stats, filler_words_df)
@@ -0,0 +1,317 @@
+import argparse
+import os
+import re
+import numpy as np
+import torch
+import soundfile
+from nemo.collections.asr.models import EncDecSpeakerLabelModel
+from helpers import SpeakerTimeline, create_workspace, cleanup
+from ingest import ingest_audio
+
+SPEAKER_MODEL = "titanet_large"
+UNKNOWN_NAME = re.compile(r"^Unknown (\d+)$")
+
+# Models are loaded once per process and reused for every file
+_speaker_models = {}
+
+
+def load_speaker_model(device, name=SPEAKER_MODEL):
+    if (name, device) not in _speaker_models:
+        _speaker_models[name, device] = EncDecSpeakerLabelModel.from_pretrained(
+            name, map_location=device
+        ).eval()
+    return _speaker_models[name, device]
+
+
+def get_speaker_embeddings(
+    signal, sample_rate, speaker_ts, device, work_dir, model_name=SPEAKER_MODEL
+):
+    """
+    Returns {speaker: (embedding, speech_ms)}, the TitaNet embedding of all the
+    speech of each speaker in the signal.
+
+    """
+    speaker_model = load_speaker_model(device, model_name)
+
+    embeddings = {}
+    totals = speaker_ts.speaker_totals()
+    starts = speaker_ts.starts * sample_rate // 1000
+    ends = speaker_ts.ends * sample_rate // 1000
+    for speaker in np.unique(speaker_ts.labels).tolist():
+        turns = speaker_ts.labels == speaker
+        speech = np.concatenate(
+            [signal[s:e] for s, e in zip(starts[turns], ends[turns])]
+        )
+        speaker_path = os.path.join(work_dir, f"speaker_{speaker}.wav")
+        soundfile.write(speaker_path, speech, sample_rate)
+        with torch.no_grad():
+            embedding = speaker_model.get_embedding(speaker_path)
+        embeddings[speaker] = (
+            embedding.squeeze().cpu().numpy(),
+            totals[speaker],
+        )
+    return embeddings
+
+
+def greedy_matches(similarity, threshold):
+    """
+    Returns {row: column} pairs of a similarity matrix, taken greedily from
+    the most similar down to threshold, so no row or column is used twice.
+    """
+    pairs, taken = {}, set()
+    for flat_idx in np.argsort(similarity, axis=None)[::-1]:
+        i, j = np.unravel_index(flat_idx, similarity.shape)
+        if similarity[i, j] < threshold:
+            break
+        if i in pairs or j in taken:
+            continue
+        pairs[int(i)] = int(j)
+        taken.add(j)
+    return pairs
+
+
+class VoicePrintStore:
+    """
+    Enrolled voices, one row per person in a float32 matrix.
+
+    Each row is the speech duration weighted mean of the normalized
+    embeddings the person was enrolled with, weights holds that duration in
+    milliseconds so new episodes keep refining the voice print. Matching is
+    a single product of the normalized rows with the embeddings to match.
+    """
+
+    def __init__(self, names=(), centroids=None, weights=None, model=SPEAKER_MODEL):
+        self.names = list(names)
+        self.model = model
+        self.centroids = (
+            np.asarray(centroids, dtype=np.float32)
+            if centroids is not None
+            else np.empty((0, 0), dtype=np.float32)
+        )
+        self.weights = (
+            np.asarray(weights, dtype=np.float64)
+            if weights is not None
+            else np.zeros(len(self.names))
+        )
+        self._normalize()
+
+    def _normalize(self):
+        norms = np.linalg.norm(self.centroids, axis=1, keepdims=True)
+        self.voice_prints = self.centroids / np.maximum(norms, 1e-12)
+
+    @classmethod
+    def load(cls, path, model=SPEAKER_MODEL):
+        """Returns the store saved at path, or an empty one if there is none yet."""
+        if not os.path.exists(path):
+            return cls(model=model)
+        with np.load(path) as data:
+            store = cls(
+                data["names"].tolist(),
+                data["centroids"],
+                data["weights"],
+                str(data["model"]),
+            )
+        if store.model != model:
+            raise ValueError(
+                f"{path} holds {store.model} voice prints, not {model} ones"
+            )
+        return store
+
+    def save(self, path):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                names=np.array(self.names, dtype=str),
+                centroids=self.centroids,
+                weights=self.weights,
+                model=np.array(self.model),
+            )
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def similarities(self, embeddings):
+        """Cosine similarity of every embedding (one per row) to every voice print."""
+        embeddings = np.atleast_2d(np.asarray(embeddings, dtype=np.float32))
+        if not self.names:
+            return np.empty((len(embeddings), 0), dtype=np.float32)
+        if embeddings.shape[1] != self.voice_prints.shape[1]:
+            raise ValueError(
+                f"embeddings of size {embeddings.shape[1]} can't be matched against "
+                f"voice prints of size {self.voice_prints.shape[1]}"
+            )
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return (embeddings / np.maximum(norms, 1e-12)) @ self.voice_prints.T
+
+    def match(self, speaker_embeddings, threshold=0.6):
+        """
+        Returns {speaker: name} for the speakers of {speaker: embedding} whose
+        voice is enrolled. Pairs are taken greedily from the most similar down
+        to threshold, so two speakers of one recording never get the same name.
+        """
+        speakers = list(speaker_embeddings)
+        if not speakers:
+            return {}
+        similarity = self.similarities([speaker_embeddings[spk] for spk in speakers])
+        return {
+            speakers[i]: self.names[j]
+            for i, j in greedy_matches(similarity, threshold).items()
+        }
+
+    def enroll(self, name, embedding, speech_ms=1):
+        """Add a voice, or refine the voice print of name if it is enrolled."""
+        embedding = np.asarray(embedding, dtype=np.float32).ravel()
+        embedding = embedding / max(np.linalg.norm(embedding), 1e-12)
+        if not self.names:
+            self.centroids = np.empty((0, len(embedding)), dtype=np.float32)
+        elif len(embedding) != self.centroids.shape[1]:
+            raise ValueError(
+                f"embedding of size {len(embedding)} can't be enrolled with voice "
+                f"prints of size {self.centroids.shape[1]}"
+            )
+
+        if name in self.names:
+            j = self.names.index(name)
+            weight = self.weights[j] + speech_ms
+            self.centroids[j] += (embedding - self.centroids[j]) * (speech_ms / weight)
+            self.weights[j] = weight
+        else:
+            self.names.append(name)
+            self.centroids = np.vstack([self.centroids, embedding])
+            self.weights = np.append(self.weights, float(speech_ms))
+        self._normalize()
+
+    def remove(self, name):
+        j = self.names.index(name)
+        del self.names[j]
+        self.centroids = np.delete(self.centroids, j, axis=0)
+        self.weights = np.delete(self.weights, j)
+        self._normalize()
+
+    def rename(self, name, new_name):
+        """Rename a voice, merging it into new_name if that one is enrolled too."""
+        j = self.names.index(name)
+        if new_name not in self.names:
+            self.names[j] = new_name
+            return
+        centroid, weight = self.centroids[j], self.weights[j]
+        self.remove(name)
+        k = self.names.index(new_name)
+        total = self.weights[k] + weight
+        self.centroids[k] = (
+            self.centroids[k] * self.weights[k] + centroid * weight
+        ) / total
+        self.weights[k] = total
+        self._normalize()
+
+    def next_unknown_name(self):
+        numbers = [
+            int(match.group(1))
+            for match in map(UNKNOWN_NAME.match, self.names)
+            if match
+        ]
+        return f"Unknown {max(numbers, default=0) + 1}"
+
+
+def name_speakers(
+    store,
+    speaker_embeddings,
+    threshold=0.6,
+    enroll_unknown=True,
+    update=True,
+    min_speech_ms=5000,
+):
+    """
+    Returns {speaker: name} for the {speaker: (embedding, speech_ms)} of one
+    recording, e.g. the output of get_speaker_embeddings.
+
+    Matched speakers refine their voice print when update is set, and voices
+    that aren't enrolled yet are added as "Unknown N" when enroll_unknown is
+    set, so they keep their name in the next episodes until they are renamed.
+    Speakers with less than min_speech_ms of speech are only matched, their
+    embedding is too noisy to enroll.
+    """
+    names = store.match(
+        {spk: emb for spk, (emb, _) in speaker_embeddings.items()}, threshold
+    )
+    for speaker, (embedding, speech_ms) in sorted(speaker_embeddings.items()):
+        if speech_ms < min_speech_ms:
+            continue
+        if speaker in names:
+            if update:
+                store.enroll(names[speaker], embedding, speech_ms)
+        elif enroll_unknown:
+            names[speaker] = store.next_unknown_name()
+            store.enroll(names[speaker], embedding, speech_ms)
+    return names
+
+
+def enroll_files(store, name, audio_paths, device, work_dir):
+    """Enroll the voice of name from recordings where only that person speaks."""
+    for i, audio_path in enumerate(audio_paths):
+        audio = ingest_audio(audio_path, work_dir, name=f"enroll_{i}")
+        duration_ms = int(audio.duration * 1000)
+        speaker_ts = SpeakerTimeline.from_list([[0, duration_ms, 0]])
+        ((embedding, speech_ms),) = get_speaker_embeddings(
+            np.asarray(audio.samples),
+            audio.sample_rate,
+            speaker_ts,
+            device,
+            work_dir,
+            store.model,
+        ).values()
+        store.enroll(name, embedding, speech_ms)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Manage the voice prints diarize.py --voiceprints names the "
+        "speakers with"
+    )
+    parser.add_argument("store", help="path of the .npz voice print store")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enroll_parser = commands.add_parser(
+        "enroll", help="add or refine a voice from recordings of that person alone"
+    )
+    enroll_parser.add_argument("name")
+    enroll_parser.add_argument("audio", nargs="+", help="audio files")
+
+    commands.add_parser("list", help="show the enrolled voices")
+
+    rename_parser = commands.add_parser(
+        "rename", help='name a voice, e.g. "Unknown 3" "Jane Doe"'
+    )
+    rename_parser.add_argument("name")
+    rename_parser.add_argument("new_name")
+
+    remove_parser = commands.add_parser("remove", help="forget a voice")
+    remove_parser.add_argument("name")
+    args = parser.parse_args()
+
+    store = VoicePrintStore.load(args.store)
+    if args.command == "list":
+        for name, weight in zip(store.names, store.weights):
+            print(f"{name}: {weight / 1000:.1f} seconds of speech")
+        raise SystemExit
+
+    if args.command == "enroll":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        work_dir = create_workspace(prefix="enroll_")
+        try:
+            enroll_files(store, args.name, args.audio, device, work_dir)
+        finally:
+            cleanup(work_dir)
+    elif args.name not in store:
+        raise SystemExit(f"{args.name} is not enrolled")
+    elif args.command == "rename":
+        store.rename(args.name, args.new_name)
+    else:
+        store.remove(args.name)
+    store.save(args.store)
+    print(f"{len(store)} voices in {args.store}")
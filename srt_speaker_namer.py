@@ -1,16 +1,118 @@
+import argparse
+import csv
+import glob
+import json
 import re
 import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+SUBTITLE_EXTENSIONS = ('.srt', '.vtt', '.txt')
+
+# "Speaker 0:" in SRT, VTT cues and TXT transcripts, "<v Speaker 0>" in VTT voice tags
+SPEAKER_LABEL = re.compile(r'Speaker (\d+):|<v Speaker (\d+)>')
+
+
+def find_speakers(path):
+    """Returns the numbers of the speakers of a file, read line by line."""
+    speaker_numbers = set()
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            for match in SPEAKER_LABEL.finditer(line):
+                speaker_numbers.add(match.group(1) or match.group(2))
+    return speaker_numbers
+
+
+def load_mapping(path):
+    """
+    Reads {speaker: name} from a JSON object or a two column CSV file, the
+    speakers can be given as "Speaker 0" or just "0".
+    """
+    with open(path, 'r', encoding='utf-8-sig', newline='') as file:
+        if path.lower().endswith('.json'):
+            items = json.load(file).items()
+        else:
+            items = [row[:2] for row in csv.reader(file) if len(row) >= 2]
+
+    mapping = {}
+    for speaker, name in items:
+        speaker = speaker.strip()
+        if speaker.lower().startswith('speaker '):
+            speaker = speaker[len('speaker '):].strip()
+        if speaker.isdigit():  # skips a CSV header
+            mapping[speaker] = name.strip()
+    return mapping
+
+
+def rename_speakers(src_path, dst_path, speaker_names):
+    """
+    Writes src_path to dst_path with the speaker labels replaced by their
+    names, in a single regex pass over each line. Speakers missing from
+    speaker_names keep their label.
+    """
+    def replace(match):
+        if match.group(1) is not None:
+            name = speaker_names.get(match.group(1))
+            return match.group(0) if name is None else name + ':'
+        name = speaker_names.get(match.group(2))
+        return match.group(0) if name is None else f'<v {name}>'
+
+    tmp_path = dst_path + '.tmp'
+    with open(src_path, 'r', encoding='utf-8') as src, open(
+        tmp_path, 'w', encoding='utf-8'
+    ) as dst:
+        dst.writelines(SPEAKER_LABEL.sub(replace, line) for line in src)
+    os.replace(tmp_path, dst_path)
+    return dst_path
+
+
+def output_path(path, output_dir=None, suffix='_withNames'):
+    base_path, extension = os.path.splitext(path)
+    if output_dir is not None:
+        base_path = os.path.join(output_dir, os.path.basename(base_path))
+    return base_path + suffix + extension
+
+
+def find_subtitles(inputs):
+    """Expand directories and glob patterns into a sorted list of subtitle files."""
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, '*')
+        files.extend(
+            path
+            for path in glob.glob(pattern)
+            if os.path.isfile(path) and path.lower().endswith(SUBTITLE_EXTENSIONS)
+        )
+    return sorted(set(files))
+
+
+def _rename_file(path, speaker_names, output_dir, suffix):
+    return rename_speakers(path, output_path(path, output_dir, suffix), speaker_names)
+
+
+def rename_files(
+    files, speaker_names, output_dir=None, suffix='_withNames', workers=None
+):
+    """Rename the speakers of many files in a process pool, returns the new paths."""
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    rename_file = partial(
+        _rename_file, speaker_names=speaker_names, output_dir=output_dir, suffix=suffix
+    )
+    if len(files) == 1:
+        return [rename_file(files[0])]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(files) // (4 * (workers or os.cpu_count())))
+        return list(pool.map(rename_file, files, chunksize=chunksize))
+
 
 def main():
     # Prompt for the SRT file
     srt_file = input("Please enter the path to the SRT file: ")
 
-    # Read the SRT file
-    with open(srt_file, 'r', encoding='utf-8') as file:
-        srt_data = file.read()
-
     # Find the number of unique speakers in the SRT file
-    speaker_numbers = set(re.findall(r'Speaker (\d+):', srt_data))
+    speaker_numbers = find_speakers(srt_file)
     num_speakers = len(speaker_numbers)
 
     # Ask for confirmation
@@ -26,17 +128,61 @@ def main():
         speaker_name = input(f"Please enter a name for Speaker {speaker_number}: ")
         speaker_names[speaker_number] = speaker_name
 
-    # Replace speaker numbers with speaker names
-    for speaker_number, speaker_name in speaker_names.items():
-        srt_data = srt_data.replace(f"Speaker {speaker_number}:", speaker_name + ":")
-
-    # Save new SRT file
-    new_srt_file = os.path.splitext(srt_file)[0] + "_withNames.srt"
-    with open(new_srt_file, 'w', encoding='utf-8') as file:
-        file.write(srt_data)
+    # Replace speaker numbers with speaker names and save the new SRT file
+    new_srt_file = rename_speakers(srt_file, output_path(srt_file), speaker_names)
 
     print(f"New SRT file saved as {new_srt_file}")
 
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description='Replace the "Speaker N" labels of subtitles and transcripts '
+        'by names. Prompts for a file and the names when no mapping is given.'
+    )
+    parser.add_argument(
+        'inputs',
+        nargs='*',
+        help='.srt, .vtt or .txt files, directories or glob patterns',
+    )
+    parser.add_argument(
+        '-m', '--mapping', help='JSON object or two column CSV of speaker to name'
+    )
+    parser.add_argument(
+        '-o', '--output-dir', default=None, help='write the renamed files here'
+    )
+    parser.add_argument(
+        '--suffix',
+        default='_withNames',
+        help='appended to the file names, pass "" with --output-dir to keep them',
+    )
+    parser.add_argument(
+        '--workers', type=int, default=None, help='number of worker processes'
+    )
+    args = parser.parse_args()
+    if not args.suffix and args.output_dir is None:
+        parser.error('--suffix "" needs --output-dir, the inputs would be overwritten')
+
+    if args.mapping is None:
+        main()
+    else:
+        files = find_subtitles(args.inputs)
+        if args.suffix:
+            # outputs of a previous run
+            files = [
+                path
+                for path in files
+                if not os.path.splitext(path)[0].endswith(args.suffix)
+            ]
+        if not files:
+            raise SystemExit("No subtitle files found.")
+        if not args.suffix and any(
+            os.path.abspath(output_path(path, args.output_dir, ''))
+            == os.path.abspath(path)
+            for path in files
+        ):
+            parser.error('--output-dir is the directory of the inputs, pass a --suffix')
+        speaker_names = load_mapping(args.mapping)
+        new_files = rename_files(
+            files, speaker_names, args.output_dir, args.suffix, args.workers
+        )
+        print(f"{len(new_files)} files renamed")
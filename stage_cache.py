@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import pickle
+import shutil
+import time
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "speech-diarization"
+)
+
+
+def file_hash(path, block_size=1 << 20):
+    """sha256 of the file content, so renamed or copied files still hit the cache."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(dirpath, name))
+        for dirpath, _, names in os.walk(path)
+        for name in names
+    )
+
+
+class StageCache:
+    """
+    On-disk cache of pipeline stage outputs.
+
+    Every entry is a directory named after a key derived from the stage name,
+    the key of its input and the settings that change its output, so changing
+    one setting only invalidates the stages downstream of it. Entries are
+    evicted least recently used first once the cache grows past max_bytes.
+    """
+
+    def __init__(self, root=DEFAULT_CACHE_DIR, max_bytes=20 * 1024**3, resume=True):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.resume = resume
+        os.makedirs(self.root, exist_ok=True)
+
+    @staticmethod
+    def hash_file(path):
+        return file_hash(path)
+
+    @staticmethod
+    def key(stage, *parts):
+        return hashlib.sha256(
+            json.dumps([stage, *parts], sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _entry(self, key):
+        return os.path.join(self.root, key)
+
+    def _hit(self, key, name):
+        path = os.path.join(self._entry(key), name)
+        if not self.resume or not os.path.exists(path):
+            return None
+        now = time.time()
+        os.utime(self._entry(key), (now, now))  # mark as recently used
+        return path
+
+    def get(self, key):
+        """Returns the cached value, or None on a miss or when not resuming."""
+        path = self._hit(key, "value.pkl")
+        if path is None:
+            return None
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+    def put(self, key, value):
+        entry = self._entry(key)
+        os.makedirs(entry, exist_ok=True)
+        tmp_path = os.path.join(entry, "value.pkl.tmp")
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, os.path.join(entry, "value.pkl"))
+        self.evict(keep=entry)
+        return value
+
+    def cached(self, key, compute, *args, **kwargs):
+        """Returns the cached value of key, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, compute(*args, **kwargs))
+        return value
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for key in os.listdir(self.root):
+            entry = self._entry(key)
+            if entry == keep:
+                continue
+            entries.append((os.path.getmtime(entry), _dir_size(entry), entry))
+
+        total = sum(size for _, size, _ in entries)
+        if keep is not None:
+            total += _dir_size(keep)
+        for _, size, entry in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+class NullCache:
+    """Stands in for StageCache when caching is disabled, every stage is computed."""
+
+    resume = False
+
+    @staticmethod
+    def hash_file(path):
+        return None
+
+    key = staticmethod(StageCache.key)
+
+    def get(self, key):
+        return None
+
+    def put(self, key, value):
+        return value
+
+    def cached(self, key, compute, *args, **kwargs):
+        return compute(*args, **kwargs)
@@ -0,0 +1,172 @@
+import queue
+import subprocess
+import threading
+import time
+from tracing import span, current_span
+
+
+class StageGraph:
+    """
+    The stages of one file and the stages whose results they take.
+
+    Each stage starts in its own thread as soon as the results of all its
+    inputs are ready, so independent stages (e.g. loading Whisper while the
+    vocals are separated, diarizing while transcribing) overlap without a
+    fixed order. Stages that need a process of their own start it with
+    run_process, which streams its output instead of buffering it.
+
+    A result is dropped once every stage taking it has finished, so models
+    are freed as soon as they are no longer needed.
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.timings = {}
+        self._processes = set()
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def add(self, name, func, *inputs):
+        """
+        Add a stage computing func(*results of inputs). Inputs have to be
+        added first, which keeps the graph acyclic.
+        """
+        if name in self.stages:
+            raise ValueError(f"stage {name} is already defined")
+        unknown = [stage for stage in inputs if stage not in self.stages]
+        if unknown:
+            raise ValueError(f"stage {name} takes unknown stages {', '.join(unknown)}")
+        self.stages[name] = (func, inputs)
+
+    def _run_stage(self, name, args, done, parent):
+        func, _ = self.stages[name]
+        start = time.perf_counter()
+        result = error = None
+        try:
+            with span(f"{name}_stage", parent=parent):
+                result = func(*args)
+        except BaseException as e:
+            error = e
+        self.timings[name] = (start, time.perf_counter())
+        done.put((name, result, error))
+
+    def run(self, keep=()):
+        """
+        Run every stage and return {stage: result} for the stages in keep.
+        The first stage to fail stops the others: no new stage is started,
+        running processes are terminated and the error is raised once the
+        running stages have returned.
+        """
+        self._stopped = False
+        pending = dict(self.stages)
+        consumers = {name: 0 for name in self.stages}
+        for _, inputs in self.stages.values():
+            for stage in inputs:
+                consumers[stage] += 1
+        results, finished = {}, set()
+        done = queue.Queue()
+        # stages are traced in the span run() is called in, not in their threads
+        parent = current_span()
+        running = 0
+        error = None
+
+        while True:
+            if error is None:
+                for name, (_, inputs) in list(pending.items()):
+                    if finished.issuperset(inputs):
+                        del pending[name]
+                        threading.Thread(
+                            target=self._run_stage,
+                            args=(
+                                name,
+                                [results[stage] for stage in inputs],
+                                done,
+                                parent,
+                            ),
+                            name=name,
+                            daemon=True,
+                        ).start()
+                        running += 1
+            if not running:
+                break
+
+            name, result, e = done.get()
+            running -= 1
+            if e is not None:
+                if error is None:
+                    error = e
+                    print(f"Stage {name} failed: {e!r}")
+                    self.terminate()
+                continue
+            finished.add(name)
+            if consumers[name] or name in keep:
+                results[name] = result
+            for stage in self.stages[name][1]:
+                consumers[stage] -= 1
+                if not consumers[stage] and stage not in keep:
+                    del results[stage]
+
+        if error is not None:
+            raise error
+        return {name: results[name] for name in keep}
+
+    def run_process(self, command, prefix):
+        """
+        Run command, printing its output line by line prefixed with [prefix]
+        while it runs, so a chatty process never blocks on a full pipe.
+        Raises CalledProcessError if it fails.
+        """
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+        with self._lock:
+            self._processes.add(process)
+            if self._stopped:
+                process.terminate()
+        try:
+            for line in process.stdout:
+                print(f"[{prefix}] {line}", end="", flush=True)
+            returncode = process.wait()
+        finally:
+            with self._lock:
+                self._processes.discard(process)
+        if returncode:
+            raise subprocess.CalledProcessError(returncode, command)
+
+    def terminate(self):
+        """Terminate the processes of the running stages and the ones they start."""
+        with self._lock:
+            self._stopped = True
+            for process in self._processes:
+                process.terminate()
+
+    def critical_path(self):
+        """
+        The chain of stages that set the latency of the last run, as
+        [(stage, seconds)]: from the last stage to finish, back through the
+        input that finished last, each stage with the time it added.
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda stage: self.timings[stage][1])
+        path = []
+        while name is not None:
+            start, end = self.timings[name]
+            inputs = [stage for stage in self.stages[name][1] if stage in self.timings]
+            previous = max(
+                inputs, key=lambda stage: self.timings[stage][1], default=None
+            )
+            ready = self.timings[previous][1] if previous else start
+            path.append((name, end - ready))
+            name = previous
+        return path[::-1]
+
+    def format_critical_path(self):
+        return " -> ".join(
+            f"{name} {seconds:.1f} s" for name, seconds in self.critical_path()
+        )
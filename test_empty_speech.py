@@ -0,0 +1,75 @@
+import os
+import numpy as np
+import pytest
+from helpers import (
+    SpeakerTimeline,
+    iter_words_speaker_mapping,
+    iter_sentences_speaker_mapping,
+)
+from transcript_writers import FORMATS, write_transcript_files
+from vad import SpeechMap, energy_speech_regions
+
+SAMPLE_RATE = 16000
+
+
+def silent_recording(tmp_path):
+    """Ten seconds of silence, and the empty RTTM NeMo writes for them."""
+    samples = np.zeros(10 * SAMPLE_RATE, dtype=np.float32)
+    rttm_path = tmp_path / "mono_file.rttm"
+    rttm_path.write_text("")
+    return samples, SpeakerTimeline.from_rttm(rttm_path)
+
+
+def check_empty_outputs(paths):
+    assert set(paths) == set(FORMATS)
+    for fmt, path in paths.items():
+        with open(path) as f:
+            content = f.read()
+        if fmt == "json":
+            assert '"segments": [\n]' in content
+        else:
+            assert "Speaker" not in content
+
+
+def test_empty_rttm_is_an_empty_timeline(tmp_path):
+    _, speaker_ts = silent_recording(tmp_path)
+    assert len(speaker_ts) == 0
+    assert speaker_ts.to_list() == []
+
+
+def test_silent_audio_writes_empty_transcripts(tmp_path):
+    samples, speaker_ts = silent_recording(tmp_path)
+    speech_map = SpeechMap(
+        energy_speech_regions(samples, SAMPLE_RATE), len(samples) / SAMPLE_RATE
+    )
+    assert not speech_map.speech_seconds
+    assert len(speech_map.gate(samples, SAMPLE_RATE)) == 0
+
+    # what diarize.py maps and writes when no speech is found
+    word_segments = []
+    wsm = iter_words_speaker_mapping(word_segments, speaker_ts)
+    ssm = iter_sentences_speaker_mapping(wsm, speaker_ts)
+    paths = write_transcript_files(ssm, os.path.join(tmp_path, "silence"), FORMATS)
+    check_empty_outputs(paths)
+
+
+def test_no_words_over_speaker_turns_writes_empty_transcripts(tmp_path):
+    # the energy VAD found nothing while NeMo still labeled a turn
+    speaker_ts = SpeakerTimeline([0], [1500], [0])
+    ssm = iter_sentences_speaker_mapping(
+        iter_words_speaker_mapping([], speaker_ts), speaker_ts
+    )
+    paths = write_transcript_files(ssm, os.path.join(tmp_path, "noise"), FORMATS)
+    check_empty_outputs(paths)
+
+
+def test_write_transcripts_without_speech(tmp_path):
+    pytest.importorskip("whisperx")
+    pytest.importorskip("nemo")
+    from pipeline import write_transcripts
+
+    _, speaker_ts = silent_recording(tmp_path)
+    paths = write_transcripts(
+        [], speaker_ts, None, None, os.path.join(tmp_path, "silence"), FORMATS
+    )
+    check_empty_outputs(paths)
@@ -0,0 +1,267 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import threading
+import time
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+def peak_rss_mb():
+    """Highest resident set size of this process so far, in MB."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * _RSS_UNIT / 2**20
+
+
+def _children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Span:
+    """
+    One timed stage. audio_seconds and attrs can be set inside the with block,
+    e.g. once the audio is decoded and its duration is known.
+    """
+
+    def __init__(self, name, parent=None, file=None, audio_seconds=None, **attrs):
+        self.name = name
+        self.parent = parent
+        self.file = file if file is not None else getattr(parent, "file", None)
+        self.audio_seconds = audio_seconds
+        self.attrs = attrs
+        self.depth = parent.depth + 1 if parent else 0
+        self.path = f"{parent.path}/{name}" if parent else name
+
+    def start(self):
+        self.thread = threading.current_thread().name
+        self.start_time = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self._children_cpu = _children_cpu()
+
+    def stop(self):
+        self.wall_seconds = time.perf_counter() - self._wall
+        self.cpu_seconds = time.process_time() - self._cpu
+        self.child_cpu_seconds = _children_cpu() - self._children_cpu
+        self.peak_rss_mb = peak_rss_mb()
+
+    @property
+    def rtf(self):
+        """Real-time factor, seconds of processing per second of audio."""
+        if not self.audio_seconds:
+            return None
+        return self.wall_seconds / self.audio_seconds
+
+    def record(self):
+        return {
+            "name": self.name,
+            "path": self.path,
+            "depth": self.depth,
+            "file": self.file,
+            "thread": self.thread,
+            "start": self.start_time,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "child_cpu_seconds": self.child_cpu_seconds,
+            "peak_rss_mb": self.peak_rss_mb,
+            "audio_seconds": self.audio_seconds,
+            "rtf": self.rtf,
+            **self.attrs,
+        }
+
+
+class Tracer:
+    """
+    Records nested spans of every stage: wall and CPU time (of this process
+    and of the subprocesses it waited for), the peak RSS of the process when
+    the span ends, and the real-time factor when the audio duration is known.
+
+    Spans nest per thread, so the stages of a pipelined batch are traced
+    side by side. Each span is appended to jsonl_path as soon as it ends,
+    the Chrome trace (chrome://tracing, Perfetto) is written by close().
+    """
+
+    def __init__(self, jsonl_path=None, chrome_path=None):
+        self.jsonl_path = jsonl_path
+        self.chrome_path = chrome_path
+        self.records = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._jsonl = open(jsonl_path, "a") if jsonl_path else None
+
+    def current(self):
+        stack = getattr(self._local, "stack", None)
+        return stack[-1] if stack else None
+
+    @contextlib.contextmanager
+    def span(self, name, file=None, audio_seconds=None, parent=None, **attrs):
+        """
+        Times a stage nested in the current span of this thread, or in parent,
+        e.g. the span of the thread that started this one.
+        """
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        span = Span(name, parent or self.current(), file, audio_seconds, **attrs)
+        self._local.stack.append(span)
+        span.start()
+        try:
+            yield span
+        finally:
+            span.stop()
+            self._local.stack.pop()
+            self._finish(span)
+
+    def _finish(self, span):
+        record = span.record()
+        with self._lock:
+            self.records.append(record)
+            if self._jsonl:
+                self._jsonl.write(json.dumps(record) + "\n")
+                self._jsonl.flush()
+
+    def call(self, name, func, *args, audio_seconds=None, **kwargs):
+        """Runs func(*args, **kwargs) in a span."""
+        with self.span(name, audio_seconds=audio_seconds):
+            return func(*args, **kwargs)
+
+    def summary(self):
+        """Totals per stage, in the order the stages first started."""
+        stages = {}
+        for record in sorted(self.records, key=lambda record: record["start"]):
+            stage = stages.setdefault(
+                record["path"],
+                {
+                    "depth": record["depth"],
+                    "count": 0,
+                    "wall_seconds": 0.0,
+                    "cpu_seconds": 0.0,
+                    "peak_rss_mb": 0.0,
+                    "audio_seconds": 0.0,
+                    "timed_audio_seconds": 0.0,
+                },
+            )
+            stage["count"] += 1
+            stage["wall_seconds"] += record["wall_seconds"]
+            stage["cpu_seconds"] += record["cpu_seconds"] + record["child_cpu_seconds"]
+            stage["peak_rss_mb"] = max(stage["peak_rss_mb"], record["peak_rss_mb"])
+            if record["audio_seconds"]:
+                stage["audio_seconds"] += record["audio_seconds"]
+                stage["timed_audio_seconds"] += record["wall_seconds"]
+        return stages
+
+    def format_summary(self):
+        lines = [
+            f"{'stage':<40} {'calls':>5} {'wall s':>9} {'cpu s':>9} "
+            f"{'peak MB':>9} {'audio s':>9} {'RTF':>7}"
+        ]
+        for path, stage in self.summary().items():
+            name = "  " * stage["depth"] + path.rsplit("/", 1)[-1]
+            audio = rtf = "-"
+            if stage["audio_seconds"]:
+                audio = f"{stage['audio_seconds']:.1f}"
+                rtf = f"{stage['timed_audio_seconds'] / stage['audio_seconds']:.3f}"
+            lines.append(
+                f"{name:<40} {stage['count']:>5} {stage['wall_seconds']:>9.2f} "
+                f"{stage['cpu_seconds']:>9.2f} {stage['peak_rss_mb']:>9.0f} "
+                f"{audio:>9} {rtf:>7}"
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """The spans as complete events of the Chrome trace event format."""
+        threads = {}
+        events = []
+        for record in self.records:
+            tid = threads.setdefault(record["thread"], len(threads) + 1)
+            events.append(
+                {
+                    "name": record["name"],
+                    "cat": record["file"] or "run",
+                    "ph": "X",
+                    "ts": record["start"] * 1e6,
+                    "dur": record["wall_seconds"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {
+                        key: value
+                        for key, value in record.items()
+                        if key not in ("name", "start", "thread")
+                    },
+                }
+            )
+        events.extend(
+            {
+                "name": "thread_name",
+                "ph": "M",
+                "pid": os.getpid(),
+                "tid": tid,
+                "args": {"name": thread},
+            }
+            for thread, tid in threads.items()
+        )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def close(self):
+        if self._jsonl:
+            self._jsonl.close()
+            self._jsonl = None
+        if self.chrome_path:
+            with open(self.chrome_path + ".tmp", "w") as f:
+                json.dump(self.chrome_trace(), f)
+            os.replace(self.chrome_path + ".tmp", self.chrome_path)
+
+
+class NullTracer:
+    """Default tracer, spans cost next to nothing and aren't recorded."""
+
+    def current(self):
+        return None
+
+    @contextlib.contextmanager
+    def span(self, name, file=None, audio_seconds=None, parent=None, **attrs):
+        yield Span(name, None, file, audio_seconds, **attrs)
+
+    def call(self, name, func, *args, audio_seconds=None, **kwargs):
+        return func(*args, **kwargs)
+
+
+_tracer = NullTracer()
+
+
+def start_tracing(jsonl_path=None, chrome_path=None):
+    """Makes a new Tracer the one span() records to, and returns it."""
+    global _tracer
+    _tracer = Tracer(jsonl_path, chrome_path)
+    return _tracer
+
+
+def stop_tracing(print_summary=True):
+    """Writes the trace files and prints the summary table of the run."""
+    global _tracer
+    tracer, _tracer = _tracer, NullTracer()
+    if isinstance(tracer, Tracer):
+        tracer.close()
+        if print_summary and tracer.records:
+            print(tracer.format_summary())
+    return tracer
+
+
+def span(name, file=None, audio_seconds=None, parent=None, **attrs):
+    """
+    Context manager timing a stage with the active tracer, nested in the
+    current span of this thread, or in parent when given.
+    """
+    return _tracer.span(name, file, audio_seconds, parent, **attrs)
+
+
+def current_span():
+    """The innermost open span of this thread, None outside of any."""
+    return _tracer.current()
+
+
+def traced(name, func, *args, audio_seconds=None, **kwargs):
+    """Runs func(*args, **kwargs) in a span of the active tracer."""
+    return _tracer.call(name, func, *args, audio_seconds=audio_seconds, **kwargs)
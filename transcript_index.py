@@ -0,0 +1,321 @@
+import argparse
+import fnmatch
+import glob
+import json
+import os
+import re
+import sqlite3
+from collections import Counter
+from helpers import format_timestamp
+
+TOKEN_PATTERN = re.compile(r"\w+(?:'\w+)*")
+
+TIMESTAMP = r"(\d+):(\d\d):(\d\d),(\d{3})"
+SRT_BLOCK = re.compile(
+    rf"^\d+\s*\n{TIMESTAMP} --> {TIMESTAMP}[^\n]*\n(.*?)(?:\n\s*\n|\Z)",
+    re.S | re.M,
+)
+SPEAKER_PREFIX = re.compile(r"^(.*?): (.*)$", re.S)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    mtime REAL
+);
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL REFERENCES files(id),
+    speaker TEXT NOT NULL,
+    start_ms INTEGER,
+    end_ms INTEGER,
+    text TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS segments_file ON segments(file_id);
+CREATE TABLE IF NOT EXISTS terms (
+    id INTEGER PRIMARY KEY,
+    term TEXT UNIQUE NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS postings (
+    term_id INTEGER NOT NULL,
+    segment_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (term_id, segment_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS postings_segment ON postings(segment_id);
+"""
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def _ms(hours, minutes, seconds, milliseconds):
+    return ((int(hours) * 60 + int(minutes)) * 60 + int(seconds)) * 1000 + int(
+        milliseconds
+    )
+
+
+def iter_srt_sentences(content):
+    """Yields the subtitles of an .srt written by diarize.py as sentence mappings."""
+    for match in SRT_BLOCK.finditer(content):
+        groups = match.groups()
+        text = " ".join(groups[8].split("\n"))
+        speaker_match = SPEAKER_PREFIX.match(text)
+        speaker, text = speaker_match.groups() if speaker_match else ("Unknown", text)
+        yield {
+            "speaker": speaker,
+            "start_time": _ms(*groups[0:4]),
+            "end_time": _ms(*groups[4:8]),
+            "text": text,
+        }
+
+
+def read_sentences(path):
+    """Returns the sentence mapping of an .srt or .json transcript."""
+    with open(path, "r", encoding="utf-8-sig") as f:
+        content = f.read()
+    if path.lower().endswith(".json"):
+        sentences = json.loads(content)
+        return sentences["segments"] if isinstance(sentences, dict) else sentences
+    return list(iter_srt_sentences(content))
+
+
+class TranscriptIndex:
+    """
+    Persistent inverted index of diarized transcripts in an SQLite database.
+
+    Every sentence of the speaker mapping is a segment, and every term maps to
+    (segment, position) postings clustered by term, so the segments of a term
+    are one range scan and phrases are matched on consecutive positions.
+    """
+
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._term_ids = None
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _term_id_map(self):
+        if self._term_ids is None:
+            self._term_ids = dict(self.conn.execute("SELECT term, id FROM terms"))
+        return self._term_ids
+
+    def is_indexed(self, path, mtime):
+        row = self.conn.execute(
+            "SELECT mtime FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        return row is not None and row[0] == mtime
+
+    def remove(self, path):
+        row = self.conn.execute(
+            "SELECT id FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return
+        segments = "(SELECT id FROM segments WHERE file_id = ?)"
+        self.conn.execute(
+            "UPDATE terms SET count = terms.count - removed.postings FROM "
+            "(SELECT term_id, count(*) AS postings FROM postings "
+            f"WHERE segment_id IN {segments} GROUP BY term_id) AS removed "
+            "WHERE terms.id = removed.term_id",
+            row,
+        )
+        self.conn.execute(f"DELETE FROM postings WHERE segment_id IN {segments}", row)
+        self.conn.execute("DELETE FROM segments WHERE file_id = ?", row)
+        self.conn.execute("DELETE FROM files WHERE id = ?", row)
+
+    def add_sentences(self, path, sentences, mtime=None):
+        """
+        Index the sentence mapping of a transcript, e.g. the output of
+        get_sentences_speaker_mapping, replacing what was indexed for path.
+
+        """
+        term_ids = self._term_id_map()
+        try:
+            with self.conn:
+                self.remove(path)
+                file_id = self.conn.execute(
+                    "INSERT INTO files (path, mtime) VALUES (?, ?)", (path, mtime)
+                ).lastrowid
+                segment_terms = []
+                for sentence_dict in sentences:
+                    segment_id = self.conn.execute(
+                        "INSERT INTO segments (file_id, speaker, start_ms, end_ms, text) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (
+                            file_id,
+                            sentence_dict["speaker"],
+                            sentence_dict.get("start_time"),
+                            sentence_dict.get("end_time"),
+                            sentence_dict["text"].strip(),
+                        ),
+                    ).lastrowid
+                    segment_terms.append((segment_id, tokenize(sentence_dict["text"])))
+
+                # sqlite hands out the ids of new terms, another writer may
+                # have added some of them since the map was read
+                new_terms = list(
+                    {
+                        term: None
+                        for _, terms in segment_terms
+                        for term in terms
+                        if term not in term_ids
+                    }
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO terms (term) VALUES (?)",
+                    [(term,) for term in new_terms],
+                )
+                for start in range(0, len(new_terms), 500):
+                    batch = new_terms[start : start + 500]
+                    term_ids.update(
+                        self.conn.execute(
+                            "SELECT term, id FROM terms WHERE term IN "
+                            f"({', '.join('?' * len(batch))})",
+                            batch,
+                        )
+                    )
+
+                postings, counts = [], Counter()
+                for segment_id, terms in segment_terms:
+                    for position, term in enumerate(terms):
+                        postings.append((term_ids[term], segment_id, position))
+                        counts[term_ids[term]] += 1
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO postings VALUES (?, ?, ?)", postings
+                )
+                self.conn.executemany(
+                    "UPDATE terms SET count = count + ? WHERE id = ?",
+                    [(count, term_id) for term_id, count in counts.items()],
+                )
+        except BaseException:
+            # the ids of the terms added by the rolled back transaction are gone
+            self._term_ids = None
+            raise
+
+    def add_file(self, path, force=False):
+        """Index an .srt or .json transcript if it changed, returns True if indexed."""
+        path = os.path.abspath(path)
+        mtime = os.path.getmtime(path)
+        if not force and self.is_indexed(path, mtime):
+            return False
+        self.add_sentences(path, read_sentences(path), mtime)
+        return True
+
+    def search(self, phrase, speaker=None, file_pattern=None, limit=None):
+        """
+        Returns the segments containing phrase as (file, speaker, start_ms,
+        end_ms, text) tuples ordered by file and time, optionally only the ones
+        of a speaker and of files matching a glob pattern.
+        """
+        terms = tokenize(phrase)
+        if not terms:
+            return []
+        rows = [
+            self.conn.execute(
+                "SELECT id, count FROM terms WHERE term = ?", (term,)
+            ).fetchone()
+            for term in terms
+        ]
+        if None in rows:
+            return []
+
+        # scan the postings of the rarest term of the phrase and look the other
+        # terms up at their offset from it
+        anchor = min(range(len(rows)), key=lambda i: rows[i][1])
+        others = [i for i in range(len(rows)) if i != anchor]
+        joins = "".join(
+            f" JOIN postings p{i} ON p{i}.term_id = ?"
+            f" AND p{i}.segment_id = a.segment_id"
+            f" AND p{i}.position = a.position + {i - anchor}"
+            for i in others
+        )
+        query = (
+            "SELECT f.path, s.speaker, s.start_ms, s.end_ms, s.text"
+            " FROM segments s JOIN files f ON f.id = s.file_id"
+            " WHERE s.id IN"
+            f" (SELECT a.segment_id FROM postings a{joins} WHERE a.term_id = ?)"
+        )
+        params = [rows[i][0] for i in others] + [rows[anchor][0]]
+        if speaker is not None:
+            query += " AND s.speaker = ?"
+            params.append(speaker)
+        query += " ORDER BY f.path, s.start_ms"
+
+        results = self.conn.execute(query, params)
+        if file_pattern is not None:
+            results = (row for row in results if fnmatch.fnmatch(row[0], file_pattern))
+        results = list(results)
+        return results[:limit] if limit else results
+
+    def speakers(self):
+        return [
+            row[0] for row in self.conn.execute("SELECT DISTINCT speaker FROM segments")
+        ]
+
+
+def find_transcripts(inputs):
+    files = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "**", "*")
+        files.extend(
+            path
+            for path in glob.glob(pattern, recursive=True)
+            if os.path.isfile(path) and path.lower().endswith((".srt", ".json"))
+        )
+    return sorted(set(files))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Search diarized transcripts by phrase, speaker and file"
+    )
+    parser.add_argument("db", help="path of the SQLite index")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    index_parser = commands.add_parser("index", help="add .srt or .json transcripts")
+    index_parser.add_argument(
+        "inputs", nargs="+", help="directories, transcript files or glob patterns"
+    )
+    index_parser.add_argument(
+        "--force", action="store_true", help="index again files that didn't change"
+    )
+
+    search_parser = commands.add_parser("search", help="find a word or phrase")
+    search_parser.add_argument("phrase", help='word or phrase, e.g. "interest rates"')
+    search_parser.add_argument(
+        "--speaker", help='only turns of this speaker, e.g. "Speaker 1"'
+    )
+    search_parser.add_argument("--files", help="only files matching this glob pattern")
+    search_parser.add_argument("--limit", type=int, default=None)
+    args = parser.parse_args()
+
+    with TranscriptIndex(args.db) as index:
+        if args.command == "index":
+            files = find_transcripts(args.inputs)
+            indexed = sum(index.add_file(path, args.force) for path in files)
+            print(f"{indexed} of {len(files)} transcripts indexed")
+        else:
+            for path, speaker, start_ms, end_ms, text in index.search(
+                args.phrase, args.speaker, args.files, args.limit
+            ):
+                times = "--"
+                if start_ms is not None:
+                    times = (
+                        f"{format_timestamp(start_ms, True)} --> "
+                        f"{format_timestamp(end_ms, True)}"
+                    )
+                print(f"{path}  {times}  {speaker}: {text}")
@@ -0,0 +1,167 @@
+import json
+import os
+
+FORMATS = ("txt", "srt", "vtt", "json", "tsv")
+DEFAULT_FORMATS = ("txt", "srt")
+
+# .txt and .srt keep the BOM they always had, editors on Windows rely on it
+ENCODINGS = {"txt": "utf-8-sig", "srt": "utf-8-sig"}
+
+
+def _clock(milliseconds):
+    seconds, milliseconds = divmod(int(milliseconds), 1000)
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    return hours, minutes, seconds, milliseconds
+
+
+def srt_timestamp(milliseconds):
+    return "%02d:%02d:%02d,%03d" % _clock(milliseconds)
+
+
+def vtt_timestamp(milliseconds):
+    return "%02d:%02d:%02d.%03d" % _clock(milliseconds)
+
+
+class TxtWriter:
+    """Speaker-aware transcript, one paragraph per speaker turn."""
+
+    def __init__(self, stream, language=None):
+        self.stream = stream
+
+    def write(self, i, sentence):
+        self.stream.write(f"\n\n{sentence['speaker']}: {sentence['text']}")
+
+    def close(self):
+        pass
+
+
+class SrtWriter(TxtWriter):
+    def write(self, i, sentence):
+        self.stream.write(
+            f"{i}\n"
+            f"{srt_timestamp(sentence['start_time'])} --> "
+            f"{srt_timestamp(sentence['end_time'])}\n"
+            f"{sentence['speaker']}: "
+            f"{sentence['text'].strip().replace('-->', '->')}\n\n"
+        )
+
+
+class VttWriter(TxtWriter):
+    """WebVTT cues with the speaker as voice tag, e.g. <v Speaker 0>."""
+
+    def __init__(self, stream, language=None):
+        super().__init__(stream)
+        self.stream.write("WEBVTT\n\n")
+
+    def write(self, i, sentence):
+        self.stream.write(
+            f"{vtt_timestamp(sentence['start_time'])} --> "
+            f"{vtt_timestamp(sentence['end_time'])}\n"
+            f"<v {sentence['speaker']}>"
+            f"{sentence['text'].strip().replace('-->', '->')}\n\n"
+        )
+
+
+class TsvWriter(TxtWriter):
+    """Start and end in milliseconds, speaker and text of every turn."""
+
+    def __init__(self, stream, language=None):
+        super().__init__(stream)
+        self.stream.write("start\tend\tspeaker\ttext\n")
+
+    def write(self, i, sentence):
+        text = " ".join(sentence["text"].split())
+        self.stream.write(
+            f"{int(sentence['start_time'])}\t{int(sentence['end_time'])}\t"
+            f"{sentence['speaker']}\t{text}\n"
+        )
+
+
+class JsonWriter(TxtWriter):
+    """
+    {"language", "segments"} where segments is the sentence mapping, with
+    the words of every turn when the mapping has them. The segments are
+    written one per line as they come instead of dumping the whole document.
+    """
+
+    def __init__(self, stream, language=None):
+        super().__init__(stream)
+        self.stream.write(f'{{"language": {json.dumps(language)}, "segments": [')
+        self.separator = "\n"
+
+    def write(self, i, sentence):
+        segment = {
+            "speaker": sentence["speaker"],
+            "start_time": int(sentence["start_time"]),
+            "end_time": int(sentence["end_time"]),
+            "text": sentence["text"].strip(),
+        }
+        if "words" in sentence:
+            segment["words"] = sentence["words"]
+        self.stream.write(self.separator + json.dumps(segment, ensure_ascii=False))
+        self.separator = ",\n"
+
+    def close(self):
+        self.stream.write("\n]}\n")
+
+
+WRITERS = {
+    "txt": TxtWriter,
+    "srt": SrtWriter,
+    "vtt": VttWriter,
+    "json": JsonWriter,
+    "tsv": TsvWriter,
+}
+
+
+def render_transcripts(sentences_speaker_mapping, streams, language=None):
+    """
+    Write the sentence mapping to {format: stream} in a single pass, so a
+    streaming sentence mapping is never materialized.
+    """
+    unknown = set(streams) - set(WRITERS)
+    if unknown:
+        raise ValueError(f"unknown transcript formats: {', '.join(sorted(unknown))}")
+    writers = [WRITERS[fmt](stream, language) for fmt, stream in streams.items()]
+    for i, sentence_dict in enumerate(sentences_speaker_mapping, start=1):
+        for writer in writers:
+            writer.write(i, sentence_dict)
+    for writer in writers:
+        writer.close()
+
+
+def write_transcript_files(
+    sentences_speaker_mapping,
+    base_path,
+    formats=DEFAULT_FORMATS,
+    language=None,
+    buffer_size=1 << 20,
+):
+    """
+    Write base_path.<format> for every format and return their paths.
+
+    Each file is written through a large buffer to a temporary file that is
+    renamed over the final one once every format is complete, so readers never
+    see a partial transcript and a failed run leaves the previous files intact.
+    """
+    paths = {fmt: f"{base_path}.{fmt}" for fmt in formats}
+    streams = {}
+    try:
+        for fmt, path in paths.items():
+            streams[fmt] = open(
+                path + ".tmp",
+                "w",
+                encoding=ENCODINGS.get(fmt, "utf-8"),
+                buffering=buffer_size,
+            )
+        render_transcripts(sentences_speaker_mapping, streams, language)
+    except BaseException:
+        for fmt, stream in streams.items():
+            stream.close()
+            os.remove(paths[fmt] + ".tmp")
+        raise
+    for fmt, stream in streams.items():
+        stream.close()
+        os.replace(paths[fmt] + ".tmp", paths[fmt])
+    return paths
@@ -0,0 +1,174 @@
+import hashlib
+import json
+import os
+import numpy as np
+
+VAD_METHODS = ("energy", "nemo")
+
+
+def energy_speech_regions(
+    signal,
+    sample_rate,
+    frame_seconds=0.03,
+    threshold_db=15.0,
+    min_speech=0.25,
+    min_silence=0.6,
+):
+    """
+    Returns the [start, end] seconds of the audible regions of a mono signal.
+
+    A 30 ms frame is audible when it is threshold_db above the noise floor,
+    the 10th percentile of the frame energies, and above -55 dBFS. Pauses
+    shorter than min_silence are bridged and regions shorter than min_speech
+    dropped. Music beds pass as speech, --stem-mode separation removes them.
+    """
+    frame = int(frame_seconds * sample_rate)
+    num_frames = len(signal) // frame
+    if not num_frames:
+        return np.empty((0, 2))
+    rms = np.sqrt(
+        np.mean(
+            np.square(signal[: num_frames * frame].reshape(num_frames, frame)), axis=1
+        )
+    )
+    db = 20 * np.log10(np.maximum(rms, 1e-10))
+    audible = db > max(np.percentile(db, 10) + threshold_db, -55.0)
+
+    # frame indices where audible regions start and end
+    edges = np.diff(np.concatenate([[0], audible.astype(np.int8), [0]]))
+    starts = np.flatnonzero(edges == 1) * frame_seconds
+    ends = np.flatnonzero(edges == -1) * frame_seconds
+    return merge_regions(np.stack([starts, ends], axis=1), min_silence, min_speech)
+
+
+def merge_regions(regions, min_silence=0.6, min_speech=0.25):
+    """Bridges the gaps shorter than min_silence, then drops short regions."""
+    regions = np.asarray(regions, dtype=np.float64).reshape(-1, 2)
+    if not len(regions):
+        return regions
+    regions = regions[np.argsort(regions[:, 0])]
+    # a region starts a new group when it begins min_silence after every
+    # region before it ended
+    previous_end = np.maximum.accumulate(regions[:, 1])[:-1]
+    new_group = np.concatenate([[True], regions[1:, 0] - previous_end >= min_silence])
+    merged = np.stack(
+        [
+            regions[new_group, 0],
+            np.maximum.reduceat(regions[:, 1], np.flatnonzero(new_group)),
+        ],
+        axis=1,
+    )
+    return merged[merged[:, 1] - merged[:, 0] >= min_speech]
+
+
+def nemo_speech_regions(nemo_out_dir, audio_path, speaker_ts=None):
+    """
+    Returns the speech regions NeMo's VAD found in audio_path while
+    diarizing, from nemo_outputs/vad_outputs/vad_out.json. When that file is
+    gone, e.g. the RTTM came from the stage cache, the speaker turns of
+    speaker_ts are used instead, they only cover what the VAD kept.
+    """
+    vad_path = os.path.join(nemo_out_dir, "vad_outputs", "vad_out.json")
+    regions = []
+    if os.path.exists(vad_path):
+        audio_path = os.path.abspath(audio_path)
+        with open(vad_path) as f:
+            for line in f:
+                entry = json.loads(line)
+                if os.path.abspath(entry["audio_filepath"]) == audio_path:
+                    regions.append(
+                        [entry["offset"], entry["offset"] + entry["duration"]]
+                    )
+    elif speaker_ts is not None:
+        regions = np.stack([speaker_ts.starts, speaker_ts.ends], axis=1) / 1000
+    else:
+        raise FileNotFoundError(f"{vad_path} doesn't exist")
+    return merge_regions(regions, min_silence=0.0, min_speech=0.0)
+
+
+class SpeechMap:
+    """
+    Speech regions of a recording cut out and joined into one shorter
+    signal, and the offset map between the two timelines.
+
+    The regions are padded by pad seconds so word edges aren't clipped, and
+    joined with gap seconds of silence so Whisper and the alignment model
+    don't run words of separate regions together.
+    """
+
+    def __init__(self, regions, duration, pad=0.2, gap=0.3):
+        regions = np.asarray(regions, dtype=np.float64).reshape(-1, 2)
+        regions = np.clip(regions + [-pad, pad], 0.0, duration)
+        regions = merge_regions(regions, min_silence=gap, min_speech=0.0)
+        self.starts = regions[:, 0]
+        self.durations = regions[:, 1] - regions[:, 0]
+        self.gap = gap
+        # where each region starts in the joined signal
+        self.gated_starts = np.concatenate(
+            [[0.0], np.cumsum(self.durations + gap)[:-1]]
+        )
+        self.duration = duration
+
+    @property
+    def speech_seconds(self):
+        return float(self.durations.sum())
+
+    def key(self):
+        """
+        Digest of the regions and the gap, the joined signal only depends on
+        them and the recording, so it can key the stages computed from it.
+        """
+        return hashlib.sha256(
+            np.concatenate([self.starts, self.durations, [self.gap]]).round(3).tobytes()
+        ).hexdigest()
+
+    def gate(self, samples, sample_rate):
+        """The speech regions of samples joined into one float32 array."""
+        silence = np.zeros(int(self.gap * sample_rate), dtype=np.float32)
+        pieces = []
+        for start, duration in zip(self.starts, self.durations):
+            first = int(round(start * sample_rate))
+            pieces.append(
+                np.asarray(
+                    samples[first : first + int(round(duration * sample_rate))],
+                    dtype=np.float32,
+                )
+            )
+            pieces.append(silence)
+        if not pieces:
+            return np.zeros(0, dtype=np.float32)
+        return np.concatenate(pieces[:-1])
+
+    def to_original(self, times):
+        """
+        Maps seconds of the joined signal back to the recording. Times in a
+        gap between two regions stick to the end of the region before it.
+        """
+        times = np.asarray(times, dtype=np.float64)
+        if not len(self.starts):
+            return times
+        region = np.maximum(
+            np.searchsorted(self.gated_starts, times, side="right") - 1, 0
+        )
+        offset = np.clip(times - self.gated_starts[region], 0.0, self.durations[region])
+        return self.starts[region] + offset
+
+    def restore_timestamps(self, segments):
+        """
+        Returns copies of Whisper segments or whisperx word segments with
+        their start and end mapped back to the recording. An end is kept in
+        the region of its start, a word is never stretched over a silence.
+        """
+        if not segments or not len(self.starts):
+            return [dict(segment) for segment in segments]
+        starts = np.array([segment["start"] for segment in segments], dtype=np.float64)
+        ends = np.array([segment["end"] for segment in segments], dtype=np.float64)
+        region = np.maximum(
+            np.searchsorted(self.gated_starts, starts, side="right") - 1, 0
+        )
+        ends = np.minimum(ends, self.gated_starts[region] + self.durations[region])
+        starts, ends = self.to_original(starts), self.to_original(ends)
+        return [
+            {**segment, "start": float(start), "end": float(end)}
+            for segment, start, end in zip(segments, starts, ends)
+        ]